@@ -0,0 +1,121 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare loading the serialized adblock shards by copy and by mmap.
+
+Each measure is done in a fresh python process, to get a cold start of the
+_adblock extension. Several processes are run at the same time to mimic
+multiple webmacs instances, and the proportional set size (Pss) of each is
+reported: with mmap, the shard pages are shared between the processes.
+
+Usage::
+
+  python benchmarks/adblock_load.py [--shards ~/.webmacs/adblock/shards]
+                                    [--instances 4] [--runs 5]
+
+Linux only, as memory is read from /proc.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import json
+
+
+CHILD = r"""
+import json, sys, time
+
+def mem():
+    res = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                res[key] = int(value.split()[0])
+    return res
+
+from _adblock import AdBlock
+
+before = mem()
+adblock = AdBlock()
+start = time.perf_counter()
+ok = all(adblock.load(path, use_mmap=sys.argv[1] == "mmap")
+         for path in sys.argv[2:])
+elapsed = time.perf_counter() - start
+# touch the rules, as a real instance would do
+adblock.matches("https://example.com/ads/banner.gif", "example.com")
+after = mem()
+
+print(json.dumps({"ok": ok, "time": elapsed, "before": before,
+                  "after": after}), flush=True)
+# keep the process (and its mapping) alive until the parent is done
+sys.stdin.read()
+"""
+
+
+def run_instances(shards, mode, instances):
+    procs = [subprocess.Popen([sys.executable, "-c", CHILD, mode] + shards,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              universal_newlines=True)
+             for _ in range(instances)]
+    # wait for every process to have loaded the cache before reading the
+    # memory of the last one, so that sharing is taken into account.
+    results = [json.loads(p.stdout.readline()) for p in procs]
+    with open("/proc/%d/smaps_rollup" % procs[-1].pid) as f:
+        pss = [int(line.split()[1]) for line in f if line.startswith("Pss:")]
+    for p in procs:
+        p.communicate("")
+    if not all(r["ok"] for r in results):
+        raise RuntimeError("Unable to load %s" % shards)
+    return results, pss[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--shards", default=os.path.expanduser(
+        "~/.webmacs/adblock/shards"),
+        help="directory of the serialized shards")
+    parser.add_argument("--instances", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=5)
+    opts = parser.parse_args()
+
+    shards = [os.path.join(opts.shards, f) for f in os.listdir(opts.shards)
+              if f.endswith(".dat")]
+    print("%d shards: %.1f MiB" % (
+        len(shards), sum(os.path.getsize(f) for f in shards) / 1024 / 1024))
+    print("%-5s %12s %14s %14s %14s"
+          % ("mode", "load (ms)", "RssAnon (KiB)", "RssFile (KiB)",
+             "Pss (KiB)"))
+    for mode in ("copy", "mmap"):
+        times, anon, file_, pss = [], [], [], []
+        for _ in range(opts.runs):
+            results, last_pss = run_instances(shards, mode,
+                                              opts.instances)
+            times.extend(r["time"] for r in results)
+            anon.extend(r["after"]["RssAnon"] - r["before"]["RssAnon"]
+                        for r in results)
+            file_.extend(r["after"]["RssFile"] - r["before"]["RssFile"]
+                         for r in results)
+            pss.append(last_pss)
+        print("%-5s %12.2f %14d %14d %14d" % (
+            mode, statistics.median(times) * 1000, statistics.median(anon),
+            statistics.median(file_), statistics.median(pss)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Offline benchmark and regression suite for the _adblock extension.
+
+A synthetic EasyList-like rule set and a corpus of requests (url, first
+party host and resource type) are generated from a fixed seed, so the
+suite needs no network access and always runs on the same data. It
+reports:
+
+- the parse, serialize (save) and deserialize (load) times, and the size
+  of the serialized data,
+- the number of matches per second and the p50/p99 latency of a match,
+  with the verdict cache disabled,
+- the cache hit rate and size when replaying the corpus twice with the
+  cache enabled.
+
+The verdicts are then compared to the golden file
+(benchmarks/adblock_golden.json), the verdicts recorded by running the
+engine with --regenerate. It must only be regenerated after reviewing a
+deliberate change of behavior: the corpus is built so that the verdict of
+each request is known, and the verdicts that differ from it are displayed
+when regenerating. Without a golden file, the verdicts are compared to
+those expected by the corpus.
+
+Usage::
+
+  python benchmarks/adblock_suite.py [--json RESULTS] [--regenerate]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from _adblock import AdBlock
+from webmacs.adblock import resource_type_option
+
+
+SEED = 20190915
+NB_RULES = 20000
+NB_REQUESTS = 20000
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "adblock_golden.json")
+
+WORDS = ("news", "shop", "mail", "video", "blog", "wiki", "maps", "docs",
+         "forum", "music", "sport", "games", "photo", "cloud", "travel")
+TLDS = ("com", "org", "net", "io", "fr", "de")
+RESOURCE_TYPES = (
+    "ResourceTypeScript", "ResourceTypeImage", "ResourceTypeStylesheet",
+    "ResourceTypeXhr", "ResourceTypeSubFrame", "ResourceTypeFontResource",
+    "ResourceTypeMedia",
+)
+
+
+def generate_rules(rnd, count):
+    """
+    Generate an EasyList-like list. Returns the list text and the rules
+    grouped by kind, used to build requests with a known verdict.
+    """
+    lines = ["[Adblock Plus 2.0]", "! Title: webmacs synthetic list",
+             "! Generated with seed %d" % SEED]
+    kinds = {"host": [], "exception": set(), "path": [], "third_party": [],
+             "script": [], "domain": []}
+    for i in range(count):
+        kind = rnd.random()
+        if kind < 0.35:
+            host = "ads%d.adserver-%s.%s" % (i, rnd.choice(WORDS),
+                                             rnd.choice(TLDS))
+            lines.append("||%s^" % host)
+            kinds["host"].append(host)
+            if rnd.random() < 0.1:
+                # an exception for a part of the blocked host
+                lines.append("@@||%s/allowed/" % host)
+                kinds["exception"].add(host)
+        elif kind < 0.55:
+            path = "/ad-banner-%d." % i
+            lines.append(path)
+            kinds["path"].append(path)
+        elif kind < 0.7:
+            host = "tracker%d.%s" % (i, rnd.choice(TLDS))
+            lines.append("||%s^$third-party" % host)
+            kinds["third_party"].append(host)
+        elif kind < 0.8:
+            host = "cdn%d.%s" % (i, rnd.choice(TLDS))
+            lines.append("||%s^$script" % host)
+            kinds["script"].append(host)
+        elif kind < 0.9:
+            host = "widget%d.%s" % (i, rnd.choice(TLDS))
+            site = "site%d.%s" % (i, rnd.choice(TLDS))
+            lines.append("||%s^$domain=%s" % (host, site))
+            kinds["domain"].append((host, site))
+        elif kind < 0.97:
+            # cosmetic filters have no effect on network requests
+            lines.append("##.ad-slot-%d" % i)
+        else:
+            lines.append("! comment %d" % i)
+    return "\n".join(lines) + "\n", kinds
+
+
+def random_site(rnd):
+    return "www.%s%d.%s" % (rnd.choice(WORDS), rnd.randrange(1000),
+                            rnd.choice(TLDS))
+
+
+def random_path(rnd):
+    return "/%s/%d/%s.%s" % (rnd.choice(WORDS), rnd.randrange(10000),
+                             rnd.choice(WORDS),
+                             rnd.choice(("js", "png", "css", "html")))
+
+
+def generate_requests(rnd, kinds, count):
+    """
+    Generate requests as (url, first party host, resource type, expected
+    verdict) tuples. About half of the requests are not matched by any
+    rule.
+    """
+    requests = []
+    for _ in range(count):
+        first_party = random_site(rnd)
+        rtype = rnd.choice(RESOURCE_TYPES)
+        kind = rnd.random()
+        if kind < 0.5:
+            url = "https://%s%s" % (first_party, random_path(rnd))
+            expected = False
+        elif kind < 0.6:
+            host = rnd.choice(kinds["host"])
+            if rnd.random() < 0.2:
+                # the separator (^) does not match a longer domain
+                url = "https://%s.example%s" % (host, random_path(rnd))
+                expected = False
+            elif host in kinds["exception"] and rnd.random() < 0.5:
+                url = "https://%s/allowed%s" % (host, random_path(rnd))
+                expected = False
+            else:
+                url = "https://%s%s" % (host, random_path(rnd))
+                expected = True
+        elif kind < 0.7:
+            path = rnd.choice(kinds["path"])
+            url = "https://%s/img%spng" % (random_site(rnd), path)
+            expected = True
+        elif kind < 0.8:
+            host = rnd.choice(kinds["third_party"])
+            if rnd.random() < 0.3:
+                first_party = host
+                expected = False
+            else:
+                expected = True
+            url = "https://%s/collect?id=%d" % (host, rnd.randrange(10**6))
+        elif kind < 0.9:
+            host = rnd.choice(kinds["script"])
+            rtype = rnd.choice(("ResourceTypeScript", "ResourceTypeImage"))
+            expected = rtype == "ResourceTypeScript"
+            url = "https://%s/lib/%s.js" % (host, rnd.choice(WORDS))
+        else:
+            host, site = rnd.choice(kinds["domain"])
+            if rnd.random() < 0.5:
+                first_party = site
+                expected = True
+            else:
+                expected = False
+            url = "https://%s/embed.js" % host
+        requests.append((url, first_party, rtype, expected))
+    return requests
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run_matches(adblock, requests):
+    verdicts, timings = [], []
+    for url, first_party, option, _ in requests:
+        start = time.perf_counter()
+        verdict = adblock.matches(url, first_party, option)
+        timings.append(time.perf_counter() - start)
+        verdicts.append(verdict)
+    return verdicts, timings
+
+
+def corpus_digest(rules, requests):
+    h = hashlib.sha1(rules.encode("utf-8"))
+    for url, first_party, rtype, _ in requests:
+        h.update(("%s %s %s\n" % (url, first_party, rtype)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def encode_verdicts(verdicts):
+    bits = "".join("1" if v else "0" for v in verdicts)
+    return "%x" % int("1" + bits, 2)
+
+
+def decode_verdicts(value):
+    return [b == "1" for b in bin(int(value, 16))[3:]]
+
+
+def benchmark(rules, requests):
+    results = {}
+    adblock = AdBlock()
+    _, results["parse_s"] = timed(adblock.parse, rules.encode("utf-8"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "rules.dat")
+        ok, results["serialize_s"] = timed(adblock.save, path)
+        if not ok:
+            raise IOError("Unable to save %s" % path)
+        results["serialized_bytes"] = os.path.getsize(path)
+        for use_mmap in (False, True):
+            loaded = AdBlock()
+            ok, duration = timed(lambda: loaded.load(path, use_mmap=use_mmap))
+            if not ok:
+                raise IOError("Unable to load %s" % path)
+            results["deserialize_%s_s" % ("mmap" if use_mmap else "copy")] \
+                = duration
+
+    # the options as given by the url interceptor
+    requests = [(url, first_party, resource_type_option(rtype), expected)
+                for url, first_party, rtype, expected in requests]
+
+    adblock.set_cache_size(0)
+    verdicts, timings = run_matches(adblock, requests)
+    results["matches_per_s"] = len(timings) / sum(timings)
+    results["match_p50_us"] = percentile(timings, 50) * 1e6
+    results["match_p99_us"] = percentile(timings, 99) * 1e6
+
+    adblock.set_cache_size(len(requests))
+    adblock.reset_stats()
+    run_matches(adblock, requests)
+    _, cached_timings = run_matches(adblock, requests)
+    stats = adblock.stats()
+    results["cache_hit_rate"] = stats["hits"] / (stats["hits"]
+                                                 + stats["misses"])
+    results["cache_size"] = stats["cache_size"]
+    results["cached_match_p99_us"] = percentile(cached_timings, 99) * 1e6
+    return results, verdicts
+
+
+def show_mismatches(title, requests, verdicts, expected, show):
+    mismatches = [(req, verdict) for req, verdict, exp
+                  in zip(requests, verdicts, expected) if verdict != exp]
+    print("\n%s: %d/%d match"
+          % (title, len(requests) - len(mismatches), len(requests)))
+    for (url, first_party, rtype, _), verdict in mismatches[:show]:
+        print("  %s %-24s %s (from %s)" % (
+            "+block" if verdict else "-block", rtype, url, first_party))
+    return not mismatches
+
+
+def check_golden(golden, digest, requests, verdicts, show):
+    if golden["corpus"] != digest:
+        print("\nthe corpus does not match the golden file, regenerate it"
+              " with --regenerate")
+        return False
+    return show_mismatches("golden verdicts", requests, verdicts,
+                           decode_verdicts(golden["verdicts"]), show)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--json",
+                        help="write the measures in this json file")
+    parser.add_argument("--regenerate", action="store_true",
+                        help="record the verdicts of the engine in the"
+                        " golden file")
+    parser.add_argument("--show", type=int, default=10,
+                        help="number of verdict mismatches to display")
+    opts = parser.parse_args()
+
+    rnd = random.Random(SEED)
+    rules, kinds = generate_rules(rnd, NB_RULES)
+    requests = generate_requests(rnd, kinds, NB_REQUESTS)
+    digest = corpus_digest(rules, requests)
+
+    results, verdicts = benchmark(rules, requests)
+    print("%d rules, %d requests (%d expected blocked)" % (
+        NB_RULES, len(requests), sum(r[3] for r in requests)))
+    for key, value in results.items():
+        print("%-22s %14.6g" % (key, value))
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if opts.regenerate:
+        # to be reviewed before committing the golden file
+        show_mismatches("expected verdicts of the corpus", requests,
+                        verdicts, [r[3] for r in requests], opts.show)
+        with open(GOLDEN, "w") as f:
+            json.dump({"seed": SEED, "corpus": digest,
+                       "verdicts": encode_verdicts(verdicts)}, f, indent=2)
+            f.write("\n")
+        print("\ngolden file regenerated: %s" % GOLDEN)
+        return
+
+    try:
+        with open(GOLDEN) as f:
+            golden = json.load(f)
+    except FileNotFoundError:
+        print("\nno golden file (see --regenerate), using the expected"
+              " verdicts of the corpus")
+        ok = show_mismatches("expected verdicts of the corpus", requests,
+                             verdicts, [r[3] for r in requests], opts.show)
+    else:
+        ok = check_golden(golden, digest, requests, verdicts, opts.show)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
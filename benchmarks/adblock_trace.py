@@ -0,0 +1,116 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Replay a recorded request trace against the ad-blocker, with and without
+the request context (resource type).
+
+A trace can be recorded by setting the *adblock-trace-file* variable in
+webmacs, then browsing. Each line is a json object with the "url",
+"first_party" (host) and "resource_type" (Qt resource type name) keys.
+
+Usage::
+
+  python benchmarks/adblock_trace.py TRACE [--shards DIR | --rules FILE...]
+
+The verdict cache is disabled, so the lookup time is the time spent in the
+engine for each request.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+from _adblock import AdBlock, FONoFilterOption
+from webmacs.adblock import resource_type_option
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(adblock, trace, with_context):
+    verdicts, timings = [], []
+    for req in trace:
+        option = (resource_type_option(req["resource_type"])
+                  if with_context else FONoFilterOption)
+        start = time.perf_counter()
+        verdict = adblock.matches(req["url"], req["first_party"], option)
+        timings.append(time.perf_counter() - start)
+        verdicts.append(verdict)
+    return verdicts, timings
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("trace")
+    parser.add_argument("--shards", default=os.path.expanduser(
+        "~/.webmacs/adblock/shards"),
+        help="directory of the serialized shards")
+    parser.add_argument("--rules", nargs="*",
+                        help="adblock list files to parse instead of using"
+                        " the shards")
+    parser.add_argument("--show", type=int, default=10,
+                        help="number of changed verdicts to display")
+    opts = parser.parse_args()
+
+    adblock = AdBlock()
+    if opts.rules:
+        for path in opts.rules:
+            with open(path, "rb") as f:
+                adblock.parse(f.read().decode("utf-8"))
+    else:
+        for fname in os.listdir(opts.shards):
+            path = os.path.join(opts.shards, fname)
+            if not adblock.load(path):
+                parser.error("Unable to load %s" % path)
+    adblock.set_cache_size(0)
+
+    trace = load_trace(opts.trace)
+    print("%d requests" % len(trace))
+    print("%-12s %8s %8s %10s %10s %10s" % (
+        "mode", "blocked", "allowed", "mean (us)", "p50 (us)", "p99 (us)"))
+    results = {}
+    for mode, with_context in (("no context", False), ("context", True)):
+        verdicts, timings = replay(adblock, trace, with_context)
+        results[mode] = verdicts
+        blocked = sum(verdicts)
+        print("%-12s %8d %8d %10.2f %10.2f %10.2f" % (
+            mode, blocked, len(verdicts) - blocked,
+            statistics.mean(timings) * 1e6,
+            percentile(timings, 50) * 1e6,
+            percentile(timings, 99) * 1e6))
+
+    changed = [(req, ctx) for req, no_ctx, ctx
+               in zip(trace, results["no context"], results["context"])
+               if no_ctx != ctx]
+    newly_blocked = sum(1 for _, ctx in changed if ctx)
+    print("\nwith context: %d newly blocked, %d newly allowed"
+          % (newly_blocked, len(changed) - newly_blocked))
+    for req, ctx in changed[:opts.show]:
+        print("  %s %-24s %s" % ("+block" if ctx else "-block",
+                                 req["resource_type"], req["url"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -16,26 +16,175 @@
 #include <Python.h>
 #include "structmember.h"
 
+#include <atomic>
+#include <chrono>
 #include <iostream>
 #include <fstream>
+#include <list>
+#include <mutex>
+#include <new>
+#include <shared_mutex>
+#include <string>
+#include <unordered_map>
+#include <unordered_set>
+#include <utility>
+#include <vector>
+
+#include <fcntl.h>
+#include <stdio.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
 
 #include "ad_block_client.h"
 
 using namespace std;
 
+
+/* A bounded LRU cache of match verdicts, keyed by the url and the first
+   party host. Thread safe. */
+class VerdictCache {
+ public:
+  explicit VerdictCache(size_t capacity) : capacity_(capacity) {}
+
+  bool get(const string & key, bool * verdict) {
+    lock_guard<mutex> guard(lock_);
+    auto it = index_.find(key);
+    if (it == index_.end()) {
+      return false;
+    }
+    // move the entry in front, as the most recently used
+    entries_.splice(entries_.begin(), entries_, it->second);
+    *verdict = it->second->second;
+    return true;
+  }
+
+  void put(const string & key, bool verdict) {
+    lock_guard<mutex> guard(lock_);
+    if (capacity_ == 0 || index_.count(key)) {
+      return;
+    }
+    entries_.emplace_front(key, verdict);
+    index_[key] = entries_.begin();
+    shrink();
+  }
+
+  void clear() {
+    lock_guard<mutex> guard(lock_);
+    entries_.clear();
+    index_.clear();
+  }
+
+  void set_capacity(size_t capacity) {
+    lock_guard<mutex> guard(lock_);
+    capacity_ = capacity;
+    shrink();
+  }
+
+  size_t capacity() {
+    lock_guard<mutex> guard(lock_);
+    return capacity_;
+  }
+
+  size_t size() {
+    lock_guard<mutex> guard(lock_);
+    return index_.size();
+  }
+
+ private:
+  typedef list<pair<string, bool>> Entries;
+
+  void shrink() {
+    while (index_.size() > capacity_) {
+      index_.erase(entries_.back().first);
+      entries_.pop_back();
+    }
+  }
+
+  size_t capacity_;
+  Entries entries_;
+  unordered_map<string, Entries::iterator> index_;
+  mutex lock_;
+};
+
+
+struct MatchStats {
+  atomic<unsigned long long> hits{0};
+  atomic<unsigned long long> misses{0};
+  // nanoseconds spent in matches() calls, GIL excluded
+  atomic<unsigned long long> total_ns{0};
+  // nanoseconds spent in the ad block client on cache misses
+  atomic<unsigned long long> engine_ns{0};
+};
+
+
+#define DEFAULT_CACHE_SIZE 8192
+
+/* Rules deserialized from a file. The client keeps pointers into the
+   buffer, so it must live as long as the client. The buffer is either
+   allocated with new[] or mapped from the file. */
+struct Shard {
+  AdBlockClient * client;
+  char * data;
+  size_t data_size;
+  bool data_mapped;
+};
+
 typedef struct {
   PyObject_HEAD
 
+  /* rules given to parse() */
   AdBlockClient * client;
-  char * data;
+  /* the exception rules given to parse(), see exception_rules(). NULL
+     if there is none. */
+  AdBlockClient * exceptions;
+  /* rules given to load(), one client per file */
+  vector<Shard> * shards;
+  /* exception rules given to load(exceptions=True), one client per
+     file */
+  vector<Shard> * exception_shards;
+  /* matches() takes it shared, anything modifying the rules takes it
+     exclusively. It is always acquired without holding the GIL. */
+  shared_timed_mutex * rules_lock;
+  VerdictCache * cache;
+  MatchStats * stats;
 } AdBlock;
 
 
+static void
+free_data(char * data, size_t size, bool mapped)
+{
+  if (!data) return;
+  if (mapped) {
+    munmap(data, size);
+  } else {
+    delete[] data;
+  }
+}
+
+static void
+free_shards(vector<Shard> * shards)
+{
+  /* NULL if tp_init was not called */
+  if (!shards) return;
+  for (Shard & shard : *shards) {
+    delete shard.client;
+    free_data(shard.data, shard.data_size, shard.data_mapped);
+  }
+  delete shards;
+}
+
 static void
 AdBlock_dealloc(AdBlock* self)
 {
   delete self->client;
-  if (self->data) delete[] self->data;
+  delete self->exceptions;
+  free_shards(self->shards);
+  free_shards(self->exception_shards);
+  delete self->rules_lock;
+  delete self->cache;
+  delete self->stats;
   Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -53,39 +202,173 @@ static int
 AdBlock_init(AdBlock *self, PyObject *args, PyObject *kwds)
 {
   self->client = new AdBlockClient;
-  self->data = NULL;
+  self->shards = new vector<Shard>;
+  self->exception_shards = new vector<Shard>;
+  self->rules_lock = new shared_timed_mutex;
+  self->cache = new VerdictCache(DEFAULT_CACHE_SIZE);
+  self->stats = new MatchStats;
   return 0;
 }
 
+/* Rules blocking every url. */
+static const char CATCH_ALL_RULES[] = "|http:\n|https:\n|ws:\n|wss:\n";
+
+/* Returns the exception rules (@@) of adblock data, with the rules
+   blocking every url, or an empty string if there is no exception rule.
+
+   The exception rules of a client only apply to its own blocking rules.
+   So the exception rules of a list are also kept in their own client,
+   which blocks every url but the ones they allow; a url blocked by any
+   list is then allowed if one of these clients does not match it. */
+static string
+exception_rules(const char *data)
+{
+  string rules;
+  const char *p = data;
+  while (*p) {
+    const char *end = strchr(p, '\n');
+    if (!end) end = p + strlen(p);
+    const char *line_end = end;
+    if (line_end > p && line_end[-1] == '\r') line_end--;
+    if (line_end - p > 2 && p[0] == '@' && p[1] == '@') {
+      rules.append(p, line_end - p);
+      rules.push_back('\n');
+    }
+    p = *end ? end + 1 : end;
+  }
+  if (!rules.empty()) {
+    rules.append(CATCH_ALL_RULES);
+  }
+  return rules;
+}
+
 static PyObject *
 AdBlock_parse(AdBlock* self, PyObject *args)
 {
+  PyObject *obj;
   const char *data;
+  char *copy = NULL;
 
-  if (!PyArg_ParseTuple(args, "s", &data))
+  if (!PyArg_ParseTuple(args, "O", &obj))
     return NULL;
 
+  if (PyUnicode_Check(obj)) {
+    data = PyUnicode_AsUTF8(obj);
+    if (!data)
+      return NULL;
+  } else if (PyBytes_Check(obj)) {
+    /* bytes are always NUL terminated, use them without any copy */
+    data = PyBytes_AS_STRING(obj);
+  } else {
+    /* any other buffer (bytearray, memoryview, mmap...) is copied to add
+       the NUL terminator required by the parser. */
+    Py_buffer view;
+    if (PyObject_GetBuffer(obj, &view, PyBUF_SIMPLE) == -1)
+      return NULL;
+    copy = new (nothrow) char[view.len + 1];
+    if (copy) {
+      memcpy(copy, view.buf, view.len);
+      copy[view.len] = '\0';
+    }
+    PyBuffer_Release(&view);
+    if (!copy)
+      return PyErr_NoMemory();
+    data = copy;
+  }
+
+  /* obj is kept alive by the args tuple while the GIL is released */
   Py_BEGIN_ALLOW_THREADS
-  self->client->parse(data);
+  string exceptions = exception_rules(data);
+  {
+    unique_lock<shared_timed_mutex> guard(*self->rules_lock);
+    self->client->parse(data);
+    if (!exceptions.empty()) {
+      if (!self->exceptions) {
+        self->exceptions = new AdBlockClient;
+      }
+      self->exceptions->parse(exceptions.c_str());
+    }
+    /* cleared with the rules lock held, see AdBlock_matches */
+    self->cache->clear();
+  }
   Py_END_ALLOW_THREADS
 
+  delete[] copy;
   Py_RETURN_NONE;
 }
 
+static unsigned long long
+elapsed_ns(chrono::steady_clock::time_point start)
+{
+  return chrono::duration_cast<chrono::nanoseconds>(
+    chrono::steady_clock::now() - start).count();
+}
+
+/* Must be called with the rules lock held. A url is filtered if it
+   matches in any of the clients, and no exception rule (@@) of any list
+   allows it (see exception_rules()). */
+static bool
+client_matches(AdBlock* self, const char *url, FilterOption option,
+               const char *domain)
+{
+  bool blocked = self->client->matches(url, option, domain);
+  for (const Shard & shard : *self->shards) {
+    if (blocked) break;
+    blocked = shard.client->matches(url, option, domain);
+  }
+  if (!blocked) {
+    return false;
+  }
+  if (self->exceptions && !self->exceptions->matches(url, option, domain)) {
+    return false;
+  }
+  for (const Shard & shard : *self->exception_shards) {
+    if (!shard.client->matches(url, option, domain)) {
+      return false;
+    }
+  }
+  return true;
+}
+
 static PyObject *
 AdBlock_matches(AdBlock* self, PyObject *args)
 {
   const char *url, *domain;
+  unsigned int option = FONoFilterOption;
   bool result;
 
-  if (!PyArg_ParseTuple(args, "ss", &url, &domain))
+  if (!PyArg_ParseTuple(args, "ss|I", &url, &domain, &option))
     return NULL;
 
-  /* I suspect that allowing threads here does create deadlocks,
-   but anyway I am not sure it would be useful to allow them. */
-  /* Py_BEGIN_ALLOW_THREADS */
-  result = self->client->matches(url, FONoFilterOption, domain);
-  /* Py_END_ALLOW_THREADS */
+  /* The GIL is released, so the calling thread (the chromium IO thread)
+     does not wait for python. The strings are owned by args, which is
+     kept alive by the caller. Only C++ locks are taken here, never the
+     GIL, so this can not deadlock. */
+  Py_BEGIN_ALLOW_THREADS
+  auto start = chrono::steady_clock::now();
+  string key(url);
+  key.push_back('\0');
+  key.append(domain);
+  key.push_back('\0');
+  key.append(to_string(option));
+
+  if (self->cache->get(key, &result)) {
+    self->stats->hits++;
+  } else {
+    auto engine_start = chrono::steady_clock::now();
+    {
+      shared_lock<shared_timed_mutex> guard(*self->rules_lock);
+      result = client_matches(self, url, (FilterOption)option, domain);
+      /* cached before the rules lock is released: the rules can not
+         change, and the cache be cleared, in between, so a verdict of
+         the previous rules is never cached. */
+      self->cache->put(key, result);
+    }
+    self->stats->engine_ns += elapsed_ns(engine_start);
+    self->stats->misses++;
+  }
+  self->stats->total_ns += elapsed_ns(start);
+  Py_END_ALLOW_THREADS
 
   if (result) {
     Py_RETURN_TRUE;
@@ -94,52 +377,320 @@ AdBlock_matches(AdBlock* self, PyObject *args)
   }
 }
 
+/* Returns true if a cosmetic filter domain list, like
+   "example.com,~ads.example.com", applies to the host. An empty list
+   applies to every host. */
+static bool
+domain_list_matches(const char *domain_list, const string & host)
+{
+  if (!domain_list || !*domain_list) {
+    return true;
+  }
+  bool has_included = false, included = false;
+  const char *p = domain_list;
+  while (*p) {
+    const char *end = strchr(p, ',');
+    if (!end) end = p + strlen(p);
+    bool negated = *p == '~';
+    if (negated) p++;
+    size_t len = end - p;
+    /* the host is the domain itself or one of its subdomains */
+    bool matched = len > 0 && host.size() >= len
+      && host.compare(host.size() - len, len, p, len) == 0
+      && (host.size() == len || host[host.size() - len - 1] == '.');
+    if (negated) {
+      if (matched) return false;
+    } else {
+      has_included = true;
+      included = included || matched;
+    }
+    p = *end ? end + 1 : end;
+  }
+  return included || !has_included;
+}
+
+/* Collects the cosmetic filters of a client. Without a host, the generic
+   filters (without a domain list) are collected. With a host, the filters
+   whose domain list applies to it are collected, and the generic
+   exceptions are added to all_exceptions too, as they also apply to
+   it. */
+static void
+client_cosmetic_selectors(AdBlockClient * client, const string * host,
+                          vector<string> & selectors,
+                          vector<string> & exceptions,
+                          unordered_set<string> & all_exceptions)
+{
+  for (int i = 0; i < client->numCosmeticFilters; i++) {
+    const Filter & filter = client->cosmeticFilters[i];
+    if (!filter.data) {
+      continue;
+    }
+    bool generic = !filter.domainList || !*filter.domainList;
+    bool exception = filter.filterType & FTElementHidingException;
+    if (host && generic) {
+      if (exception) {
+        all_exceptions.insert(filter.data);
+      }
+      continue;
+    }
+    if (host ? !domain_list_matches(filter.domainList, *host) : !generic) {
+      continue;
+    }
+    if (exception) {
+      exceptions.push_back(filter.data);
+      all_exceptions.insert(filter.data);
+    } else if (filter.filterType & FTElementHiding) {
+      selectors.push_back(filter.data);
+    }
+  }
+}
+
+/* Collects the cosmetic filters of every client, see
+   client_cosmetic_selectors. */
+static void
+collect_cosmetic_selectors(AdBlock* self, const string * host,
+                           vector<string> & selectors,
+                           vector<string> & exceptions,
+                           unordered_set<string> & all_exceptions)
+{
+  Py_BEGIN_ALLOW_THREADS
+  {
+    shared_lock<shared_timed_mutex> guard(*self->rules_lock);
+    client_cosmetic_selectors(self->client, host, selectors, exceptions,
+                              all_exceptions);
+    for (const Shard & shard : *self->shards) {
+      client_cosmetic_selectors(shard.client, host, selectors, exceptions,
+                                all_exceptions);
+    }
+  }
+  Py_END_ALLOW_THREADS
+}
+
+/* Returns the list of the selectors, without duplicates nor the excluded
+   ones. */
 static PyObject *
-AdBlock_save(AdBlock* self, PyObject *args)
+selectors_list(const vector<string> & selectors,
+               const unordered_set<string> & excluded)
 {
-  const char *path;
+  PyObject *result = PyList_New(0);
+  if (!result)
+    return NULL;
+  unordered_set<string> seen;
+  for (const string & selector : selectors) {
+    if (excluded.count(selector) || !seen.insert(selector).second) {
+      continue;
+    }
+    PyObject *item = PyUnicode_DecodeUTF8(selector.data(), selector.size(),
+                                          "replace");
+    if (!item || PyList_Append(result, item) == -1) {
+      Py_XDECREF(item);
+      Py_DECREF(result);
+      return NULL;
+    }
+    Py_DECREF(item);
+  }
+  return result;
+}
 
-  if (!PyArg_ParseTuple(args, "s", &path))
+static PyObject *
+AdBlock_generic_cosmetic_selectors(AdBlock* self,
+                                   PyObject *Py_UNUSED(ignored))
+{
+  vector<string> selectors, exceptions;
+  unordered_set<string> all_exceptions;
+  collect_cosmetic_selectors(self, NULL, selectors, exceptions,
+                             all_exceptions);
+  return selectors_list(selectors, all_exceptions);
+}
+
+static PyObject *
+AdBlock_cosmetic_selectors(AdBlock* self, PyObject *args)
+{
+  const char *host_arg;
+
+  if (!PyArg_ParseTuple(args, "s", &host_arg))
+    return NULL;
+
+  string host(host_arg);
+  vector<string> selectors, exceptions;
+  unordered_set<string> all_exceptions;
+  collect_cosmetic_selectors(self, &host, selectors, exceptions,
+                             all_exceptions);
+
+  PyObject *specific = selectors_list(selectors, all_exceptions);
+  if (!specific)
+    return NULL;
+  PyObject *excepted = selectors_list(exceptions, unordered_set<string>());
+  if (!excepted) {
+    Py_DECREF(specific);
     return NULL;
+  }
+  PyObject *result = PyTuple_Pack(2, specific, excepted);
+  Py_DECREF(specific);
+  Py_DECREF(excepted);
+  return result;
+}
+
+/* Must be called without the GIL. */
+static bool
+save_client(AdBlock* self, AdBlockClient * client, const char *path)
+{
+  bool result = false;
+  /* write into a temporary file then rename it, so that any other
+     process having the cache file mapped keeps a valid mapping. */
+  string tmp_path = string(path) + ".tmp." + to_string(getpid());
 
   int size;
-  ofstream outFile(path, ios::out | ios::binary);
-  if (!outFile) {
-    Py_RETURN_FALSE;
+  char * buffer;
+  {
+    shared_lock<shared_timed_mutex> guard(*self->rules_lock);
+    /* keep the cosmetic (element hiding) filters */
+    buffer = client->serialize(&size, false);
+  }
+  ofstream outFile(tmp_path.c_str(), ios::out | ios::binary);
+  if (outFile) {
+    outFile.write(buffer, size);
+    outFile.close();
+    result = !outFile.fail()
+      && rename(tmp_path.c_str(), path) == 0;
+    if (!result) unlink(tmp_path.c_str());
   }
+  delete[] buffer;
+  return result;
+}
+
+static PyObject *
+AdBlock_save(AdBlock* self, PyObject *args)
+{
+  const char *path;
+  bool result;
+
+  if (!PyArg_ParseTuple(args, "s", &path))
+    return NULL;
 
   Py_BEGIN_ALLOW_THREADS
-  char * buffer = self->client->serialize(&size);
-  outFile.write(buffer, size);
-  outFile.close();
+  result = save_client(self, self->client, path);
   Py_END_ALLOW_THREADS
 
-  Py_RETURN_TRUE;
+  if (result) {
+    Py_RETURN_TRUE;
+  } else {
+    Py_RETURN_FALSE;
+  }
 }
 
 static PyObject *
-AdBlock_load(AdBlock* self, PyObject *args)
+AdBlock_save_exceptions(AdBlock* self, PyObject *args)
 {
   const char *path;
-  bool result = false;
+  bool result;
 
   if (!PyArg_ParseTuple(args, "s", &path))
     return NULL;
 
+  if (!self->exceptions) {
+    Py_RETURN_NONE;
+  }
+
+  Py_BEGIN_ALLOW_THREADS
+  result = save_client(self, self->exceptions, path);
+  Py_END_ALLOW_THREADS
+
+  if (result) {
+    Py_RETURN_TRUE;
+  } else {
+    Py_RETURN_FALSE;
+  }
+}
+
+static bool
+read_file(const char *path, char ** data, size_t * size)
+{
   ifstream file(path, ios::binary | ios::ate);
   if (!file) {
-    Py_RETURN_FALSE;
+    return false;
   }
 
-  Py_BEGIN_ALLOW_THREADS
-  streamsize size = file.tellg();
+  streamsize fsize = file.tellg();
+  if (fsize <= 0) {
+    return false;
+  }
   file.seekg(0, ios::beg);
 
-  if (self->data) {delete[] self->data;}
-  self->data = new char[size];
-  if (file.read(self->data, size)) {
-    self->client->deserialize(self->data);
-    result = true;
+  char * buffer = new char[fsize];
+  if (!file.read(buffer, fsize)) {
+    delete[] buffer;
+    return false;
+  }
+  *data = buffer;
+  *size = fsize;
+  return true;
+}
+
+static bool
+map_file(const char *path, char ** data, size_t * size)
+{
+  int fd = open(path, O_RDONLY);
+  if (fd < 0) {
+    return false;
+  }
+
+  struct stat st;
+  if (fstat(fd, &st) < 0 || st.st_size <= 0) {
+    close(fd);
+    return false;
+  }
+
+  /* A private mapping is copy on write: pages that are only read by the
+     deserialized client stay backed by the page cache, and are thus shared
+     between every process mapping the same cache file. The mapping is
+     writable only in case the deserialization patches the buffer. */
+  void * addr = mmap(NULL, st.st_size, PROT_READ | PROT_WRITE, MAP_PRIVATE,
+                     fd, 0);
+  close(fd);
+  if (addr == MAP_FAILED) {
+    return false;
+  }
+  madvise(addr, st.st_size, MADV_WILLNEED);
+
+  *data = (char *)addr;
+  *size = st.st_size;
+  return true;
+}
+
+static PyObject *
+AdBlock_load(AdBlock* self, PyObject *args, PyObject *kwds)
+{
+  static const char *kwlist[] = {"path", "use_mmap", "exceptions", NULL};
+  const char *path;
+  int use_mmap = 1;
+  int exceptions = 0;
+  bool result = false;
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "s|pp", (char **)kwlist,
+                                   &path, &use_mmap, &exceptions))
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  char * data = NULL;
+  size_t size = 0;
+
+  if (use_mmap ? map_file(path, &data, &size)
+      : read_file(path, &data, &size)) {
+    AdBlockClient * client = new AdBlockClient;
+    if (client->deserialize(data)) {
+      Shard shard = {client, data, size, (bool)use_mmap};
+      {
+        unique_lock<shared_timed_mutex> guard(*self->rules_lock);
+        (exceptions ? self->exception_shards : self->shards)
+          ->push_back(shard);
+        self->cache->clear();
+      }
+      result = true;
+    } else {
+      delete client;
+      free_data(data, size, use_mmap);
+    }
   }
   Py_END_ALLOW_THREADS
 
@@ -150,19 +701,102 @@ AdBlock_load(AdBlock* self, PyObject *args)
   }
 }
 
+static PyObject *
+AdBlock_set_cache_size(AdBlock* self, PyObject *args)
+{
+  Py_ssize_t size;
+
+  if (!PyArg_ParseTuple(args, "n", &size))
+    return NULL;
+
+  if (size < 0) {
+    PyErr_SetString(PyExc_ValueError, "cache size must be positive");
+    return NULL;
+  }
+
+  self->cache->set_capacity(size);
+  Py_RETURN_NONE;
+}
+
+static PyObject *
+AdBlock_stats(AdBlock* self, PyObject *Py_UNUSED(ignored))
+{
+  unsigned long long hits = self->stats->hits;
+  unsigned long long misses = self->stats->misses;
+
+  return Py_BuildValue(
+    "{s:K,s:K,s:K,s:K,s:n,s:n,s:n}",
+    "hits", hits,
+    "misses", misses,
+    "total_ns", (unsigned long long)self->stats->total_ns,
+    "engine_ns", (unsigned long long)self->stats->engine_ns,
+    "cache_size", (Py_ssize_t)self->cache->size(),
+    "cache_capacity", (Py_ssize_t)self->cache->capacity(),
+    "shards", (Py_ssize_t)self->shards->size());
+}
+
+static PyObject *
+AdBlock_reset_stats(AdBlock* self, PyObject *Py_UNUSED(ignored))
+{
+  self->stats->hits = 0;
+  self->stats->misses = 0;
+  self->stats->total_ns = 0;
+  self->stats->engine_ns = 0;
+  Py_RETURN_NONE;
+}
+
 
 static PyMethodDef AdBlock_methods[] = {
   {"parse", (PyCFunction)AdBlock_parse, METH_VARARGS,
-   "Parse adblock data string, like the content of an easylist."
+   "Parse adblock data, like the content of an easylist. The data can be"
+   " a string, or a bytes-like object holding the utf-8 encoded rules."
   },
   {"matches", (PyCFunction)AdBlock_matches, METH_VARARGS,
-   "matches an url, returns True if it should be filtered."
+   "matches(url, first_party_host[, option]): returns True if the url"
+   " should be filtered. option is a combination of the FO* constants"
+   " describing the request, like FOScript. The GIL is released, and"
+   " verdicts are cached."
+  },
+  {"generic_cosmetic_selectors",
+   (PyCFunction)AdBlock_generic_cosmetic_selectors, METH_NOARGS,
+   "generic_cosmetic_selectors(): returns the list of css selectors of the"
+   " elements to hide on every host (element hiding rules without domains,"
+   " like ##.ad), generic exceptions (#@#.ad) removed."
+  },
+  {"cosmetic_selectors", (PyCFunction)AdBlock_cosmetic_selectors,
+   METH_VARARGS,
+   "cosmetic_selectors(host): returns a tuple (selectors, exceptions) for"
+   " the given host, in addition to the generic selectors: the css"
+   " selectors of the element hiding rules with domains applying to it"
+   " (like example.com##.ad), exceptions removed, and the selectors excepted"
+   " on it (like example.com#@#.ad)."
   },
   {"save", (PyCFunction)AdBlock_save, METH_VARARGS,
-   "Save serialized data into a file."
+   "Save the rules given to parse() into a file, serialized. Cosmetic"
+   " filters are included."
+  },
+  {"save_exceptions", (PyCFunction)AdBlock_save_exceptions, METH_VARARGS,
+   "Save the exception rules (@@) given to parse() into a file,"
+   " serialized, to be loaded with load(path, exceptions=True). Returns"
+   " None if there is no exception rule."
   },
-  {"load", (PyCFunction)AdBlock_load, METH_VARARGS,
-   "Load serialized data from a file."
+  {"load", (PyCFunction)AdBlock_load, METH_VARARGS | METH_KEYWORDS,
+   "Load serialized data from a file, in addition to the rules already"
+   " loaded or parsed. By default the file is memory mapped, so its"
+   " content is shared between processes. Pass use_mmap=False to read"
+   " it into a private buffer instead. Pass exceptions=True for a file"
+   " written by save_exceptions(): its exception rules then apply to the"
+   " rules of every list."
+  },
+  {"set_cache_size", (PyCFunction)AdBlock_set_cache_size, METH_VARARGS,
+   "Set the maximum number of cached verdicts. 0 disables the cache."
+  },
+  {"stats", (PyCFunction)AdBlock_stats, METH_NOARGS,
+   "Returns a dict of matching statistics: cache hits and misses, and"
+   " the time spent matching in nanoseconds."
+  },
+  {"reset_stats", (PyCFunction)AdBlock_reset_stats, METH_NOARGS,
+   "Reset the matching statistics."
   },
   {NULL}  /* Sentinel */
 };
@@ -233,5 +867,23 @@ PyInit__adblock(void)
 
   Py_INCREF(&AdBlockType);
   PyModule_AddObject(m, "AdBlock", (PyObject *)&AdBlockType);
+
+#define ADD_FILTER_OPTION(name) PyModule_AddIntConstant(m, #name, name)
+  ADD_FILTER_OPTION(FONoFilterOption);
+  ADD_FILTER_OPTION(FOScript);
+  ADD_FILTER_OPTION(FOImage);
+  ADD_FILTER_OPTION(FOStylesheet);
+  ADD_FILTER_OPTION(FOObject);
+  ADD_FILTER_OPTION(FOXmlHttpRequest);
+  ADD_FILTER_OPTION(FOObjectSubrequest);
+  ADD_FILTER_OPTION(FOSubdocument);
+  ADD_FILTER_OPTION(FODocument);
+  ADD_FILTER_OPTION(FOOther);
+  ADD_FILTER_OPTION(FOPing);
+  ADD_FILTER_OPTION(FOFont);
+  ADD_FILTER_OPTION(FOMedia);
+  ADD_FILTER_OPTION(FOWebsocket);
+#undef ADD_FILTER_OPTION
+
   return m;
 }
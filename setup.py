@@ -39,7 +39,7 @@ adblocker = Extension(
     language="c++",
     include_dirs=[bloom_dir, hashset_dir, adblock_dir],
     # not sure if that help for speed. Careful it strip the debug symbols
-    extra_compile_args=["-g0", "-std=c++11"],
+    extra_compile_args=["-g0", "-std=c++14"],
     sources=[
         os.path.join(bloom_dir, "BloomFilter.cpp"),
         os.path.join(bloom_dir, "hashFn.cpp"),
@@ -116,7 +116,7 @@ Some of the features are:
 
 ''',
     packages=find_packages(),
-    install_requires=["dateparser", "jinja2", "pygments"],
+    install_requires=["jinja2", "pygments"],
     entry_points={"console_scripts": ["webmacs = webmacs.main:main"]},
     package_data={"webmacs": [
         "scripts/*.js",
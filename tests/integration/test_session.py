@@ -0,0 +1,50 @@
+from webmacs import BUFFERS
+from webmacs.session import SessionAutosave, BufferPlaceholder, \
+    session_save, session_clean, session_load, session_entries
+from webmacs.session_journal import read_session
+from webmacs.webbuffer import create_buffer
+
+
+def urls(entries):
+    return [e.url().toString() for e in entries]
+
+
+def test_restore_session_with_autosave(session, variables, tmpdir):
+    variables.set("session-autosave-interval", 10)
+    variables.set("session-restore-preload", 0)
+    path = str(tmpdir.join("session.json"))
+    session.load_page("navigation")
+    for page in ("navigation/index.html", "navigation/page1.html"):
+        create_buffer(session.test_page_url(page))
+    saved = urls(BUFFERS)
+    session_save(path)
+
+    autosave = SessionAutosave(path)
+    autosave.start()
+    try:
+        # as the restore-session command does
+        session_clean()
+        session_load(path)
+
+        # only the buffer displayed in the window is created
+        assert len(BUFFERS) == 1
+        assert urls(session_entries()) == saved
+        placeholders = [e for e in session_entries()
+                        if isinstance(e, BufferPlaceholder)]
+        assert len(placeholders) == 2
+
+        buffer = placeholders[1].create()
+        assert BUFFERS[1] is buffer
+        assert session_entries()[2] is buffer
+        placeholders[0].discard()
+        assert urls(session_entries()) == saved[:1] + saved[2:]
+        new = create_buffer(session.test_page_url("navigation/page1.html"))
+        assert session_entries()[2:] == [new]
+
+        # the journal follows the restored session
+        autosave.save()
+        assert [u["url"] for u in read_session(path)["urls"]] \
+            == urls(session_entries())
+    finally:
+        autosave.stop()
+        session_clean()
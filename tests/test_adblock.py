@@ -0,0 +1,66 @@
+import pytest
+
+_adblock = pytest.importorskip("_adblock")
+
+
+def shard(tmpdir, name, rules):
+    adblock = _adblock.AdBlock()
+    adblock.parse(rules)
+    path = str(tmpdir.join(name + ".dat"))
+    assert adblock.save(path)
+    exceptions = str(tmpdir.join(name + "-exceptions.dat"))
+    return path, (exceptions if adblock.save_exceptions(exceptions)
+                  else None)
+
+
+URL = "https://example.com/ad.js"
+
+
+def test_exceptions_apply_to_every_list(tmpdir):
+    blocking = shard(tmpdir, "blocking", "||example.com^\n||example.org^\n")
+    allowing = shard(tmpdir, "allowing", "@@||example.com^\n")
+    assert blocking[1] is None
+
+    adblock = _adblock.AdBlock()
+    assert adblock.load(blocking[0])
+    assert adblock.matches(URL, "example.com")
+
+    assert adblock.load(allowing[0])
+    assert adblock.load(allowing[1], exceptions=True)
+    assert not adblock.matches(URL, "example.com")
+    assert adblock.matches("https://example.org/ad.js", "example.org")
+
+
+def test_parsed_exceptions_apply_to_loaded_lists(tmpdir):
+    blocking = shard(tmpdir, "blocking", "||example.com^\n")
+
+    adblock = _adblock.AdBlock()
+    assert adblock.load(blocking[0])
+    adblock.parse("@@||example.com^\r\n")
+    assert not adblock.matches(URL, "example.com")
+
+
+def test_cosmetic_selectors(tmpdir):
+    generic = shard(tmpdir, "generic", "##.ad\n##.banner\n#@#.gone\n")
+    adblock = _adblock.AdBlock()
+    assert adblock.load(generic[0])
+    adblock.parse("##.ad\n##.gone\nexample.com##.promo\nexample.com##.gone\n"
+                  "example.com#@#.banner\n~sub.example.com,example.com##.y\n")
+
+    # the generic exceptions apply to every list
+    assert adblock.generic_cosmetic_selectors() == [".ad", ".banner"]
+    # only the selectors added or excepted on the host
+    assert adblock.cosmetic_selectors("example.com") \
+        == ([".promo", ".y"], [".banner"])
+    assert adblock.cosmetic_selectors("sub.example.com") \
+        == ([".promo"], [".banner"])
+    assert adblock.cosmetic_selectors("example.org") == ([], [])
+
+
+def test_main_frame_option():
+    adblock = pytest.importorskip("webmacs.adblock", exc_type=ImportError)
+    # the $document rules do not apply to the top-level navigations
+    assert adblock.resource_type_option("ResourceTypeMainFrame") \
+        == _adblock.FONoFilterOption
+    assert adblock.resource_type_option("ResourceTypeSubFrame") \
+        == _adblock.FOSubdocument
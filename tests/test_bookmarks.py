@@ -0,0 +1,18 @@
+from webmacs.bookmarks import Bookmarks
+
+
+def test_search():
+    bookmarks = Bookmarks(":memory:")
+    bookmarks.set("https://github.com/parkouss/webmacs", "webmacs")
+    bookmarks.set("https://docs.python.org", "Python docs")
+    bookmarks.set("https://example.com/100%_sure", None)
+
+    def search(text):
+        return [url for url, _ in bookmarks.search(text)]
+
+    # every word, in any order, in the url or the name
+    assert search("webmacs github") == ["https://github.com/parkouss/webmacs"]
+    assert search("docs python") == ["https://docs.python.org"]
+    assert search("docs github") == []
+    assert search("0%_") == ["https://example.com/100%_sure"]
+    assert len(search("")) == 3
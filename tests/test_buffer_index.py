@@ -0,0 +1,66 @@
+from PyQt6.QtCore import QObject, pyqtSignal as Signal
+
+from webmacs import BUFFERS, BufferIndex, hooks
+
+
+class Buffer(QObject):
+    titleChanged = Signal(str)
+    urlChanged = Signal(object)
+
+    def __init__(self, index, last_use):
+        QObject.__init__(self)
+        self._index = index
+        self.last_use = last_use
+
+    def set_last_use(self, value):
+        self.last_use = value
+        self._index.update_last_use(self)
+
+
+def test_buffer_index(monkeypatch):
+    monkeypatch.setattr(hooks, "webbuffer_created", hooks.Hook())
+    monkeypatch.setattr(hooks, "webbuffer_closed", hooks.Hook())
+    index = BufferIndex()
+    events = []
+    index.buffer_used.connect(lambda b: events.append(("used", b)))
+    index.buffer_changed.connect(lambda b: events.append(("changed", b)))
+
+    def create(last_use):
+        buff = Buffer(index, last_use)
+        BUFFERS.append(buff)
+        hooks.webbuffer_created(buff)
+        return buff
+
+    try:
+        a, b, c = create(1), create(2), create(3)
+        assert index.recent == [c, b, a]
+        assert [index.position(x) for x in (a, b, c)] == [0, 1, 2]
+
+        a.set_last_use(4)
+        assert index.recent == [a, c, b]
+        # already the most recent
+        a.set_last_use(5)
+        assert events == [("used", a)]
+
+        # an older last use (e.g. restored from the session)
+        a.set_last_use(0)
+        assert index.recent == [c, b, a]
+
+        b.titleChanged.emit("title")
+        assert events[-1] == ("changed", b)
+
+        BUFFERS.remove(b)
+        hooks.webbuffer_closed(b)
+        assert index.recent == [c, a]
+        assert index.position(c) == 1
+
+        # inserted in the middle
+        d = Buffer(index, 6)
+        BUFFERS.insert(1, d)
+        hooks.webbuffer_created(d)
+        assert [index.position(x) for x in (a, d, c)] == [0, 1, 2]
+        BUFFERS.remove(a)
+        hooks.webbuffer_closed(a)
+        assert [index.position(x) for x in (d, c)] == [0, 1]
+    finally:
+        del BUFFERS[:]
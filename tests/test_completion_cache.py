@@ -0,0 +1,45 @@
+from webmacs.minibuffer.completion import CompletionCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_ttl():
+    clock = Clock()
+    cache = CompletionCache(maxsize=10, ttl=60, clock=clock)
+    cache.set("a", ["abc", "abd"])
+    assert cache.get("a") == ["abc", "abd"]
+    assert cache.get("b") is None
+
+    # an entry can have its own time to live
+    cache.set("b", ["bcd"], ttl=120)
+    clock.now = 60
+    assert cache.get("a") is None
+    assert cache.get("b") == ["bcd"]
+    # expired entries are removed
+    assert len(cache) == 1
+
+    # a time to live of 0 disables the cache
+    cache.set("c", ["cde"], ttl=0)
+    assert cache.get("c") is None
+
+
+def test_cache_lru():
+    cache = CompletionCache(maxsize=2, clock=Clock())
+    cache.set("a", [1])
+    cache.set("b", [2])
+    # "a" is now the most recently used
+    assert cache.get("a") == [1]
+    cache.set("c", [3])
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == [1]
+    assert cache.get("c") == [3]
+
+    cache.clear()
+    assert cache.get("a") is None
@@ -0,0 +1,101 @@
+from PyQt6.QtCore import QStringListModel, QItemSelectionModel
+
+from webmacs.minibuffer import completion
+from webmacs.minibuffer.completion import CompletionProxyModel
+from webmacs.minibuffer.prompt import Prompt
+
+
+def rows(proxy):
+    return [proxy.index(i, 0).data() for i in range(proxy.rowCount())]
+
+
+def test_data_changed_refilters_the_changed_rows(qapp):
+    source = QStringListModel(["github", "gmail", "maps", "git"])
+    proxy = CompletionProxyModel()
+    proxy.setSourceModel(source)
+    proxy.set_filter("g", Prompt.SimpleMatch)
+    assert rows(proxy) == ["github", "gmail", "git"]
+
+    selection = QItemSelectionModel(proxy)
+    selection.setCurrentIndex(proxy.index(2, 0),
+                              QItemSelectionModel.SelectionFlag.Select)
+    resets = []
+    proxy.modelReset.connect(lambda: resets.append(True))
+
+    # no longer matching, then matching
+    source.setData(source.index(1, 0), "calendar")
+    assert rows(proxy) == ["github", "git"]
+    source.setData(source.index(2, 0), "google maps")
+    assert rows(proxy) == ["github", "google maps", "git"]
+    # still matching
+    source.setData(source.index(0, 0), "gitlab")
+    assert rows(proxy) == ["gitlab", "google maps", "git"]
+
+    assert not resets
+    assert selection.currentIndex().data() == "git"
+
+
+def test_data_changed_keeps_the_fuzzy_order(qapp):
+    source = QStringListModel(["xgxixt", "git", "xgitx"])
+    proxy = CompletionProxyModel()
+    proxy.setSourceModel(source)
+    proxy.set_filter("git", Prompt.FuzzyMatch)
+    assert rows(proxy) == ["git", "xgitx", "xgxixt"]
+
+    source.setData(source.index(0, 0), "gitx")
+    assert rows(proxy) == ["git", "gitx", "xgitx"]
+
+
+def test_no_filter_uses_the_source_rows(qapp, monkeypatch):
+    loaded = []
+    load = CompletionProxyModel._load_candidates
+    monkeypatch.setattr(CompletionProxyModel, "_load_candidates",
+                        lambda self: loaded.append(True) or load(self))
+
+    source = QStringListModel(["github", "gmail", "maps"])
+    proxy = CompletionProxyModel()
+    proxy.setSourceModel(source)
+    proxy.set_filter("", Prompt.FuzzyMatch)
+    # the rows are not copied when there is nothing to filter
+    assert rows(proxy) == ["github", "gmail", "maps"]
+    assert not loaded
+
+    proxy.set_filter("g", Prompt.SimpleMatch)
+    assert rows(proxy) == ["github", "gmail"]
+    proxy.set_filter("", Prompt.SimpleMatch)
+    assert rows(proxy) == ["github", "gmail", "maps"]
+
+    resets = []
+    proxy.modelReset.connect(lambda: resets.append(True))
+    source.insertRows(1, 1)
+    source.setData(source.index(1, 0), "git")
+    source.removeRows(3, 1)
+    assert rows(proxy) == ["github", "git", "gmail"]
+    assert proxy.mapToSource(proxy.index(1, 0)).row() == 1
+    assert not resets
+
+    # the changes are seen by the next filter
+    proxy.set_filter("gi", Prompt.SimpleMatch)
+    assert rows(proxy) == ["github", "git"]
+
+
+def test_filter_error(qapp, qtbot, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("broken")
+
+    source = QStringListModel(["github", "gmail", "maps", "git"])
+    proxy = CompletionProxyModel()
+    proxy.setSourceModel(source)
+    monkeypatch.setattr(completion.FuzzyMatcher, "match", fail)
+
+    # the error is logged, and no rows are matched
+    with qtbot.waitSignal(proxy.filtered):
+        proxy.set_filter("g", Prompt.FuzzyMatch)
+    assert rows(proxy) == []
+
+    # the same in a thread
+    monkeypatch.setattr(CompletionProxyModel, "ASYNC_THRESHOLD", 1)
+    with qtbot.waitSignal(proxy.filtered):
+        proxy.set_filter("gi", Prompt.FuzzyMatch)
+    assert not proxy.pending()
+    assert rows(proxy) == []
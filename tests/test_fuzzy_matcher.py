@@ -0,0 +1,89 @@
+import pytest
+
+from webmacs.minibuffer.matcher import FuzzyMatcher, Cancelled, \
+    fuzzy_match, match_words
+
+
+def test_fuzzy_match():
+    score, positions = fuzzy_match("gh", "github.com")
+    assert positions == [0, 3]
+    assert fuzzy_match("xyz", "github.com") is None
+    # order matters inside a word
+    assert fuzzy_match("hg", "github") is None
+
+
+def test_fuzzy_match_shortest_positions():
+    # the backward scan finds the shortest match
+    score, positions = fuzzy_match("ab", "a-xxxx-ab")
+    assert positions == [7, 8]
+
+
+def test_fuzzy_match_scores():
+    # consecutive characters score higher than scattered ones
+    assert fuzzy_match("git", "github")[0] > fuzzy_match("git", "gxixt")[0]
+    # characters at a word boundary score higher
+    assert fuzzy_match("m", "my-mail")[0] > fuzzy_match("m", "gmail")[0]
+    assert fuzzy_match("gp", "git-push")[0] > fuzzy_match("gp", "gulp")[0]
+
+
+def test_smart_case():
+    assert fuzzy_match("gh", "GitHub") is not None
+    assert fuzzy_match("GH", "GitHub") is not None
+    assert fuzzy_match("GH", "github") is None
+
+
+def test_fuzzy_match_non_ascii():
+    # "\u0130".lower() is two characters long
+    score, positions = fuzzy_match("ul", "\u0130stanbul")
+    assert positions == [6, 7]
+    score, positions = fuzzy_match("ist", "\u0130stanbul")
+    assert positions == [0, 1, 2]
+    score, positions = fuzzy_match("caf", "Caf\u00e9 \u0130zmir")
+    assert positions == [0, 1, 2]
+
+
+def test_match_words():
+    score, positions = match_words(["com", "git"], "github.com")
+    assert positions == [0, 1, 2, 7, 8, 9]
+    assert match_words(["git", "org"], "github.com") is None
+
+
+def test_matcher_order():
+    matcher = FuzzyMatcher([("gmail.com", "Mail"),
+                            ("github.com/parkouss", "GitHub"),
+                            ("news.ycombinator.com", "Hacker News")])
+    matches = matcher.match("gh")
+    assert [m.index for m in matches] == [1]
+    # the best column is used
+    assert matches[0].column == 1
+
+    # ties are broken by the shortest text, then the index
+    matches = matcher.match("com")
+    assert [m.index for m in matches] == [0, 1, 2]
+    assert matcher.match("") == [(i, 0, 0, []) for i in range(3)]
+
+
+def test_matcher_incremental():
+    matcher = FuzzyMatcher([("abc",), ("abd",), ("xyz",)])
+    assert [m.index for m in matcher.match("ab")] == [0, 1]
+
+    # only the previous matches are considered when the query is extended
+    matcher._candidates = matcher._candidates[:2] + (("abcd",),)
+    assert [m.index for m in matcher.match("abc")] == [0]
+    # but not when the query changes
+    assert [m.index for m in matcher.match("bc")] == [0, 2]
+
+    # adding candidates forgets the previous query
+    indexes = matcher.add_candidates([("abce",)])
+    assert list(indexes) == [3]
+    assert [m.index for m in matcher.match("abc")] == [0, 2, 3]
+    assert [m.index for m in matcher.match("abc", indexes)] == [3]
+
+
+def test_matcher_cancelled():
+    matcher = FuzzyMatcher([("abc",)] * 1000)
+    with pytest.raises(Cancelled):
+        matcher.match("ab", cancelled=lambda: True)
+    # a cancelled query is not remembered
+    assert matcher._last_query is None
+    assert len(matcher.match("abc", cancelled=lambda: False)) == 1000
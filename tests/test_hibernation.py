@@ -0,0 +1,132 @@
+from PyQt6.QtCore import QObject, pyqtSignal as Signal
+
+from webmacs import hibernation, BufferIndex, hooks
+
+
+class Buffer(object):
+    def __init__(self, pid, visible=False):
+        self.pid = pid
+        self.visible = visible
+        self.hibernated = False
+
+    def renderProcessPid(self):
+        return 0 if self.hibernated else self.pid
+
+    def delayed_loading_url(self):
+        return self.hibernated or None
+
+    def isVisible(self):
+        return self.visible
+
+    def recentlyAudible(self):
+        return False
+
+    def hibernate(self):
+        if self.visible or self.hibernated:
+            return False
+        self.hibernated = True
+        return True
+
+
+def test_hibernate_buffers(monkeypatch):
+    # a shared renderer, and a renderer used by a displayed buffer
+    buffers = [Buffer(10), Buffer(11), Buffer(10), Buffer(12, visible=True),
+               Buffer(12)]
+    monkeypatch.setattr(hibernation.BUFFER_INDEX, "recent", buffers)
+    monkeypatch.setattr(hibernation, "process_memory", lambda pid: pid)
+
+    assert hibernation.hibernate_buffers(buffers[:2]) == (2, 11)
+    # the renderer 10 is freed with its last buffer
+    assert hibernation.hibernate_buffers(buffers) == (2, 10)
+    assert [b.hibernated for b in buffers] \
+        == [True, True, True, False, True]
+
+
+def test_hibernate_buffers_memory_target(monkeypatch):
+    buffers = [Buffer(pid) for pid in (10, 20, 30)]
+    monkeypatch.setattr(hibernation.BUFFER_INDEX, "recent", buffers)
+    monkeypatch.setattr(hibernation.os, "getpid", lambda: 5)
+    monkeypatch.setattr(hibernation, "process_memory", lambda pid: pid)
+
+    # 65 used: one renderer is released by call, until below 40
+    assert hibernation.hibernate_buffers(buffers, 40) == (1, 10)
+    assert hibernation.hibernate_buffers(buffers, 40) == (1, 20)
+    assert hibernation.hibernate_buffers(buffers, 40) == (0, 0)
+    assert [b.hibernated for b in buffers] == [True, True, False]
+
+
+def test_hibernate_buffers_memory_target_shared_renderer(monkeypatch):
+    # the renderer 10 is kept by a displayed buffer
+    buffers = [Buffer(10), Buffer(10), Buffer(20), Buffer(10, visible=True)]
+    monkeypatch.setattr(hibernation.BUFFER_INDEX, "recent", buffers)
+    monkeypatch.setattr(hibernation.os, "getpid", lambda: 5)
+    monkeypatch.setattr(hibernation, "process_memory", lambda pid: pid)
+
+    assert hibernation.hibernate_buffers(buffers, 0) == (1, 20)
+    assert [b.hibernated for b in buffers] == [False, False, True, False]
+    assert hibernation.hibernate_buffers(buffers, 0) == (0, 0)
+
+
+class HiddenBuffer(QObject):
+    visibleChanged = Signal(bool)
+
+    def __init__(self, discardable=False):
+        QObject.__init__(self)
+        self.state = "active"
+        self.visible = False
+        self.discardable = discardable
+        self.last_use = 0
+
+    def isVisible(self):
+        return self.visible
+
+    def set_visible(self, visible):
+        self.visible = visible
+        if visible:
+            self.state = "active"
+        self.visibleChanged.emit(visible)
+
+    def freeze(self):
+        if self.state != "active" or self.visible:
+            return False
+        self.state = "frozen"
+        return True
+
+    def can_discard(self):
+        return self.discardable
+
+    def hibernate(self):
+        self.state = "discarded"
+        return True
+
+
+def test_lifecycle_policy(monkeypatch):
+    monkeypatch.setattr(hooks, "webbuffer_created", hooks.Hook())
+    monkeypatch.setattr(hooks, "webbuffer_closed", hooks.Hook())
+    index = BufferIndex()
+    monkeypatch.setattr(hibernation, "BUFFER_INDEX", index)
+    monkeypatch.setattr(hibernation.freeze_delay, "value", 60)
+    monkeypatch.setattr(hibernation.discard_delay, "value", 10)
+    clock = [1000]
+    monkeypatch.setattr(hibernation.time, "time", lambda: clock[0])
+    policy = hibernation.LifecyclePolicy()
+
+    shown, hidden, discardable = buffers = \
+        [HiddenBuffer(), HiddenBuffer(), HiddenBuffer(True)]
+    for buffer in buffers:
+        index.buffer_added.emit(buffer)
+    shown.set_visible(True)
+
+    clock[0] += 30
+    policy.check()
+    assert [b.state for b in buffers] == ["active"] * 3
+
+    clock[0] += 30
+    policy.check()
+    assert [b.state for b in buffers] == ["active", "frozen", "frozen"]
+
+    # thawed when displayed
+    hidden.set_visible(True)
+    clock[0] += 600
+    policy.check()
+    assert [b.state for b in buffers] == ["active", "active", "discarded"]
@@ -1,3 +1,6 @@
+import json
+
+from webmacs.minibuffer import prompt
 from webmacs.minibuffer.prompt import PromptHistory
 
 
@@ -40,3 +43,74 @@ def test_history():
     assert p.in_user_value()
     assert p.get_next() == "test_2"
     assert p.get_previous() == ""
+
+
+def test_history_duplicates():
+    p = PromptHistory(maxsize=3)
+    for text in ("a", "b", "a", "c", "c"):
+        p.push(text)
+    # "a" was moved to the end
+    assert len(p) == 3
+    assert p.get_previous() == "c"
+    assert p.get_previous() == "a"
+    assert p.get_previous() == "b"
+
+    # the oldest entry is removed, from the index too
+    p.push("d")
+    assert len(p) == 3
+    assert p.search("b") == []
+
+
+def test_history_search():
+    p = PromptHistory()
+    for text in ("github.com/parkouss", "gmail.com", "news github",
+                 "wikipedia.org"):
+        p.push(text)
+
+    # words are matched as prefixes, the most recent entries first
+    assert p.search("git") == ["news github", "github.com/parkouss"]
+    assert p.search("GIT park") == ["github.com/parkouss"]
+    assert p.search("com") == ["gmail.com", "github.com/parkouss"]
+    assert p.search("xyz") == []
+    assert p.search("") == ["wikipedia.org", "news github", "gmail.com",
+                            "github.com/parkouss"]
+
+    p.set_user_value("git")
+    assert p.get_previous_matching() == "news github"
+    assert p.get_previous_matching() == "github.com/parkouss"
+    # previous and next continue from the match
+    assert p.get_next() == "gmail.com"
+    # the search starts again from the user value
+    p.reset()
+    p.set_user_value("git")
+    assert p.get_previous_matching() == "news github"
+    assert p.get_previous_matching() == "github.com/parkouss"
+    assert p.get_previous_matching() == "git"
+    assert p.in_user_value()
+
+
+def test_history_persistence(tmpdir, monkeypatch):
+    monkeypatch.setattr(prompt, "_HISTORY_PATH", str(tmpdir))
+    monkeypatch.setattr(prompt, "_HISTORIES", [])
+    monkeypatch.setattr(prompt.QTimer, "singleShot", lambda *a: None)
+
+    p = PromptHistory(name="test")
+    p.push("foo")
+    p.push("bar")
+    # nothing is written until saved
+    assert not tmpdir.join("test.json").exists()
+    prompt.flush_prompt_histories()
+    assert json.loads(tmpdir.join("test.json").read()) == ["foo", "bar"]
+
+    # loaded on first use
+    p2 = PromptHistory(name="test")
+    assert p2._history is None
+    assert p2.get_previous() == "bar"
+    assert p2.search("foo") == ["foo"]
+
+    # an older snapshot never replaces a newer one
+    p2.push("baz")
+    p2.flush()
+    p2._write(p2._path(), ["foo"], 1)
+    assert json.loads(tmpdir.join("test.json").read()) == \
+        ["foo", "bar", "baz"]
@@ -0,0 +1,113 @@
+import json
+
+from webmacs.session_journal import (SessionWriter, read_session,
+                                     journal_path, replay_journal)
+
+
+def buffer(url):
+    return {"url": url, "title": url, "last_use": 0}
+
+
+def session(*urls):
+    return {"version": 2, "urls": [buffer(u) for u in urls],
+            "windows": [], "current-window": 0}
+
+
+def test_snapshot_then_journal(tmpdir):
+    path = str(tmpdir.join("session.json"))
+    writer = SessionWriter(path)
+    writer.write_snapshot(session("a", "b"))
+
+    writer.append([
+        {"op": "insert", "index": 1, "buffer": buffer("c")},
+        {"op": "remove", "index": 0},
+        {"op": "update", "index": 1, "buffer": buffer("d")},
+    ])
+    writer.append([{"op": "windows", "windows": [{}], "current-window": 0}])
+    writer.close()
+
+    data = read_session(path)
+    assert [u["url"] for u in data["urls"]] == ["c", "d"]
+    assert data["windows"] == [{}]
+    assert writer.journal_size == 4
+
+
+def test_new_snapshot_resets_the_journal(tmpdir):
+    path = str(tmpdir.join("session.json"))
+    writer = SessionWriter(path)
+    writer.write_snapshot(session("a"))
+    writer.append([{"op": "remove", "index": 0}])
+    writer.write_snapshot(session("b"))
+
+    assert writer.journal_size == 0
+    assert [u["url"] for u in read_session(path)["urls"]] == ["b"]
+
+
+def test_journal_of_another_snapshot_is_ignored(tmpdir):
+    path = str(tmpdir.join("session.json"))
+    writer = SessionWriter(path)
+    writer.write_snapshot(session("a"))
+    writer.append([{"op": "remove", "index": 0}])
+    writer.close()
+    # as if a crash happened between the snapshot and the new journal
+    with open(journal_path(path)) as f:
+        journal = f.read()
+    writer.write_snapshot(session("b"))
+    with open(journal_path(path), "w") as f:
+        f.write(journal)
+
+    assert [u["url"] for u in read_session(path)["urls"]] == ["b"]
+
+
+def test_truncated_journal_entry_is_ignored():
+    data = dict(session("a", "b"), generation="1")
+    lines = [
+        json.dumps({"generation": "1"}),
+        json.dumps({"op": "remove", "index": 0}),
+        '{"op": "remove", "ind',
+    ]
+    assert replay_journal(data, lines) == 1
+    assert [u["url"] for u in data["urls"]] == ["b"]
+
+
+def test_journal_stops_at_an_invalid_entry():
+    data = dict(session("a", "b"), generation="1")
+    lines = [
+        json.dumps({"generation": "1"}),
+        json.dumps({"op": "insert", "index": 2, "buffer": buffer("c")}),
+        json.dumps({"op": "remove", "index": 5}),
+        json.dumps({"op": "remove", "index": 0}),
+    ]
+    assert replay_journal(data, lines) == 1
+    assert [u["url"] for u in data["urls"]] == ["a", "b", "c"]
+
+    for op in ({"op": "insert", "index": 4, "buffer": buffer("d")},
+               {"op": "update", "index": -1, "buffer": buffer("d")},
+               {"op": "windows", "windows": []},
+               {"op": "unknown"},
+               ["remove", 0]):
+        lines = [json.dumps({"generation": "1"}), json.dumps(op)]
+        assert replay_journal(data, lines) == 0
+    assert [u["url"] for u in data["urls"]] == ["a", "b", "c"]
+    assert data["windows"] == []
+
+
+def test_histories_sidecar(tmpdir):
+    path = str(tmpdir.join("session.json"))
+    writer = SessionWriter(path)
+    writer.write_snapshot(session("a", "b"))
+    writer.write_snapshot(dict(session("a", "b"), urls=[
+        dict(buffer("a"), history=b"history a"),
+        buffer("b"),
+    ]))
+    writer.append([
+        {"op": "update", "index": 1,
+         "buffer": dict(buffer("b"), history=b"history b")},
+    ])
+    writer.close()
+
+    # only the history file of the last snapshot is kept
+    assert len(tmpdir.listdir(lambda p: p.ext == ".history")) == 1
+    data = read_session(path)
+    assert [u["history"] for u in data["urls"]] \
+        == [b"history a", b"history b"]
@@ -0,0 +1,72 @@
+import sqlite3
+
+from webmacs import visited_links
+from webmacs.visited_links import VisitedLinks
+
+
+def test_search_unwritten_visits(qapp, tmpdir):
+    path = str(tmpdir.join("visitedlinks.db"))
+    links = VisitedLinks(path)
+    links.visit("https://github.com/parkouss/webmacs", "webmacs")
+    links.visit("https://gitlab.com", "GitLab")
+    links.flush(wait=True)
+
+    # lock the database, so the writer can not write anything
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN EXCLUSIVE")
+    links.visit("https://github.com/explore", "Explore GitHub")
+    links.flush()
+    links.visit("https://docs.python.org", "Python")
+    links.remove("https://gitlab.com")
+
+    assert [url for url, _ in links.search("git")] == [
+        "https://github.com/explore",
+        "https://github.com/parkouss/webmacs",
+    ]
+    assert [url for url, _ in links.visited_urls()] == [
+        "https://docs.python.org",
+        "https://github.com/explore",
+        "https://github.com/parkouss/webmacs",
+    ]
+
+    conn.rollback()
+    links.close()
+    assert {url for url, _ in VisitedLinks(path).visited_urls()} == {
+        "https://docs.python.org",
+        "https://github.com/explore",
+        "https://github.com/parkouss/webmacs",
+    }
+
+
+def test_search_punctuation(qapp):
+    links = VisitedLinks(":memory:")
+    links.visit("https://github.com/parkouss/webmacs", "webmacs")
+    links.visit("https://example.com", "Example")
+    links.flush()
+
+    assert [url for url, _ in links.search("github /")] \
+        == ["https://github.com/parkouss/webmacs"]
+    assert {url for url, _ in links.search("/")} \
+        == {"https://example.com", "https://github.com/parkouss/webmacs"}
+    assert list(links.search("park")) \
+        == [("https://github.com/parkouss/webmacs", "webmacs")]
+
+
+def test_writer_survives_errors(qapp, tmpdir, monkeypatch):
+    path = str(tmpdir.join("visitedlinks.db"))
+    links = VisitedLinks(path)
+    write = visited_links._write
+
+    def fail_once(conn, batch):
+        monkeypatch.setattr(visited_links, "_write", write)
+        raise TypeError("not a sqlite error")
+
+    monkeypatch.setattr(visited_links, "_write", fail_once)
+    links.visit("https://example.com", "Example")
+    # the batch is lost, but the flush does not block
+    links.flush(wait=True)
+    links.visit("https://github.com", "GitHub")
+    links.flush(wait=True)
+
+    assert [url for url, _ in links.visited_urls()] == ["https://github.com"]
+    links.close()
@@ -15,7 +15,7 @@
 
 import importlib
 
-from PyQt6.QtCore import QObject, QEvent, QTimer
+from PyQt6.QtCore import QObject, QEvent, QTimer, pyqtSignal as Signal
 
 from . import hooks
 
@@ -74,6 +74,99 @@ class WindowsHandler(QObject):
 WINDOWS_HANDLER = WindowsHandler()
 
 
+class BufferIndex(QObject):
+    """
+    Index of the buffers, kept up to date by the buffer hooks: their
+    position in BUFFERS, and the buffers ordered by most recent use.
+
+    Its signals allow to update the buffer lists incrementally instead of
+    building them again.
+    """
+    # emitted with the buffer once it is added
+    buffer_added = Signal(object)
+    # emitted with the buffer once it is removed
+    buffer_removed = Signal(object)
+    # emitted with the buffer once it moved in the recent order
+    buffer_used = Signal(object)
+    # emitted with the buffer when its title or url changed
+    buffer_changed = Signal(object)
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        # the most recently used first
+        self.recent = []
+        # the positions of the buffers in BUFFERS, up to date for the first
+        # _valid buffers: a buffer created or closed only invalidates the
+        # positions after its own, so appending or closing the last buffers
+        # costs nothing.
+        self._positions = {}
+        self._valid = 0
+        hooks.webbuffer_created.add(self._on_buffer_created)
+        hooks.webbuffer_closed.add(self._on_buffer_closed)
+
+    def position(self, buffer):
+        """
+        Returns the index of the buffer in BUFFERS.
+        """
+        position = self._positions.get(buffer)
+        if position is None or position >= self._valid:
+            for i in range(self._valid, len(BUFFERS)):
+                self._positions[BUFFERS[i]] = i
+            self._valid = len(BUFFERS)
+            position = self._positions[buffer]
+        return position
+
+    def _invalidate_positions(self, position):
+        self._valid = min(self._valid, position)
+
+    def _insert_recent(self, buffer):
+        # usually, the buffer is the most recently used
+        i = 0
+        while i < len(self.recent) \
+                and self.recent[i].last_use > buffer.last_use:
+            i += 1
+        self.recent.insert(i, buffer)
+
+    def _on_buffer_created(self, buffer):
+        # usually, the buffer is appended
+        self._invalidate_positions(
+            len(BUFFERS) - 1 if BUFFERS and BUFFERS[-1] is buffer
+            else BUFFERS.index(buffer))
+        self._insert_recent(buffer)
+        buffer.titleChanged.connect(self._on_buffer_changed)
+        buffer.urlChanged.connect(self._on_buffer_changed)
+        self.buffer_added.emit(buffer)
+
+    def _on_buffer_closed(self, buffer):
+        position = self._positions.pop(buffer, None)
+        if position is not None:
+            self._invalidate_positions(position)
+        self.recent.remove(buffer)
+        self.buffer_removed.emit(buffer)
+
+    def _on_buffer_changed(self):
+        self.buffer_changed.emit(self.sender())
+
+    def update_last_use(self, buffer):
+        """
+        Called when the last use of a buffer changed.
+        """
+        if self.recent and self.recent[0] is buffer and (
+                len(self.recent) == 1
+                or self.recent[1].last_use <= buffer.last_use):
+            return
+        try:
+            self.recent.remove(buffer)
+        except ValueError:
+            # not yet created
+            return
+        self._insert_recent(buffer)
+        self.buffer_used.emit(buffer)
+
+
+BUFFER_INDEX = BufferIndex()
+
+
 def windows():
     """
     Returns the window list.
@@ -106,9 +199,9 @@ def buffers():
 
 def recent_buffers():
     """
-    Returns an iterable of buffers, most recently used first.
+    Returns the list of buffers, most recently used first.
     """
-    return sorted(BUFFERS, key=lambda b: b.last_use, reverse=True)
+    return list(BUFFER_INDEX.recent)
 
 
 def current_minibuffer():
@@ -14,21 +14,23 @@
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 import logging
 import time
 import json
+import hashlib
 
-from datetime import datetime, timezone
-import dateparser
+from collections import OrderedDict
+from email.utils import formatdate
 
+import _adblock
 from _adblock import AdBlock
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import urllib.request
-from . import variables
+from . import variables, require
 from .task import Task
 
 from PyQt6.QtNetwork import QNetworkRequest, QNetworkReply
 from PyQt6.QtCore import QUrl, QThreadPool, pyqtSignal as Signal, Qt
+from PyQt6.QtWebEngineCore import QWebEngineUrlRequestInfo, QWebEngineScript
 
 
 DEFAULT_EASYLIST = [
@@ -47,21 +49,230 @@ adblock_urls_rules = variables.define_variable(
 )
 
 
-def cache_file(cache_path):
-    return os.path.join(cache_path, "cache.dat")
+def _update_cache_size(var):
+    app = require(".application").app()
+    if app:
+        app.url_interceptor().update_cache_size()
+
+
+adblock_cache_size = variables.define_variable(
+    "adblock-cache-size",
+    "The number of ad-blocking verdicts (an url requested from a site) to"
+    " keep in memory, so that urls already seen are not matched against"
+    " the rules again. Set to 0 to disable the cache.",
+    8192,
+    type=variables.Int(min=0),
+    callbacks=(_update_cache_size,),
+)
+
+
+adblock_trace_file = variables.define_variable(
+    "adblock-trace-file",
+    "Path of a file to record every request seen by the ad-blocker, one"
+    " json object per line. This is meant to be used with the adblock"
+    " benchmarks of webmacs. Empty to disable.",
+    "",
+    type=variables.String(),
+)
+
+
+adblock_cosmetic_filters = variables.define_variable(
+    "adblock-cosmetic-filters",
+    "If True, the elements matched by the element hiding rules of the"
+    " adblock lists (like example.com##.ad) are hidden with a stylesheet"
+    " injected in the pages.",
+    True,
+    type=variables.Bool(),
+)
+
+
+# map the Qt resource type names to the ad-block filter option names, so
+# the engine only evaluates the rules relevant for the requested resource.
+# Note that the third party relationship is not given here: the engine
+# computes it from the request url and the first party host. The top-level
+# navigations are given no option, as before the resource types were used:
+# $document rules are exceptions for the whole page, and do not apply to
+# the navigation itself.
+RESOURCE_TYPE_OPTIONS = {
+    "ResourceTypeMainFrame": "FONoFilterOption",
+    "ResourceTypeNavigationPreloadMainFrame": "FONoFilterOption",
+    "ResourceTypeSubFrame": "FOSubdocument",
+    "ResourceTypeStylesheet": "FOStylesheet",
+    "ResourceTypeScript": "FOScript",
+    "ResourceTypeImage": "FOImage",
+    "ResourceTypeFavicon": "FOImage",
+    "ResourceTypeFontResource": "FOFont",
+    "ResourceTypeObject": "FOObject",
+    "ResourceTypePluginResource": "FOObjectSubrequest",
+    "ResourceTypeMedia": "FOMedia",
+    "ResourceTypeXhr": "FOXmlHttpRequest",
+    "ResourceTypePing": "FOPing",
+    "ResourceTypeCspReport": "FOOther",
+    "ResourceTypeWebSocket": "FOWebsocket",
+}
+
+
+def resource_type_option(name):
+    """
+    Returns the filter option to use for a Qt resource type name, like
+    "ResourceTypeScript". Unknown resource types are mapped to FOOther.
+    """
+    return getattr(_adblock, RESOURCE_TYPE_OPTIONS.get(name, "FOOther"))
+
+
+# the same, keyed by QWebEngineUrlRequestInfo.ResourceType
+RESOURCE_TYPES = {
+    rtype: resource_type_option(rtype.name)
+    for rtype in QWebEngineUrlRequestInfo.ResourceType
+}
+
+
+class CosmeticFilters(object):
+    """
+    Build the scripts injecting the element hiding stylesheet of a domain.
+
+    The selectors of the rules without domains are the same for every
+    domain: they are injected by one shared script, built once. The
+    selectors of the rules with domains, and the generic ones excepted, are
+    injected by a small script per domain. Computing them requires to go
+    through all the cosmetic filters, so these scripts are kept in a LRU
+    cache keyed by domain.
+    """
+    SCRIPT_NAME = "webmacs-cosmetic-filters"
+    # both scripts share the stylesheets of the page, whatever their order
+    SCRIPT_SRC = """
+(function(filters) {
+    var state = window.__webmacsCosmeticFilters;
+    if (!state) {
+        state = window.__webmacsCosmeticFilters = {
+            generic: null,
+            exceptions: [],
+            genericSheet: new CSSStyleSheet(),
+            specificSheet: new CSSStyleSheet(),
+        };
+        document.adoptedStyleSheets = [...document.adoptedStyleSheets,
+                                       state.genericSheet,
+                                       state.specificSheet];
+    }
+    function css(selectors) {
+        // one rule per selector, as an invalid selector would invalidate
+        // all the selectors of its rule.
+        return selectors.map(s => s + "{display:none!important}").join("\\n");
+    }
+    if (filters.generic) {
+        state.generic = filters.generic;
+    } else {
+        state.exceptions = filters.exceptions;
+        state.specificSheet.replaceSync(css(filters.specific));
+    }
+    if (state.generic && (filters.generic || state.exceptions.length)) {
+        var exceptions = new Set(state.exceptions);
+        state.genericSheet.replaceSync(
+            css(state.generic.filter(s => !exceptions.has(s))));
+    }
+})(%s);
+"""
+
+    def __init__(self, adblock, size=64):
+        self._adblock = adblock
+        self._size = size
+        self._scripts = OrderedDict()
+        self._generic_script = None
+        self._generic_built = False
+
+    def _script(self, filters):
+        script = QWebEngineScript()
+        script.setName(self.SCRIPT_NAME)
+        script.setInjectionPoint(
+            QWebEngineScript.InjectionPoint.DocumentCreation)
+        script.setWorldId(QWebEngineScript.ScriptWorldId.ApplicationWorld)
+        script.setRunsOnSubFrames(False)
+        script.setSourceCode(self.SCRIPT_SRC % json.dumps(filters))
+        return script
+
+    def generic_script(self):
+        """
+        Returns the QWebEngineScript hiding the elements on every domain, or
+        None if there is nothing to hide.
+        """
+        if not self._generic_built:
+            self._generic_built = True
+            selectors = self._adblock.generic_cosmetic_selectors()
+            if selectors:
+                self._generic_script = self._script({"generic": selectors})
+        return self._generic_script
+
+    def domain_script(self, domain):
+        """
+        Returns the QWebEngineScript hiding the elements specific to the
+        domain, or None if there are none.
+        """
+        try:
+            self._scripts.move_to_end(domain)
+            return self._scripts[domain]
+        except KeyError:
+            pass
+
+        selectors, exceptions = self._adblock.cosmetic_selectors(domain)
+        script = None
+        if selectors or exceptions:
+            script = self._script({"specific": selectors,
+                                   "exceptions": exceptions})
+        self._scripts[domain] = script
+        if len(self._scripts) > self._size:
+            self._scripts.popitem(last=False)
+        return script
+
+    def scripts(self, domain):
+        """
+        Returns the list of the QWebEngineScript hiding the elements for the
+        domain.
+        """
+        return [script for script in (self.generic_script(),
+                                      self.domain_script(domain))
+                if script is not None]
+
+
+def _status_code(reply):
+    return reply.attribute(QNetworkRequest.Attribute.HttpStatusCodeAttribute)
+
+
+# to be incremented when the content of the shards changes, so they are
+# compiled again. 2: cosmetic filters are saved. 3: exception rules are
+# saved apart, to apply to every list.
+SHARD_VERSION = 3
+
+# the files of the shards directory created by _shard_file
+_SHARD_FILE_RE = re.compile(r"^[0-9a-f]{40}-\d+(-exceptions)?\.dat$")
 
 
 class AdBlockUpdateTask(Task):
+    """
+    Download the adblock lists, and build an AdBlock object.
+
+    Each list is compiled into its own serialized shard, named after the
+    hash of the list content, so that only changed lists are parsed
+    again. The shards are then memory mapped and combined in one AdBlock
+    object.
+
+    The exception rules (@@) of a list are also saved in a shard of their
+    own, loaded with exceptions=True so they apply to the rules of every
+    list.
+    """
     adblock_ready = Signal(AdBlock)
 
     def __init__(self, app, cache_path, ):
         Task.__init__(self)
         self.app = app
-        if not os.path.isdir(cache_path):
-            os.makedirs(cache_path)
+        self._shards_path = os.path.join(cache_path, "shards")
+        if not os.path.isdir(self._shards_path):
+            os.makedirs(self._shards_path)
         self._cache_path = cache_path
         self._cached_urls_path = os.path.join(self._cache_path, "urls.json")
-        self._cache_file = cache_file(cache_path)
+        # http validators (etag, last-modified) of the downloaded lists
+        self._validators_path = os.path.join(self._cache_path,
+                                             "validators.json")
+        self._validators = {}
         self._user_urls = {
             url: os.path.join(self._cache_path, url.rsplit("/", 1)[-1])
             for url in adblock_urls_rules.value
@@ -72,64 +283,174 @@ class AdBlockUpdateTask(Task):
 
         self._adblock = None
         self._replies = {}
-        self._modified = False
+        self._shards = {}
         self.__thread_running = False
 
     def start(self):
         to_download = [(url, path) for url, path in self._user_urls.items()
                        if not os.path.isfile(path)
                        or (os.path.getmtime(path) + 3600) < time.time()]
+        if to_download:
+            self._validators = self._read_validators()
         for url, path in to_download:
-            reply = self.app.network_manager.get(QNetworkRequest(QUrl(url)))
+            reply = self.app.network_manager.get(self._request(url, path))
             reply.readyRead.connect(self._dl_ready_read)
             reply.finished.connect(self._dl_finished)
-            self._replies[reply] = {"path": path}
+            self._replies[reply] = {"path": path, "url": url}
         self._maybe_finish()
 
+    def _read_validators(self):
+        try:
+            with open(self._validators_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            logging.exception("Could not load the adblock validators %s."
+                              % self._validators_path)
+            return {}
+
+    def _request(self, url, path):
+        """
+        Create a conditional request for the list, so the server can reply
+        with a 304 (not modified) status if we already have its content.
+        """
+        request = QNetworkRequest(QUrl(url))
+        if not os.path.isfile(path):
+            return request
+        validators = self._validators.get(url, {})
+        if "etag" in validators:
+            request.setRawHeader(b"If-None-Match",
+                                 validators["etag"].encode("latin-1"))
+        last_modified = validators.get("last-modified") \
+            or formatdate(os.path.getmtime(path), usegmt=True)
+        request.setRawHeader(b"If-Modified-Since",
+                             last_modified.encode("latin-1"))
+        return request
+
     def _maybe_finish(self):
         if self._replies:
             return
 
-        if not self._modified:
-            try:
-                with open(self._cached_urls_path) as f:
-                    cached_urls = json.load(f)
-            except FileNotFoundError:
-                self._modified = True
-            except Exception:
-                logging.exception("Could not load cached urls. Removing %s."
-                                  % self._cached_urls_path)
-                os.unlink(self._cached_urls_path)
-                self._modified = True
-            else:
-                if cached_urls != self._user_urls or not os.path.exists(self._cache_file):
-                    self._modified = True
-
         self.__thread_running = True
-        QThreadPool.globalInstance().start(
-            self._parse_adblock_files if self._modified else self._adblock_from_cache)
+        QThreadPool.globalInstance().start(self._load_shards)
 
-    def _adblock_from_cache(self):
-        adblock = AdBlock()
-        adblock.load(self._cache_file)
-        self.adblock_ready.emit(adblock)
+    def _shard_file(self, digest, exceptions=False):
+        return os.path.join(self._shards_path, "%s-%d%s.dat" % (
+            digest, SHARD_VERSION, "-exceptions" if exceptions else ""))
 
-    def _parse_adblock_files(self):
-        adblock = AdBlock()
-        for path in self._user_urls.values():
+    def _shard_files(self, shard):
+        files = [self._shard_file(shard["hash"])]
+        if shard["exceptions"]:
+            files.append(self._shard_file(shard["hash"], exceptions=True))
+        return files
+
+    def _read_cached_urls(self):
+        try:
+            with open(self._cached_urls_path) as f:
+                cached_urls = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            logging.exception("Could not load cached urls. Removing %s."
+                              % self._cached_urls_path)
+            os.unlink(self._cached_urls_path)
+            return {}
+        # older versions only stored the path of the adblock files
+        return {url: shard for url, shard in cached_urls.items()
+                if isinstance(shard, dict)}
+
+    def _shard_for(self, url, path, cached_urls):
+        """
+        Returns the shard information for an adblock file, compiling the
+        shard if it does not exist yet.
+        """
+        stat = os.stat(path)
+        shard = cached_urls.get(url)
+        # avoid to hash the file content if it did not change
+        if (shard and shard["path"] == path
+                and shard["mtime"] == stat.st_mtime
+                and shard["size"] == stat.st_size
+                and "exceptions" in shard
+                and all(os.path.isfile(f) for f in self._shard_files(shard))):
+            return shard
+
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        shard_file = self._shard_file(digest)
+        exceptions_file = self._shard_file(digest, exceptions=True)
+        if not os.path.isfile(shard_file):
             logging.info("parsing adblock file: %s", path)
+            adblock = AdBlock()
+            adblock.parse(data)
+            # saved first, so the shard file exists only if they are saved
+            if adblock.save_exceptions(exceptions_file) is False:
+                raise IOError("Unable to save %s" % exceptions_file)
+            if not adblock.save(shard_file):
+                raise IOError("Unable to save %s" % shard_file)
+        return {"path": path, "mtime": stat.st_mtime, "size": stat.st_size,
+                "hash": digest,
+                "exceptions": os.path.isfile(exceptions_file)}
+
+    def _load_shard(self, adblock, shard):
+        if not adblock.load(self._shard_file(shard["hash"])):
+            return False
+        if shard["exceptions"]:
+            return adblock.load(self._shard_file(shard["hash"], True),
+                                exceptions=True)
+        return True
+
+    def _load_shards(self):
+        cached_urls = self._read_cached_urls()
+        adblock = AdBlock()
+        shards = {}
+        for url, path in self._user_urls.items():
             try:
-                with open(path) as f:
-                    adblock.parse(f.read())
+                shard = self._shard_for(url, path, cached_urls)
+                if not self._load_shard(adblock, shard):
+                    # probably a corrupted shard, compile it again. Note
+                    # that its rules may already be loaded, if only the
+                    # exceptions file is corrupted.
+                    for shard_file in self._shard_files(shard):
+                        os.unlink(shard_file)
+                    shard = self._shard_for(url, path, {})
+                    if not self._load_shard(adblock, shard):
+                        raise IOError("Unable to load the adblock shard")
             except Exception:
-                logging.exception(f"Unable to parse {f.name} adblock file")
-            adblock.save(self._cache_file)
+                logging.exception(f"Unable to use the {path} adblock file")
+            else:
+                shards[url] = shard
+
+        self._remove_unused_shards(shards)
+        self._shards = shards
         self.adblock_ready.emit(adblock)
 
+    def _remove_unused_shards(self, shards):
+        # it is safe to remove a shard used by another running instance, as
+        # its memory mapping stays valid. Other files (like the temporary
+        # files of a shard being saved by another instance) are kept.
+        used = {f for shard in shards.values()
+                for f in self._shard_files(shard)}
+        for fname in os.listdir(self._shards_path):
+            path = os.path.join(self._shards_path, fname)
+            if _SHARD_FILE_RE.match(fname) and path not in used:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        # the combined cache of previous versions
+        old_cache = os.path.join(self._cache_path, "cache.dat")
+        if os.path.isfile(old_cache):
+            os.unlink(old_cache)
+
     def _on_adblock_ready(self, adblock):
         self.__thread_running = False
         with open(self._cached_urls_path, "w") as f:
-            json.dump(self._user_urls, f)
+            json.dump(self._shards, f)
+        if self._validators:
+            with open(self._validators_path, "w") as f:
+                json.dump(self._validators, f)
         self._adblock = adblock
         self.finished.emit()
 
@@ -137,42 +458,60 @@ class AdBlockUpdateTask(Task):
         return self._adblock
 
     def _dl_ready_read(self):
-        reply = self.sender()
+        self._write_body(self.sender())
+
+    def _write_body(self, reply):
         data = self._replies[reply]
+        if _status_code(reply) != 200:
+            # nothing to store for a 304 (not modified) reply or an error
+            reply.readAll()
+            return
         if "file" not in data:
-            headers = {bytes(k).lower(): bytes(v)
-                       for k, v in reply.rawHeaderPairs()}
-            if os.path.isfile(data["path"]):
-                try:
-                    last_modified = dateparser.parse(
-                        headers[b"last-modified"].decode("utf-8"),
-                        languages=["en"])
-                except Exception:
-                    logging.exception(
-                        "Unable to parse the last-modified header for %s",
-                        reply.url().toString())
-                else:
-                    file_time = datetime.fromtimestamp(
-                        os.path.getmtime(data["path"]), timezone.utc)
-                    if last_modified < file_time:
-                        logging.info("no need to download adblock rule: %s", url)
-                        # touch on the file
-                        os.utime(path, None)
-                        self._close_reply(reply)
-                        self._maybe_finish()
-                        return
-            logging.info("downloading adblock rule: %s", reply.url().toString())
-            data["file"] = open(data["path"], "w")
-
-        data["file"].write(bytes(reply.readAll()).decode("utf-8"))
+            logging.info("downloading adblock rule: %s", data["url"])
+            # download into a temporary file, renamed once complete, so an
+            # interrupted download never replaces a valid list.
+            data["file"] = open(data["path"] + ".part", "wb")
+
+        data["file"].write(reply.readAll().data())
 
     def _dl_finished(self):
         reply = self.sender()
-        self._modified = True
+        self._write_body(reply)
         data = self._replies.pop(reply)
-        data["file"].close()
+        url = data["url"]
+        status = _status_code(reply)
+        error = reply.error() != QNetworkReply.NetworkError.NoError
+        if "file" in data:
+            self._close_file(data, keep=not error)
+        if error:
+            logging.error("Unable to download adblock rule %s: %s",
+                          url, reply.errorString())
+        elif status == 304:
+            logging.info("no need to download adblock rule: %s", url)
+            # touch on the file, so it is not checked for the next hour
+            os.utime(data["path"], None)
+        elif status == 200:
+            headers = {bytes(k).decode("latin-1").lower():
+                       bytes(v).decode("latin-1")
+                       for k, v in reply.rawHeaderPairs()}
+            self._validators[url] = {
+                k: headers[k] for k in ("etag", "last-modified")
+                if k in headers
+            }
+        reply.deleteLater()
         self._maybe_finish()
 
+    def _close_file(self, data, keep):
+        f = data.pop("file")
+        if keep:
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+        if keep:
+            os.replace(f.name, data["path"])
+        else:
+            os.unlink(f.name)
+
     def _close_reply(self, reply):
         del self._replies[reply]
         reply.readyRead.disconnect(self._dl_ready_read)
@@ -183,8 +522,7 @@ class AdBlockUpdateTask(Task):
         for reply, data in list(self._replies.items()):
             self._close_reply(reply)
             if "file" in data:
-                data["file"].close()
-                os.unlink(data["path"])
+                self._close_file(data, keep=False)
         # wait for any thread to join
         if self.__thread_running:
             QThreadPool.globalInstance().waitForDone(1000)
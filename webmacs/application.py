@@ -14,6 +14,7 @@
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import json
 import logging
 
 from PyQt6.QtCore import pyqtSlot as Slot, Qt
@@ -24,11 +25,14 @@ from PyQt6.QtNetwork import QNetworkAccessManager
 
 from . import require, version
 from .task import TaskRunner
-from .adblock import AdBlockUpdateTask, adblock_urls_rules, AdBlock
+from .adblock import AdBlockUpdateTask, adblock_urls_rules, AdBlock, \
+    adblock_cache_size, adblock_trace_file, RESOURCE_TYPES, CosmeticFilters, \
+    adblock_cosmetic_filters
 from .download_manager import DownloadManager
 from .profile import named_profile
 from .minibuffer.right_label import init_minibuffer_right_labels
 from .keyboardhandler import LOCAL_KEYMAP_SETTER
+from .visited_links import VisitedLinksMaintenanceTask
 from .spell_checking import SpellCheckingTask, \
     spell_checking_dictionaries
 from .scheme_handlers import register_schemes
@@ -49,11 +53,34 @@ class UrlInterceptor(QWebEngineUrlRequestInterceptor):
     def __init__(self, app):
         QWebEngineUrlRequestInterceptor.__init__(self)
         self._adblock = AdBlock()
+        self._cosmetic_filters = CosmeticFilters(self._adblock)
         self._use_adblock = True
+        self.update_cache_size()
 
     @Slot(object)
     def update_adblock(self, adblock):
         self._adblock = adblock
+        self._cosmetic_filters = CosmeticFilters(adblock)
+        self.update_cache_size()
+
+    def update_cache_size(self):
+        self._adblock.set_cache_size(adblock_cache_size.value)
+
+    def adblock_stats(self):
+        """
+        Returns the matching statistics of the ad-blocker, see
+        :meth:`AdBlock.stats`.
+        """
+        return self._adblock.stats()
+
+    def cosmetic_scripts(self, domain):
+        """
+        Returns the list of the QWebEngineScript hiding the ads for the
+        domain.
+        """
+        if not self._use_adblock or not adblock_cosmetic_filters.value:
+            return []
+        return self._cosmetic_filters.scripts(domain)
 
     def toggle_use_adblock(self):
         self._use_adblock = not self._use_adblock
@@ -61,13 +88,30 @@ class UrlInterceptor(QWebEngineUrlRequestInterceptor):
     def interceptRequest(self, request):
         url = request.requestUrl()
         url_s = url.toString()
-        if (self._use_adblock
-            and self._adblock.matches(
-                url_s,
-                request.firstPartyUrl().toString())):
+        if not self._use_adblock:
+            return
+        first_party = request.firstPartyUrl().host()
+        resource_type = request.resourceType()
+        if adblock_trace_file.value:
+            self._trace(url_s, first_party, resource_type)
+        # the adblock engine releases the GIL while matching, and keeps a
+        # cache of verdicts for (url, first party host, resource type).
+        if self._adblock.matches(url_s, first_party,
+                                 RESOURCE_TYPES[resource_type]):
             logging.info("filtered: %s", url_s)
             request.block(True)
 
+    def _trace(self, url, first_party, resource_type):
+        try:
+            with open(adblock_trace_file.value, "a") as f:
+                f.write(json.dumps({
+                    "url": url,
+                    "first_party": first_party,
+                    "resource_type": resource_type.name,
+                }) + "\n")
+        except OSError:
+            logging.exception("Unable to write the adblock trace")
+
 
 class WithoutAppEventFilter(object):
     def __enter__(self):
@@ -192,7 +236,14 @@ class Application(QApplication):
         task.finished.connect(spc_finished)
         self.task_runner.run(task)
 
+    def visitedlinks_maintenance(self):
+        path = self.visitedlinks().path
+        if path == ":memory:":
+            return
+        self.task_runner.run(VisitedLinksMaintenanceTask(path))
+
     def post_init(self):
         self.adblock_update()
+        self.visitedlinks_maintenance()
         self.update_spell_checking()
         init_minibuffer_right_labels()
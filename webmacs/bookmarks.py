@@ -36,6 +36,22 @@ class Bookmarks(object):
             "select url, name from bookmarks order by name"
         )]
 
+    def search(self, text):
+        """
+        Returns a cursor over the bookmarks (url, name) which url or name
+        contains every word of the text, in any order.
+        """
+        words = [w.replace("\\", "\\\\").replace("%", "\\%")
+                 .replace("_", "\\_") for w in text.split()]
+        condition = " AND ".join(
+            ["(url || ' ' || ifnull(name, '')) LIKE ? ESCAPE '\\'"]
+            * len(words)) or "1"
+        return self._conn.execute(
+            "SELECT url, name FROM bookmarks WHERE %s ORDER BY name"
+            % condition,
+            ["%" + w + "%" for w in words]
+        )
+
     def remove(self, url):
         self._conn.execute("""
         DELETE from bookmarks WHERE url = ?
@@ -90,7 +90,7 @@ class BufferHistoryListPrompt(Prompt):
         # keep a python reference to the items
         self._items = self.page_history.items()
         Prompt.enable(self, minibuffer)
-        minibuffer.input().popup().selectRow(
+        minibuffer.input().select_source_row(
             self.page_history.currentItemIndex())
 
     def completer_model(self):
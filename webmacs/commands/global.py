@@ -16,11 +16,13 @@
 import itertools
 import os
 import sys
-from PyQt6.QtCore import QStringListModel, QModelIndex, QProcess
+from PyQt6.QtCore import QStringListModel, QModelIndex, QProcess, \
+    pyqtSlot as Slot
 
 from . import define_command, COMMANDS, register_prompt_opener_commands
 from ..minibuffer import Prompt
-from ..minibuffer.prompt import PromptTableModel, PromptHistory
+from ..minibuffer.prompt import PromptTableModel, PromptHistory, \
+    PagedPromptTableModel
 from ..application import app
 from ..webbuffer import create_buffer
 from ..keymaps import KeyPress, VISITEDLINKS_KEYMAP, BOOKMARKS_KEYMAP, \
@@ -41,7 +43,7 @@ class CommandsListPrompt(Prompt):
         "match": Prompt.FuzzyMatch,
         "complete-empty": True,
     }
-    history = PromptHistory()
+    history = PromptHistory(name="commands")
 
     def __init__(self, ctx, local_keymap=None):
         Prompt.__init__(self, ctx)
@@ -248,6 +250,29 @@ def toggle_ad_block(ctx):
     reload_buffer_no_cache(ctx)
 
 
+@define_command("adblock-statistics")
+def adblock_statistics(ctx):
+    """
+    Display the ad-blocking verdict cache hit rate and matching latency.
+    """
+    stats = app().url_interceptor().adblock_stats()
+    total = stats["hits"] + stats["misses"]
+    if not total:
+        ctx.minibuffer.show_info("No request matched by the ad-blocker yet.")
+        return
+    ctx.minibuffer.show_info(
+        "adblock: {} requests, cache hit rate {:.1%} ({}/{} entries),"
+        " mean latency {:.1f}us (engine on miss: {:.1f}us)".format(
+            total,
+            stats["hits"] / total,
+            stats["cache_size"],
+            stats["cache_capacity"],
+            stats["total_ns"] / total / 1000,
+            stats["engine_ns"] / (stats["misses"] or 1) / 1000,
+        )
+    )
+
+
 @define_command("toggle-toolbar")
 def toggle_toolbar(ctx):
     """
@@ -256,12 +281,19 @@ def toggle_toolbar(ctx):
     ctx.window.toggle_toolbar()
 
 
-class VisitedLinksModel(PromptTableModel):
+class VisitedLinksModel(PagedPromptTableModel):
+    """
+    Visited links found by the search of the typed text, fetched by pages.
+    """
 
     def __init__(self, parent):
-        visitedlinks = app().visitedlinks()
-        PromptTableModel.__init__(self, visitedlinks.visited_urls())
-        self.visitedlinks = visitedlinks
+        PagedPromptTableModel.__init__(self)
+        self.visitedlinks = app().visitedlinks()
+        self.text_changed("")
+
+    @Slot(str)
+    def text_changed(self, text):
+        self.set_rows(self.visitedlinks.search(text))
 
     def remove_history_entry(self, index):
         self.beginRemoveRows(QModelIndex(), index.row(), index.row())
@@ -272,7 +304,8 @@ class VisitedLinksModel(PromptTableModel):
 class VisitedLinksPrompt(Prompt):
     label = "Find url from visited links:"
     complete_options = {
-        "match": Prompt.FuzzyMatch,
+        # the search is done by the model
+        "match": None,
         "complete-empty": True,
     }
     keymap = VISITEDLINKS_KEYMAP
@@ -281,6 +314,18 @@ class VisitedLinksPrompt(Prompt):
     def completer_model(self):
         return VisitedLinksModel(self)
 
+    def enable(self, minibuffer):
+        Prompt.enable(self, minibuffer)
+        # connected after the model, to update the popup with the results
+        minibuffer.input().textEdited.connect(self._text_edited)
+
+    def _text_edited(self, text):
+        self.minibuffer.input().show_completions()
+
+    def close(self):
+        self.minibuffer.input().textEdited.disconnect(self._text_edited)
+        Prompt.close(self)
+
 
 @define_command("visited-links-delete-highlighted")
 def visited_links_remove_entry(ctx):
@@ -307,10 +352,10 @@ register_prompt_opener_commands(
 class BookmarksModel(VisitedLinksModel):
 
     def __init__(self, parent):
-        bookmarks = app().bookmarks()
-        PromptTableModel.__init__(self, bookmarks.list())
-        # this makes the remove_history_entry method works
-        self.visitedlinks = bookmarks
+        PagedPromptTableModel.__init__(self)
+        # this makes the text_changed and remove_history_entry methods work
+        self.visitedlinks = app().bookmarks()
+        self.text_changed("")
 
 
 @define_command("bookmarks-delete-highlighted")
@@ -325,7 +370,7 @@ def bookmarks_remove_entry(ctx):
 class BookmarksPrompt(VisitedLinksPrompt):
     label = "Open bookmark:"
     keymap = BOOKMARKS_KEYMAP
-    history = PromptHistory()
+    history = PromptHistory(name="bookmarks")
 
     def completer_model(self):
         return BookmarksModel(self)
@@ -473,7 +518,7 @@ class VariableListPrompt(Prompt):
         "match": Prompt.FuzzyMatch,
         "complete-empty": True,
     }
-    history = PromptHistory()
+    history = PromptHistory(name="variables")
 
     def completer_model(self):
         model = QStringListModel(self)
@@ -494,7 +539,7 @@ def describe_variable(ctx):
 
 class DescribeCommandsListPrompt(CommandsListPrompt):
     label = "describe command: "
-    history = PromptHistory()
+    history = PromptHistory(name="describe-command")
 
 
 @define_command("describe-command")
@@ -589,7 +634,7 @@ def describe_binding_briefly(ctx):
 
 class WhereIsCommandsListPrompt(CommandsListPrompt):
     label = "Where is command: "
-    history = PromptHistory()
+    history = PromptHistory(name="where-is")
 
 
 @define_command("where-is")
@@ -633,7 +678,7 @@ class InstancesListPrompt(Prompt):
         "match": Prompt.FuzzyMatch,
         "complete-empty": True,
     }
-    history = PromptHistory()
+    history = PromptHistory(name="instances")
     exclude_self_instance = True
 
     def __init__(self, ctx):
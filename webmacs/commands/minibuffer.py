@@ -126,6 +126,16 @@ def prompt_history_previous(ctx):
     _prompt_history(ctx, lambda h: h.get_previous())
 
 
+@define_command("minibuffer-history-search")
+def prompt_history_search(ctx):
+    """
+    Insert the previous history value matching the words typed.
+
+    Calling it again inserts the next match.
+    """
+    _prompt_history(ctx, lambda h: h.get_previous_matching())
+
+
 @define_command("minibuffer-validate")
 def edition_finished(ctx):
     """
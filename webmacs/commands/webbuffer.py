@@ -13,8 +13,6 @@
 # You should have received a copy of the GNU General Public License
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
-import itertools
-
 from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
 from PyQt6.QtGui import QColor
 from PyQt6.QtPrintSupport import QPrinter, QPrintDialog
@@ -25,8 +23,12 @@ from ..commands import define_command
 from ..minibuffer import Prompt
 from ..webbuffer import WebBuffer, close_buffer, create_buffer
 from ..killed_buffers import KilledBuffer
+from ..hibernation import hibernate_buffers, format_memory
+from ..session import (BufferPlaceholder, session_entries,
+                       discard_placeholders, restoring_placeholder,
+                       placeholder_discarded, restore_started)
 from ..keyboardhandler import send_key_event
-from .. import BUFFERS, version, current_buffer, recent_buffers
+from .. import BUFFERS, BUFFER_INDEX, version, current_buffer
 from .. import variables, clipboard, GLOBAL_OBJECTS
 from ..keymaps import KeyPress, BUFFERLIST_KEYMAP
 from ..password_manager import PasswordManagerNotReady
@@ -42,10 +44,104 @@ switch_buffer_current_color = variables.define_variable(
 
 
 class BufferTableModel(QAbstractTableModel):
+    """
+    The buffers, in position order or the most recently used first.
+
+    The buffers of a restored session not created yet are listed too, as
+    placeholders (see BufferPlaceholder).
+
+    It is updated incrementally from the BUFFER_INDEX signals, so it is
+    built once and shared by the buffer list prompts, see
+    :func:`buffer_table_model`.
+    """
 
-    def __init__(self, buffers):
+    def __init__(self, recent=False):
         QAbstractTableModel.__init__(self)
-        self._buffers = list(buffers)
+        self._recent = recent
+        self._buffers = self._entries()
+        BUFFER_INDEX.buffer_added.connect(self._on_buffer_added)
+        BUFFER_INDEX.buffer_removed.connect(self._on_buffer_removed)
+        BUFFER_INDEX.buffer_used.connect(self._on_buffer_used)
+        BUFFER_INDEX.buffer_changed.connect(self._on_buffer_changed)
+        placeholder_discarded.add(self._on_buffer_removed)
+        restore_started.add(self._on_restore_started)
+
+    def _entries(self):
+        if self._recent:
+            # sorted like BUFFER_INDEX.recent
+            return sorted(session_entries(), key=lambda b: b.last_use,
+                          reverse=True)
+        return list(session_entries())
+
+    def _on_restore_started(self):
+        self.beginResetModel()
+        self._buffers = self._entries()
+        self.endResetModel()
+
+    def _row_for(self, buffer):
+        """
+        Returns the row of a buffer to be inserted.
+        """
+        if not self._recent:
+            position = BUFFER_INDEX.position(buffer)
+            if position == 0:
+                return 0
+            return self._buffers.index(BUFFERS[position - 1]) + 1
+        # as BufferIndex._insert_recent
+        row = 0
+        while row < len(self._buffers) \
+                and self._buffers[row].last_use > buffer.last_use:
+            row += 1
+        return row
+
+    def _positions_changed(self):
+        # the buffer numbers displayed in the second column
+        if self._buffers:
+            self.dataChanged.emit(self.index(0, 1),
+                                  self.index(len(self._buffers) - 1, 1))
+
+    def _on_buffer_added(self, buffer):
+        placeholder = restoring_placeholder()
+        if placeholder is not None:
+            # a buffer of the session is created, at the placeholder row
+            row = self._buffers.index(placeholder)
+            self._buffers[row] = buffer
+            self.dataChanged.emit(self.index(row, 0), self.index(row, 1))
+            self._positions_changed()
+            return
+        row = self._row_for(buffer)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._buffers.insert(row, buffer)
+        self.endInsertRows()
+        self._positions_changed()
+
+    def _on_buffer_removed(self, buffer):
+        row = self._buffers.index(buffer)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self._buffers.pop(row)
+        self.endRemoveRows()
+        self._positions_changed()
+
+    def _on_buffer_used(self, buffer):
+        if not self._recent:
+            return
+        old = self._buffers.index(buffer)
+        del self._buffers[old]
+        new = self._row_for(buffer)
+        self._buffers.insert(old, buffer)
+        if old == new:
+            return
+        self.beginMoveRows(QModelIndex(), old, old, QModelIndex(),
+                           new + 1 if new > old else new)
+        self._buffers.insert(new, self._buffers.pop(old))
+        self.endMoveRows()
+
+    def _on_buffer_changed(self, buffer):
+        row = self._buffers.index(buffer)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, 1))
+
+    def buffers(self):
+        return self._buffers
 
     def rowCount(self, index=QModelIndex()):
         return len(self._buffers)
@@ -62,8 +158,12 @@ class BufferTableModel(QAbstractTableModel):
         if role == Qt.ItemDataRole.DisplayRole:
             if col == 0:
                 return buff.url().toString()
+            elif isinstance(buff, BufferPlaceholder):
+                # not created, so without position
+                return buff.title()
             else:
-                return "[{}] {}".format(BUFFERS.index(buff) + 1, buff.title())
+                return "[{}] {}".format(BUFFER_INDEX.position(buff) + 1,
+                                        buff.title())
         elif role == Qt.ItemDataRole.DecorationRole and col == 0:
             return buff.icon()
         elif role == Qt.ItemDataRole.BackgroundRole:
@@ -78,15 +178,30 @@ class BufferTableModel(QAbstractTableModel):
             return QModelIndex()
 
     def close_buffer_at(self, index):
+        # the row is removed when the buffer is closed
+        buff = self._buffers[index.row()]
+        if isinstance(buff, BufferPlaceholder):
+            buff.discard()
+            return
         try:
-            if not close_buffer(self._buffers[index.row()]):
-                return
+            close_buffer(buff)
         except ValueError:
-            return
+            pass
 
-        self.beginRemoveRows(QModelIndex(), index.row(), index.row())
-        self._buffers.pop(index.row())
-        self.endRemoveRows()
+
+_BUFFER_TABLE_MODELS = {}
+
+
+def buffer_table_model(recent=False):
+    """
+    Returns the shared BufferTableModel, ordered by position or by most
+    recent use.
+    """
+    try:
+        return _BUFFER_TABLE_MODELS[recent]
+    except KeyError:
+        model = _BUFFER_TABLE_MODELS[recent] = BufferTableModel(recent)
+        return model
 
 
 @define_command("buffer-list-delete-highlighted")
@@ -113,14 +228,23 @@ class BufferListPrompt(Prompt):
     keymap = BUFFERLIST_KEYMAP
     value_return_index_data = True
 
+    recent = False
+
     def completer_model(self):
-        return BufferTableModel(self.ordered_buffers())
+        return buffer_table_model(self.recent)
+
+    def value(self):
+        buffer = Prompt.value(self)
+        if isinstance(buffer, BufferPlaceholder):
+            # selected, so it is needed
+            buffer = buffer.create()
+        return buffer
 
     def ordered_buffers(self):
         """
         How to display buffers.
         """
-        return BUFFERS
+        return buffer_table_model(self.recent).buffers()
 
     def enable(self, minibuffer):
         Prompt.enable(self, minibuffer)
@@ -129,13 +253,16 @@ class BufferListPrompt(Prompt):
         index = buffers.index(current_buffer()) + 1
         if index >= len(buffers):
             index = 0
-        minibuffer.input().popup().selectRow(index)
+        minibuffer.input().select_source_row(index)
 
+    def close(self):
+        # the model is shared, do not let Prompt.close delete it
+        self.minibuffer.input().set_completer_model(None)
+        Prompt.close(self)
 
-class RecentBufferListPrompt(BufferListPrompt):
 
-    def ordered_buffers(self):
-        return recent_buffers()
+class RecentBufferListPrompt(BufferListPrompt):
+    recent = True
 
 
 class BufferSwitchListPrompt(BufferListPrompt):
@@ -153,7 +280,8 @@ class BufferKillListPrompt(BufferListPrompt):
         Prompt.enable(self, minibuffer)
         # auto-select the currently visible buffer
         buffers = self.ordered_buffers()
-        minibuffer.input().popup().selectRow(buffers.index(current_buffer()))
+        minibuffer.input().select_source_row(
+            buffers.index(current_buffer()))
 
 
 def show_buffer(buffer, view):
@@ -196,12 +324,8 @@ def _next_buffer(ctx, reverse=False):
     if len(BUFFERS) <= 1:
         return
 
-    buffers = itertools.cycle(reversed(BUFFERS) if reverse else BUFFERS)
-    next_b = next(buffers)
-    while next_b != ctx.buffer:
-        next_b = next(buffers)
-
-    show_buffer(next(buffers), ctx.view)
+    position = BUFFER_INDEX.position(ctx.buffer) + (-1 if reverse else 1)
+    show_buffer(BUFFERS[position % len(BUFFERS)], ctx.view)
 
 
 @define_command("next-buffer")
@@ -220,6 +344,19 @@ def previous_buffer(ctx):
     _next_buffer(ctx, reverse=True)
 
 
+@define_command("hibernate-buffers")
+def hibernate_all_buffers(ctx):
+    """
+    Hibernate every buffer not displayed, releasing their page from memory.
+
+    The buffers are loaded again when displayed, restoring their navigation
+    history and scroll position.
+    """
+    count, reclaimed = hibernate_buffers(BUFFER_INDEX.recent[::-1])
+    ctx.minibuffer.show_info("Hibernated %d buffers, reclaiming about %s."
+                             % (count, format_memory(reclaimed)))
+
+
 class OpenDevToolsPrompt(BufferListPrompt):
     label = "open dev tools for buffer:"
     keymap = None
@@ -227,7 +364,7 @@ class OpenDevToolsPrompt(BufferListPrompt):
     def enable(self, minibuffer):
         Prompt.enable(self, minibuffer)
         # auto-select the currently visible buffer
-        minibuffer.input().popup().selectRow(0)
+        minibuffer.input().select_source_row(0)
 
 
 @define_command("open-dev-tools")
@@ -370,6 +507,7 @@ def close_other_buffers(ctx):
     buffer = ctx.minibuffer.do_prompt(BufferKillListPrompt(ctx))
     if buffer:
         # Get all other buffers and kill them
+        discard_placeholders()
         for wb in [b for b in BUFFERS if b != buffer]:
             close_buffer(wb)
 
@@ -512,7 +650,7 @@ class KilledBufferListPrompt(Prompt):
     def enable(self, minibuffer):
         Prompt.enable(self, minibuffer)
         if KilledBuffer.all:
-            minibuffer.input().popup().selectRow(0)
+            minibuffer.input().select_source_row(0)
 
 
 @define_command("revive-buffer")
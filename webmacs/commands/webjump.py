@@ -18,11 +18,13 @@ import logging
 from collections import namedtuple
 
 from PyQt6.QtCore import QUrl, pyqtSlot as Slot, \
-    pyqtSignal as Signal, QStringListModel, QObject, QEvent, Qt
+    pyqtSignal as Signal, QStringListModel, QObject, QEvent, Qt, QTimer, \
+    QByteArray
 from PyQt6.QtNetwork import QNetworkRequest
 
 from ..commands import define_command
 from ..minibuffer.prompt import Prompt, PromptTableModel, PromptHistory
+from ..minibuffer.completion import CompletionCache
 from .. keymaps import WEBJUMP_KEYMAP
 from ..commands import register_prompt_opener_commands
 from .. import current_buffer
@@ -43,6 +45,35 @@ webjump_default = variables.define_variable(
     type=variables.String(choices=WEBJUMPS),
 )
 
+webjump_completion_delay = variables.define_variable(
+    "webjump-completion-delay",
+    "Time to wait (in milliseconds) after a key press before requesting"
+    " completions to a web service, so that typing quickly sends only one"
+    " request.",
+    150,
+    type=variables.Int(min=0),
+)
+
+webjump_completion_cache_ttl = variables.define_variable(
+    "webjump-completion-cache-ttl",
+    "How long (in seconds) the completions of a web service are kept, to be"
+    " reused when the same text is typed again. Set to 0 to disable the"
+    " cache.",
+    600,
+    type=variables.Int(min=0),
+)
+
+webjump_local_completions = variables.define_variable(
+    "webjump-local-completions",
+    "Maximum number of bookmarks and visited links proposed by the http and"
+    " https webjumps completion, before the suggestions of the web service.",
+    10,
+    type=variables.Int(min=0),
+)
+
+# completion request url -> reply body, shared by every webjump
+COMPLETION_CACHE = CompletionCache(256)
+
 
 def define_webjump(name, url, doc="", complete_fn=None, protocol=False):
     """
@@ -161,7 +192,11 @@ class WebJumpRequestCompleter(WebJumpCompleter):
     """
     A completer that executes a Web request to provide completion.
 
-    This completer will not block the UI.
+    This completer will not block the UI. The request is only sent once no
+    key has been pressed for a short delay (the *webjump-completion-delay*
+    variable), and a new completion aborts the running request. The replies
+    are cached (see the *webjump-completion-cache-ttl* variable), so typing
+    the same text again does not use the network.
 
     :param url_fn: a function that takes the text to complete, and returns a
         URL that will provide completion. The returned value can be none
@@ -169,43 +204,115 @@ class WebJumpRequestCompleter(WebJumpCompleter):
     :param extract_completions_fn: a function that takes the bytes of the
         request reply, and must convert them to the completions
         (a string list).
+    :param delay: the delay in milliseconds before sending a request, for
+        this completer. Defaults to the *webjump-completion-delay* variable.
     """
 
-    def __init__(self, url_fn, extract_completions_fn):
+    def __init__(self, url_fn, extract_completions_fn, delay=None):
         WebJumpCompleter.__init__(self)
         self.url_fn = url_fn
         self.extract_completions_fn = extract_completions_fn
+        self.delay = delay
         self.reply = None
+        self._url = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._send_request)
 
     def complete(self, text):
+        self.abort()
         url = self.url_fn(text)
         if not url:
             self.completed.emit([])
             return
         elif not isinstance(url, QUrl):
             url = QUrl(url)
-        req = QNetworkRequest(QUrl(url))
-        self.reply = app().network_manager.get(req)
+        data = COMPLETION_CACHE.get(url.toString())
+        if data is not None:
+            self._extract(url, data)
+            return
+        self._url = url
+        self._timer.start(webjump_completion_delay.value
+                          if self.delay is None else self.delay)
+
+    def _send_request(self):
+        self.reply = app().network_manager.get(QNetworkRequest(self._url))
         self.reply.finished.connect(self._on_reply_finished)
 
     def abort(self):
+        self._timer.stop()
         if self.reply:
-            self.reply.abort()
+            reply, self.reply = self.reply, None
+            reply.finished.disconnect(self._on_reply_finished)
+            reply.abort()
+            reply.deleteLater()
+
+    def _extract(self, url, data):
+        try:
+            completions = self.extract_completions_fn(QByteArray(data))
+        except Exception:
+            logging.exception(
+                "Error when trying to extract completions from %s"
+                % url.toString()
+            )
+            self.completed.emit([])
+            return False
+        self.completed.emit(completions)
+        return True
 
     def _on_reply_finished(self):
-        if self.reply.error() == self.reply.NetworkError.NoError:
-            try:
-                completions = self.extract_completions_fn(self.reply.readAll())
-            except Exception:
-                logging.exception(
-                    "Error when trying to extract completions from %s"
-                    % self.reply.url().toString()
-                )
-                completions = []
-            self.completed.emit(completions)
+        reply, self.reply = self.reply, None
+        if reply.error() == reply.NetworkError.NoError:
+            data = reply.readAll().data()
+            if self._extract(self._url, data):
+                COMPLETION_CACHE.set(self._url.toString(), data,
+                                     webjump_completion_cache_ttl.value)
+        reply.deleteLater()
 
-        self.reply.deleteLater()
-        self.reply = None
+
+class MergedWebJumpCompleter(WebJumpCompleter):
+
+    """
+    A completer that merges the completions of other completers.
+
+    The completions are emitted as soon as one of the completers gives
+    its completions, so that the fast (local) completers do not wait for
+    the slow (remote) ones. Completions are ordered by the priority of
+    their completer, and duplicates (ignoring a trailing slash) are removed.
+
+    :param completers: the completers, from the highest priority to the
+        lowest.
+    """
+
+    def __init__(self, *completers):
+        WebJumpCompleter.__init__(self)
+        self.completers = completers
+        self._completions = [[] for _ in completers]
+        for i, completer in enumerate(completers):
+            completer.setParent(self)
+            completer.completed.connect(
+                lambda completions, i=i: self._on_completed(i, completions))
+
+    def complete(self, text):
+        self._completions = [[] for _ in self.completers]
+        for completer in self.completers:
+            completer.complete(text)
+
+    def abort(self):
+        for completer in self.completers:
+            completer.abort()
+
+    def _on_completed(self, index, completions):
+        self._completions[index] = completions
+        merged = []
+        seen = set()
+        for completions in self._completions:
+            for completion in completions:
+                key = completion.rstrip("/")
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(completion)
+        self.completed.emit(merged)
 
 
 @define_command("webjump-complete")
@@ -226,7 +333,7 @@ class WebJumpPrompt(Prompt):
     complete_options = {
         "match": Prompt.SimpleMatch
     }
-    history = PromptHistory()
+    history = PromptHistory(name="webjump")
     keymap = WEBJUMP_KEYMAP
     default_input = "alternate"
 
@@ -342,6 +449,15 @@ class WebJumpPrompt(Prompt):
             self.minibuffer.input().show_completions(text[len(prefix):])
 
     def close(self):
+        # a delayed or running completion request must not call back once
+        # the models are deleted
+        if self._completer:
+            self._completer.completed.disconnect(self._got_completions)
+            self._completer.abort()
+            self._completer.deleteLater()
+            self._completer = None
+        self._active_webjump = None
+        self.minibuffer.input().textEdited.disconnect(self._text_edited)
         Prompt.close(self)
         self.minibuffer.input().removeEventFilter(self)
         # not sure if those are required;
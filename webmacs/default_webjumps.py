@@ -14,11 +14,14 @@
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import itertools
 
 from PyQt6.QtCore import QUrl
 
 from .commands.webjump import define_webjump, define_protocol, \
-    webjump_default, WebJumpRequestCompleter, SyncWebJumpCompleter
+    webjump_default, WebJumpRequestCompleter, SyncWebJumpCompleter, \
+    MergedWebJumpCompleter, WebJumpCompleter, webjump_local_completions
+from .application import app
 from .minibuffer.prompt import FSModel
 from .scheme_handlers.webmacs import PAGES as webmacs_pages
 
@@ -47,16 +50,34 @@ define_webjump("google",
 # ----------- end of doc example
 
 
-def complete_fs():
-    model = FSModel()
+class FSCompleter(WebJumpCompleter):
+    """
+    Complete local paths. The directories are listed in a thread, the
+    completions are given again each time files are found.
+    """
 
-    def _complete(text):
-        model.text_changed(text)
+    def __init__(self):
+        WebJumpCompleter.__init__(self)
+        self.text = ""
+        self.model = FSModel(self)
+        self.model.modelReset.connect(self._emit_completions)
+        self.model.rowsInserted.connect(self._emit_completions)
+
+    def complete(self, text):
+        self.text = text
+        self.model.text_changed(text)
+        self._emit_completions()
+
+    def _emit_completions(self, *args):
+        model = self.model
         dircontent = [model.data(model.index(i, 0))
                       for i in range(model.rowCount())]
-        return [c for c in dircontent if c.startswith(text)]
+        self.completed.emit([c for c in dircontent
+                             if c.startswith(self.text)])
 
-    return SyncWebJumpCompleter(_complete)
+
+def complete_fs():
+    return FSCompleter()
 
 
 define_protocol("file",
@@ -75,9 +96,26 @@ define_protocol("webmacs",
                 complete_fn=complete_pages)
 
 
+def complete_local_urls(protocol):
+    """
+    Complete with the bookmarks, then the visited links (the most frecent
+    first) having the given protocol.
+    """
+    def _complete(text):
+        urls = itertools.chain(
+            (url for url, _ in app().bookmarks().search(text)),
+            (url for url, _ in app().visitedlinks().search(text)),
+        )
+        return list(itertools.islice(
+            (url[len(protocol):] for url in urls if url.startswith(protocol)),
+            webjump_local_completions.value))
+
+    return SyncWebJumpCompleter(_complete)
+
+
 def complete_protocol(protocol):
 
-    def complete():
+    def complete_remote():
         completer = complete_google()
         extract_fn = completer.extract_completions_fn
         url_fn = completer.url_fn
@@ -90,6 +128,12 @@ def complete_protocol(protocol):
         completer.url_fn \
             = lambda text: url_fn(protocol + text)
         return completer
+
+    def complete():
+        # bookmarks and history are given at once, the web suggestions are
+        # merged after them when they arrive.
+        return MergedWebJumpCompleter(complete_local_urls(protocol),
+                                      complete_remote())
     return complete
 
 
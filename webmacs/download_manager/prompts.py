@@ -45,7 +45,7 @@ class DlChooseActionPrompt(Prompt):
 
     def enable(self, minibuffer):
         super().enable(minibuffer)
-        minibuffer.input().popup().selectRow(0)
+        minibuffer.input().select_source_row(0)
 
 
 class DlOpenActionPrompt(Prompt):
@@ -205,15 +205,23 @@ class ViewGridLayout(QLayout):
 
         return item_dump_state(self._root)
 
-    def restore_state(self, grid_data):
+    def restore_state(self, grid_data, get_buffer=None):
+        """
+        Restore the views given by dump_state. get_buffer returns the
+        buffer for an index of the dumped state, by default the index in
+        BUFFERS.
+        """
         main_view = self._current_view
+        if get_buffer is None:
+            get_buffer = BUFFERS.__getitem__
 
         def restore(data, view):
             split = data.get("split")
 
             if split is None:
                 # attach the buffer to the view.
-                view.setBuffer(BUFFERS[data["buffer"]], update_last_use=False)
+                view.setBuffer(get_buffer(data["buffer"]),
+                               update_last_use=False)
                 if data.get("current"):
                     self._current_view = view
 
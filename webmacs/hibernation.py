@@ -0,0 +1,289 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hibernation of the buffers not used for some time, or the least recently
+used ones when webmacs uses too much memory.
+
+A hibernated buffer releases its renderer (see WebBuffer.hibernate), and is
+loaded again when displayed.
+
+The buffers hidden for some time can also be frozen (their javascript timers
+and rendering stopped), then hibernated, following the lifecycle states
+recommended by Qt.
+"""
+
+import os
+import time
+import logging
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSlot as Slot
+
+from . import BUFFER_INDEX, variables
+
+
+def _update_policy(_):
+    HIBERNATION.update()
+
+
+def _update_lifecycle_policy(_):
+    LIFECYCLE.update()
+
+
+hibernation_idle_time = variables.define_variable(
+    "buffer-hibernation-idle-time",
+    "Time in minutes after which a buffer not used is hibernated: its page"
+    " is released from memory, and loaded again when displayed. 0 to"
+    " disable.",
+    0,
+    type=variables.Int(min=0),
+    callbacks=(_update_policy,),
+)
+
+hibernation_memory_budget = variables.define_variable(
+    "buffer-hibernation-memory-budget",
+    "Memory in MiB used by webmacs and its web pages above which the least"
+    " recently used buffers are hibernated. 0 to disable. Only supported on"
+    " linux.",
+    0,
+    type=variables.Int(min=0),
+    callbacks=(_update_policy,),
+)
+
+freeze_delay = variables.define_variable(
+    "buffer-freeze-delay",
+    "Time in seconds after which a buffer hidden (not displayed in any view)"
+    " is frozen: its javascript timers and rendering are stopped until it is"
+    " displayed again. Buffers playing audio are not frozen. 0 to disable.",
+    0,
+    type=variables.Int(min=0),
+    callbacks=(_update_lifecycle_policy,),
+)
+
+discard_delay = variables.define_variable(
+    "buffer-discard-delay",
+    "Time in minutes after which a buffer hidden (not displayed in any view)"
+    " is hibernated, if nothing would be lost (like a form input). 0 to"
+    " disable.",
+    0,
+    type=variables.Int(min=0),
+    callbacks=(_update_lifecycle_policy,),
+)
+
+
+# interval in seconds between two checks of the buffers to hibernate
+CHECK_INTERVAL = 60
+
+# interval in seconds between two checks of the buffers to freeze or discard
+LIFECYCLE_CHECK_INTERVAL = 30
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def process_memory(pid):
+    """
+    Returns the resident memory of the given process in bytes, or 0 when
+    unknown.
+    """
+    try:
+        with open("/proc/%d/statm" % pid) as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _renderers(buffers):
+    """
+    Returns a dict of render process pid: buffers using it.
+    """
+    renderers = {}
+    for buffer in buffers:
+        if buffer.delayed_loading_url() is None:
+            pid = buffer.renderProcessPid()
+            if pid:
+                renderers.setdefault(pid, []).append(buffer)
+    return renderers
+
+
+def _releasable(users):
+    # a renderer is kept while one of its pages can not be hibernated
+    return not any(b.isVisible() or b.recentlyAudible() for b in users)
+
+
+def hibernate_buffers(buffers, memory_target=None):
+    """
+    Hibernate the given buffers, in order.
+
+    The memory of a renderer is reclaimed once every buffer it renders is
+    hibernated (renderers are shared by pages of the same site), and it has
+    exited. So if memory_target is given and the memory used is above it,
+    only the buffers of the renderers that can be released are hibernated,
+    stopping at the first renderer released: the memory used is measured
+    again on the next call.
+
+    Returns the number of buffers hibernated and an estimate of the memory
+    reclaimed, in bytes: the memory used by the renderers released, before
+    they exit.
+    """
+    renderers = _renderers(BUFFER_INDEX.recent)
+    # measured while every renderer is alive
+    sizes = {pid: process_memory(pid) for pid in renderers}
+    if memory_target is not None \
+       and process_memory(os.getpid()) + sum(sizes.values()) <= memory_target:
+        return 0, 0
+
+    count = reclaimed = 0
+    for buffer in buffers:
+        pid = buffer.renderProcessPid()
+        users = renderers.get(pid)
+        if memory_target is not None and not (users and _releasable(users)):
+            continue
+        if buffer.recentlyAudible() or not buffer.hibernate():
+            continue
+        count += 1
+        if users and buffer in users:
+            users.remove(buffer)
+            if not users:
+                del renderers[pid]
+                reclaimed += sizes[pid]
+                if memory_target is not None:
+                    break
+    return count, reclaimed
+
+
+def format_memory(size):
+    return "%.1f MiB" % (size / (1024 * 1024))
+
+
+class HibernationPolicy(QObject):
+    """
+    Regularly hibernate the buffers, according to the
+    buffer-hibernation-idle-time and buffer-hibernation-memory-budget
+    variables.
+    """
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.check)
+
+    def update(self):
+        """
+        Start or stop the regular checks, as the variables changed.
+        """
+        if hibernation_idle_time.value or hibernation_memory_budget.value:
+            if not self._timer.isActive():
+                self._timer.start(CHECK_INTERVAL * 1000)
+        else:
+            self._timer.stop()
+
+    @Slot()
+    def check(self):
+        # the least recently used first
+        buffers = BUFFER_INDEX.recent[::-1]
+        count = reclaimed = 0
+
+        idle_time = hibernation_idle_time.value
+        if idle_time:
+            limit = time.time() - idle_time * 60
+            idle = [b for b in buffers if b.last_use < limit]
+            count, reclaimed = hibernate_buffers(idle)
+
+        budget = hibernation_memory_budget.value
+        if budget:
+            n, r = hibernate_buffers(buffers, budget * 1024 * 1024)
+            count += n
+            reclaimed += r
+
+        if count:
+            logging.info("Hibernated %d buffers, reclaiming about %s.",
+                         count, format_memory(reclaimed))
+
+
+class LifecyclePolicy(QObject):
+    """
+    Freeze, then hibernate the buffers hidden for some time, according to
+    the buffer-freeze-delay and buffer-discard-delay variables.
+
+    The buffers are thawed when displayed (see WebView.setBuffer).
+    """
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        # the time when each buffer was hidden
+        self._hidden = {}
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.check)
+        BUFFER_INDEX.buffer_added.connect(self._on_buffer_added)
+        BUFFER_INDEX.buffer_removed.connect(self._on_buffer_removed)
+
+    def update(self):
+        """
+        Start or stop the regular checks, as the variables or the hidden
+        buffers changed.
+        """
+        if self._hidden and (freeze_delay.value or discard_delay.value):
+            if not self._timer.isActive():
+                self._timer.start(LIFECYCLE_CHECK_INTERVAL * 1000)
+        else:
+            self._timer.stop()
+
+    @Slot(object)
+    def _on_buffer_added(self, buffer):
+        buffer.visibleChanged.connect(self._on_visible_changed)
+        if not buffer.isVisible():
+            self._hidden[buffer] = time.time()
+            self.update()
+
+    @Slot(object)
+    def _on_buffer_removed(self, buffer):
+        if self._hidden.pop(buffer, None) is not None:
+            self.update()
+
+    @Slot(bool)
+    def _on_visible_changed(self, visible):
+        buffer = self.sender()
+        if visible:
+            self._hidden.pop(buffer, None)
+        else:
+            self._hidden[buffer] = time.time()
+        self.update()
+
+    @Slot()
+    def check(self):
+        now = time.time()
+        freeze = freeze_delay.value
+        discard = discard_delay.value * 60
+        frozen = hibernated = 0
+        for buffer, hidden in list(self._hidden.items()):
+            elapsed = now - hidden
+            if discard and elapsed >= discard and buffer.can_discard() \
+               and buffer.hibernate():
+                hibernated += 1
+                # nothing else to do until displayed again
+                del self._hidden[buffer]
+            elif freeze and elapsed >= freeze and buffer.freeze():
+                frozen += 1
+        if frozen or hibernated:
+            logging.debug("Froze %d buffers and hibernated %d.",
+                          frozen, hibernated)
+            self.update()
+
+
+HIBERNATION = HibernationPolicy()
+LIFECYCLE = LifecyclePolicy()
@@ -43,3 +43,5 @@ local_mode_changed = Hook()
 window_activated = Hook()
 
 window_closed = Hook()
+
+user_input = Hook()
@@ -25,6 +25,12 @@ from . import COMMANDS, minibuffer_show_info, current_minibuffer, \
 from .mode import Mode
 
 
+# the events calling the user_input hook
+USER_INPUT_EVENTS = frozenset((QEvent.Type.KeyPress,
+                               QEvent.Type.MouseButtonPress,
+                               QEvent.Type.Wheel))
+
+
 class CommandContext(object):
     def __init__(self):
         self.window = current_window()
@@ -49,6 +55,9 @@ class LocalKeymapSetter(QObject):
         # event filter on the global app is required to avoid click on webviews
         t = evt.type()
 
+        if t in USER_INPUT_EVENTS and isinstance(obj, QWindow):
+            hooks.user_input(evt)
+
         if t == QEvent.Type.KeyPress and isinstance(obj, QWindow):
             return KEY_EATER.event_filter(obj, evt)
         elif t == QEvent.Type.ShortcutOverride:
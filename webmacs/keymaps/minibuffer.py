@@ -28,6 +28,7 @@ KEYMAP.define_key("C-v", "minibuffer-select-next-page")
 KEYMAP.define_key("M-v", "minibuffer-select-prev-page")
 KEYMAP.define_key("M-n", "minibuffer-history-next")
 KEYMAP.define_key("M-p", "minibuffer-history-prev")
+KEYMAP.define_key("M-r", "minibuffer-history-search")
 KEYMAP.define_key("Return", "minibuffer-validate")
 KEYMAP.define_key("C-g", "minibuffer-abort")
 KEYMAP.define_key("Esc", "minibuffer-abort")
@@ -14,7 +14,6 @@
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
-from PyQt6.QtCore import QDataStream, QByteArray, QIODevice
 from .webbuffer import create_buffer
 from . import variables, hooks
 
@@ -51,26 +50,21 @@ class KilledBuffer(object):
 
     @classmethod
     def from_buffer(cls, buff):
-        data = QByteArray()
-        stream = QDataStream(data, QIODevice.OpenModeFlag.WriteOnly)
-        stream << buff.history()
-
         return cls(
             buff.url(),
             buff.title(),
             buff.icon(),
-            data,
+            buff.history_data(),
             buff.delayed_loading_url()
         )
 
     def revive(self):
         buff = create_buffer()
-        stream = QDataStream(self.history_data,
-                             QIODevice.OpenModeFlag.ReadOnly)
-        stream >> buff.history()
         self.all.remove(self)
 
-        if self.delayed:
+        if self.history_data:
+            buff.restore_history(self.history_data)
+        elif self.delayed:
             buff.load(self.delayed.url)
         return buff
 
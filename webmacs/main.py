@@ -25,7 +25,7 @@ import warnings
 from PyQt6.QtNetwork import QAbstractSocket
 
 from .ipc import IpcServer
-from . import variables, filter_webengine_output
+from . import variables, filter_webengine_output, call_later
 
 
 log_to_disk = variables.define_variable(
@@ -168,11 +168,16 @@ def init(opts):
     :param opts: the result of the parsed command line.
     """
     from .application import app
-    from .session import session_load, session_save
+    from .session import session_load, session_save, SessionAutosave
     from .window import Window
     from .webbuffer import create_buffer
 
     a = app()
+    if a.profile.session_file:
+        autosave = SessionAutosave(a.profile.session_file, a)
+        a.aboutToQuit.connect(autosave.stop)
+        # once the buffers and windows below are created
+        call_later(autosave.start)
     a.aboutToQuit.connect(lambda: session_save(a.profile.session_file))
 
     def create_window(url):
@@ -17,11 +17,11 @@ from PyQt6.QtWidgets import QWidget, QLineEdit, QHBoxLayout, QLabel, \
     QTableView, QHeaderView, QApplication, QSizePolicy, QFrame
 from PyQt6.QtGui import QPainter
 from PyQt6.QtCore import pyqtSignal as Signal, \
-    QEvent, QSortFilterProxyModel, QRegularExpression, Qt, QModelIndex, \
-    pyqtProperty
+    QEvent, Qt, QModelIndex, pyqtProperty
 
 from ..keymaps import MINIBUFFER_KEYMAP as KEYMAP
 from .prompt import Prompt
+from .completion import CompletionProxyModel, MatchDelegate
 from .. import variables
 from .. import windows
 from ..keyboardhandler import LOCAL_KEYMAP_SETTER
@@ -52,6 +52,7 @@ class Popup(QTableView):
         self.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
         self.setSelectionMode(QTableView.SelectionMode.SingleSelection)
         self.setShowGrid(False)
+        self.setItemDelegate(MatchDelegate(self))
         self._max_visible_items = 10
 
     def _resize(self, size):
@@ -98,8 +99,11 @@ class MinibufferInput(QLineEdit):
         self._popup.installEventFilter(self)
         self.installEventFilter(self)
         self._eat_focusout = False
-        self._proxy_model = QSortFilterProxyModel(self)
-        self._proxy_model.setFilterKeyColumn(-1)
+        self._proxy_model = CompletionProxyModel(self)
+        self._proxy_model.filtered.connect(self._on_filtered)
+        self._completions_requested = False
+        # the row of the completer model to select once filtered
+        self._row_to_select = None
         self._popup.setModel(self._proxy_model)
         self._popup.activated.connect(self._on_completion_activated)
         self._popup.selectionModel().currentRowChanged.connect(
@@ -176,26 +180,41 @@ class MinibufferInput(QLineEdit):
             self.complete(hide_popup=False)
 
     def _show_completions(self, txt, force=False):
-        force = force or self._complete_empty
-        if self._match is not None:
-            if self._match == self.SimpleMatch:
-                pattern = "^" + QRegularExpression.escape(txt)
-            elif self._match == self.FuzzyMatch:
-                pattern = ".*".join(QRegularExpression.escape(t)
-                                    for t in txt.split())
-            self._proxy_model.setFilterRegularExpression(QRegularExpression(
-                pattern,
-                QRegularExpression.PatternOption.CaseInsensitiveOption
-            ))
-        else:
-            self._proxy_model.setFilterRegularExpression(None)
-
-        if self._proxy_model.rowCount() == 0:
-            self._popup.hide()
-        elif not txt and not force:
-            self._popup.hide()
-        else:
-            self._popup.popup()
+        self._completions_requested = True
+        self._force_completions = force or self._complete_empty
+        # the popup is updated once the rows are filtered, see _on_filtered
+        self._proxy_model.set_filter(txt, self._match)
+
+    def _on_filtered(self):
+        if self._completions_requested:
+            self._completions_requested = False
+            if self._proxy_model.rowCount() == 0:
+                self._popup.hide()
+            elif not self._proxy_model.filter_text() \
+                    and not self._force_completions:
+                self._popup.hide()
+            else:
+                self._popup.popup()
+        self._select_row()
+
+    def select_source_row(self, row):
+        """
+        Select the completion of the given row of the completer model. If
+        the completions are being filtered in a thread, it is selected once
+        they are filtered.
+        """
+        self._row_to_select = row
+        if not self._proxy_model.pending():
+            self._select_row()
+
+    def _select_row(self):
+        row, self._row_to_select = self._row_to_select, None
+        model = self.completer_model()
+        if row is None or model is None:
+            return
+        index = self._proxy_model.mapFromSource(model.index(row, 0))
+        if index.isValid():
+            self._popup.selectRow(index.row())
 
     def show_completions(self, filter_text=None):
         self._show_completions(
@@ -221,7 +240,10 @@ class MinibufferInput(QLineEdit):
         index = self._popup.selectionModel().currentIndex()
         if index.isValid():
             self._on_completion_activated(index, hide_popup=hide_popup)
-        elif self._autocomplete_single and self._proxy_model.rowCount() == 1:
+            return
+        # do not complete with the rows of a previous input
+        self._proxy_model.flush()
+        if self._autocomplete_single and self._proxy_model.rowCount() == 1:
             self._on_completion_activated(self._proxy_model.index(0, 0),
                                           hide_popup=hide_popup)
 
@@ -238,6 +260,9 @@ class MinibufferInput(QLineEdit):
             row = selection.row()
             if forward:
                 row = row + steps
+                if row >= entries and model.canFetchMore(QModelIndex()):
+                    model.fetchMore(QModelIndex())
+                    entries = model.rowCount()
                 if row >= entries:
                     row = 0
             else:
@@ -268,6 +293,8 @@ class MinibufferInput(QLineEdit):
         return self._mark
 
     def reinit(self):
+        self._completions_requested = False
+        self._row_to_select = None
         self.setText("")
         self.setEchoMode(self.EchoMode.Normal)
         self.setValidator(None)
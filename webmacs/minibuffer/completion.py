@@ -0,0 +1,611 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import copy
+import logging
+import time
+from collections import OrderedDict
+
+from PyQt6.QtCore import QAbstractProxyModel, QAbstractListModel, \
+    QModelIndex, Qt, QRect, QObject, QThreadPool, pyqtSignal as Signal, \
+    pyqtSlot as Slot
+from PyQt6.QtGui import QFont, QFontMetrics, QPalette
+from PyQt6.QtWidgets import QStyledItemDelegate, QStyleOptionViewItem, \
+    QStyle, QApplication
+
+from .matcher import FuzzyMatcher, Match, Cancelled, cancellable
+from .prompt import Prompt
+
+
+# the data role giving the positions of the matched characters of a cell
+MATCH_POSITIONS_ROLE = Qt.ItemDataRole.UserRole + 1
+
+
+def _simple_match(matcher, index, text):
+    for column, value in enumerate(matcher.candidate(index)):
+        if isinstance(value, str) and value.lower().startswith(text):
+            return Match(index, 0, column, list(range(len(text))))
+    return None
+
+
+def _filter_rows(matcher, text, match, indexes=None, cancelled=None):
+    if match == Prompt.FuzzyMatch:
+        return matcher.match(text, indexes, cancelled)
+    if indexes is None:
+        indexes = range(len(matcher))
+    indexes = cancellable(indexes, cancelled)
+    if match == Prompt.SimpleMatch and text:
+        text = text.lower()
+        return [m for m in (_simple_match(matcher, i, text) for i in indexes)
+                if m is not None]
+    return [Match(i, 0, 0, []) for i in indexes]
+
+
+def _safe_filter_rows(matcher, text, match, indexes=None, cancelled=None):
+    """
+    Like _filter_rows, but an error (e.g. from the data of a model) is
+    logged, and no rows are matched.
+    """
+    try:
+        return _filter_rows(matcher, text, match, indexes, cancelled)
+    except Cancelled:
+        raise
+    except Exception:
+        logging.exception("Unable to filter the completions with %r", text)
+        return []
+
+
+class _FilterJob(QObject):
+    """
+    Filter a snapshot of the candidates, in a thread of the QThreadPool.
+    """
+    finished = Signal(object, object)
+
+    def __init__(self, matcher, text, match):
+        QObject.__init__(self)
+        self.matcher = matcher
+        self.text = text
+        self.match = match
+        self.cancelled = False
+
+    def is_cancelled(self):
+        return self.cancelled
+
+    def run(self):
+        try:
+            matches = _safe_filter_rows(self.matcher, self.text, self.match,
+                                        cancelled=self.is_cancelled)
+        except Cancelled:
+            return
+        self.finished.emit(self, matches)
+
+
+class CompletionProxyModel(QAbstractProxyModel):
+    """
+    Filter the rows of the completion model given the text typed in the
+    minibuffer input.
+
+    With Prompt.SimpleMatch, the rows having a column starting with the
+    text are kept, in their order. With Prompt.FuzzyMatch, the rows are
+    scored by a FuzzyMatcher and sorted, the best first. Without matching
+    (None), every row is kept.
+
+    With ASYNC_THRESHOLD candidates or more, the filtering is done in a
+    thread on a snapshot of the candidates, so typing is not blocked: a new
+    filter cancels the running one, and the rows are replaced at once when
+    it is done. The filtered signal is emitted each time the rows match the
+    filter.
+
+    When the data of source rows changes, only these rows are filtered
+    again, so the other rows and the selection of the view are kept.
+
+    Without a filter (no text), the rows are the source rows, in order: they
+    are not copied until a filter is set, so showing every row does not
+    depend on their number.
+    """
+    ASYNC_THRESHOLD = 2000
+
+    filtered = Signal()
+
+    def __init__(self, parent=None):
+        QAbstractProxyModel.__init__(self, parent)
+        self._text = ""
+        self._match = None
+        self._matcher = FuzzyMatcher()
+        # the matches, in display order
+        self._matches = []
+        self._proxy_rows = None
+        # True when the rows are the source rows, without a filter
+        self._identity = True
+        # True when the candidates of the matcher are the source rows
+        self._loaded = False
+        self._job = None
+
+    def setSourceModel(self, model):
+        self.beginResetModel()
+        old = self.sourceModel()
+        if old is not None:
+            for signal, slot in self._source_connections(old):
+                signal.disconnect(slot)
+        QAbstractProxyModel.setSourceModel(self, model)
+        if model is not None:
+            for signal, slot in self._source_connections(model):
+                signal.connect(slot)
+        self._on_source_reset()
+
+    def _source_connections(self, model):
+        return (
+            (model.modelAboutToBeReset, self.beginResetModel),
+            (model.modelReset, self._on_source_reset),
+            (model.layoutAboutToBeChanged, self.beginResetModel),
+            (model.layoutChanged, self._on_source_reset),
+            (model.rowsAboutToBeRemoved, self._on_source_about_to_remove),
+            (model.rowsRemoved, self._on_source_rows_removed),
+            (model.rowsAboutToBeInserted, self._on_source_about_to_insert),
+            (model.rowsInserted, self._on_source_rows_inserted),
+            (model.rowsAboutToBeMoved, self._on_source_about_to_change),
+            (model.rowsMoved, self._on_source_reset),
+            (model.dataChanged, self._on_source_data_changed),
+        )
+
+    def _on_source_about_to_change(self, *args):
+        self.beginResetModel()
+
+    def _on_source_reset(self, *args):
+        # the source rows changed, the current matches are not valid anymore
+        self._loaded = False
+        if self._no_filter():
+            self._cancel_job()
+            self._set_identity()
+            self.endResetModel()
+            self.filtered.emit()
+            return
+        matches = self._start_filter()
+        self._set_matches([] if matches is None else matches)
+        self.endResetModel()
+        if matches is not None:
+            self.filtered.emit()
+
+    def _on_source_about_to_remove(self, parent, first, last):
+        if not self._identity:
+            self.beginResetModel()
+        elif not parent.isValid():
+            self.beginRemoveRows(QModelIndex(), first, last)
+
+    def _on_source_rows_removed(self, parent, first, last):
+        if not self._identity:
+            self._on_source_reset()
+        elif not parent.isValid():
+            self._loaded = False
+            self.endRemoveRows()
+
+    def _on_source_about_to_insert(self, parent, first, last):
+        if self._identity and not parent.isValid():
+            self.beginInsertRows(QModelIndex(), first, last)
+
+    def _on_source_data_changed(self, top_left, bottom_right, roles=()):
+        if top_left.parent().isValid():
+            return
+        first, last = top_left.row(), bottom_right.row()
+        if roles and Qt.ItemDataRole.DisplayRole not in roles:
+            # the candidates did not change
+            self._emit_data_changed(range(first, last + 1))
+            return
+        if self._identity:
+            if self._loaded:
+                self._matcher.update_candidates(
+                    first, self._source_rows(first, last + 1))
+            self._emit_data_changed(range(first, last + 1))
+            return
+        indexes = self._matcher.update_candidates(
+            first, self._source_rows(first, last + 1))
+        if self._job is not None:
+            # the running job does not know about the new data
+            self._start_filter()
+            return
+        self._refilter(indexes)
+
+    def _sort_key(self, match):
+        if self._match == Prompt.FuzzyMatch and self._text.split():
+            # as sorted by FuzzyMatcher.match
+            return (-match.score,
+                    len(self._matcher.candidate(match.index)[match.column]),
+                    match.index)
+        return (match.index,)
+
+    def _refilter(self, indexes):
+        """
+        Filter again the given candidates, changing only their rows, so the
+        other rows (and the selection) are kept.
+        """
+        matches = {m.index: m for m in _safe_filter_rows(
+            self._matcher, self._text, self._match, indexes)}
+        rows = {m.index: row for row, m in enumerate(self._matches)}
+        removed = []
+        inserted = []
+        updated = []
+        for index in indexes:
+            row = rows.get(index)
+            match = matches.get(index)
+            if row is None:
+                if match is not None:
+                    inserted.append(match)
+            elif match is None:
+                removed.append(row)
+            elif self._sort_key(match) == self._sort_key(self._matches[row]):
+                self._matches[row] = match
+                updated.append(index)
+            else:
+                # its rank changed, it is moved
+                removed.append(row)
+                inserted.append(match)
+
+        for row in sorted(removed, reverse=True):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self._matches[row]
+            self._proxy_rows = None
+            self.endRemoveRows()
+        for match in inserted:
+            row = bisect.bisect([self._sort_key(m) for m in self._matches],
+                                self._sort_key(match))
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._matches.insert(row, match)
+            self._proxy_rows = None
+            self.endInsertRows()
+        self._emit_data_changed(updated)
+
+    def _emit_data_changed(self, indexes):
+        model = self.sourceModel()
+        last_column = self.columnCount() - 1
+        for index in indexes:
+            proxy_index = self.mapFromSource(model.index(index, 0))
+            if proxy_index.isValid():
+                row = proxy_index.row()
+                self.dataChanged.emit(self.index(row, 0),
+                                      self.index(row, last_column))
+
+    def _on_source_rows_inserted(self, parent, first, last):
+        if parent.isValid():
+            return
+        if self._identity:
+            if self._loaded:
+                if first == len(self._matcher):
+                    self._matcher.add_candidates(
+                        self._source_rows(first, last + 1))
+                else:
+                    self._loaded = False
+            self.endInsertRows()
+            return
+        if first != len(self._matcher):
+            # inserted in the middle, all the source rows have moved
+            self.beginResetModel()
+            self._on_source_reset()
+            return
+        # rows appended (e.g. a page fetched): the new matches are appended
+        # after the current ones.
+        indexes = self._matcher.add_candidates(
+            self._source_rows(first, last + 1))
+        if self._job is not None:
+            # the running job does not know about the new rows
+            self._start_filter()
+            return
+        matches = _safe_filter_rows(self._matcher, self._text, self._match,
+                                    indexes)
+        if matches:
+            row = len(self._matches)
+            self.beginInsertRows(QModelIndex(), row, row + len(matches) - 1)
+            self._matches.extend(matches)
+            self._proxy_rows = None
+            self.endInsertRows()
+
+    def _source_columns(self):
+        model = self.sourceModel()
+        if model is None:
+            return 0
+        # columnCount is not exposed by PyQt for list models
+        if isinstance(model, QAbstractListModel):
+            return 1
+        return model.columnCount()
+
+    def _source_rows(self, first, last):
+        model = self.sourceModel()
+        columns = self._source_columns()
+        return [self._source_row(model, row, columns)
+                for row in range(first, last)]
+
+    def _source_row(self, model, row, columns):
+        try:
+            return tuple(model.index(row, col).data()
+                         for col in range(columns))
+        except Exception:
+            # the row can not be matched, but it is kept
+            logging.exception("Unable to read the completion row %d", row)
+            return ()
+
+    def _load_candidates(self):
+        model = self.sourceModel()
+        if model is None:
+            self._matcher.set_candidates(())
+        else:
+            self._matcher.set_candidates(
+                self._source_rows(0, model.rowCount()))
+        self._loaded = True
+
+    def _no_filter(self):
+        if self._match == Prompt.FuzzyMatch:
+            return not self._text.split()
+        if self._match == Prompt.SimpleMatch:
+            return not self._text
+        return True
+
+    def _set_identity(self):
+        self._identity = True
+        self._matches = []
+        self._proxy_rows = None
+
+    def _set_matches(self, matches):
+        self._identity = False
+        self._matches = matches
+        self._proxy_rows = None
+
+    def _cancel_job(self):
+        if self._job is not None:
+            self._job.cancelled = True
+            self._job = None
+
+    def _start_filter(self):
+        """
+        Filter the candidates, cancelling any running job. Returns the
+        matches, or None if they are computed in a thread.
+        """
+        self._cancel_job()
+        if not self._loaded:
+            self._load_candidates()
+        if len(self._matcher) < self.ASYNC_THRESHOLD:
+            return _safe_filter_rows(self._matcher, self._text, self._match)
+        self._job = _FilterJob(copy.copy(self._matcher), self._text,
+                               self._match)
+        self._job.finished.connect(self._on_job_finished)
+        QThreadPool.globalInstance().start(self._job.run)
+        return None
+
+    @Slot(object, object)
+    def _on_job_finished(self, job, matches):
+        if job is not self._job:
+            # cancelled, but finished before noticing it
+            return
+        self._job = None
+        # the job's snapshot remembers the query, to refilter faster
+        self._matcher = job.matcher
+        self._apply(matches)
+
+    def _apply(self, matches):
+        self.beginResetModel()
+        self._set_matches(matches)
+        self.endResetModel()
+        self.filtered.emit()
+
+    def pending(self):
+        """
+        True while the rows are being filtered in a thread.
+        """
+        return self._job is not None
+
+    def flush(self):
+        """
+        If the rows are being filtered in a thread, filter them now.
+        """
+        if self._job is not None:
+            self._cancel_job()
+            self._apply(_safe_filter_rows(self._matcher, self._text,
+                                          self._match))
+
+    def filter_text(self):
+        return self._text
+
+    def set_filter(self, text, match):
+        """
+        Filter the rows with the text, using the given match type.
+        """
+        if text == self._text and match == self._match:
+            if self._job is None:
+                self.filtered.emit()
+            return
+        self._text = text
+        self._match = match
+        if self._no_filter():
+            self._cancel_job()
+            if not self._identity:
+                self.beginResetModel()
+                self._set_identity()
+                self.endResetModel()
+            self.filtered.emit()
+            return
+        matches = self._start_filter()
+        if matches is not None:
+            self._apply(matches)
+
+    def mapToSource(self, index):
+        model = self.sourceModel()
+        if model is None or not index.isValid():
+            return QModelIndex()
+        if self._identity:
+            return model.index(index.row(), index.column())
+        try:
+            row = self._matches[index.row()].index
+        except IndexError:
+            return QModelIndex()
+        return model.index(row, index.column())
+
+    def mapFromSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        if self._identity:
+            return self.index(index.row(), index.column())
+        if self._proxy_rows is None:
+            self._proxy_rows = {m.index: row
+                                for row, m in enumerate(self._matches)}
+        row = self._proxy_rows.get(index.row())
+        if row is None:
+            return QModelIndex()
+        return self.index(row, index.column())
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not 0 <= row < self.rowCount() \
+           or not 0 <= column < self.columnCount():
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._identity:
+            model = self.sourceModel()
+            return 0 if model is None else model.rowCount()
+        return len(self._matches)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._source_columns()
+
+    def hasChildren(self, parent=QModelIndex()):
+        return not parent.isValid() and self.rowCount() > 0
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == MATCH_POSITIONS_ROLE:
+            if self._identity:
+                return None
+            try:
+                match = self._matches[index.row()]
+            except IndexError:
+                return None
+            if match.column == index.column():
+                return match.positions
+            return None
+        return QAbstractProxyModel.data(self, index, role)
+
+
+class MatchDelegate(QStyledItemDelegate):
+    """
+    Paint the cells of the completion popup, with the matched characters in
+    bold.
+
+    Texts that do not fit in their cell are painted the default way, elided.
+    """
+
+    def paint(self, painter, option, index):
+        positions = index.data(MATCH_POSITIONS_ROLE)
+        if not positions:
+            return QStyledItemDelegate.paint(self, painter, option, index)
+
+        opt = QStyleOptionViewItem(option)
+        self.initStyleOption(opt, index)
+        text = opt.text
+        widget = opt.widget
+        style = widget.style() if widget else QApplication.style()
+        rect = style.subElementRect(
+            QStyle.SubElement.SE_ItemViewItemText, opt, widget)
+        margin = style.pixelMetric(
+            QStyle.PixelMetric.PM_FocusFrameHMargin, None, widget) + 1
+        rect.adjust(margin, 0, -margin, 0)
+
+        bold = QFont(opt.font)
+        bold.setBold(True)
+        metrics = (QFontMetrics(opt.font), QFontMetrics(bold))
+        positions = set(positions)
+        # split the text in runs of normal or bold characters
+        runs = []
+        for i, char in enumerate(text):
+            is_bold = i in positions
+            if runs and runs[-1][0] == is_bold:
+                runs[-1][1] += char
+            else:
+                runs.append([is_bold, char])
+        widths = [metrics[is_bold].horizontalAdvance(run)
+                  for is_bold, run in runs]
+        if sum(widths) > rect.width():
+            return QStyledItemDelegate.paint(self, painter, option, index)
+
+        # draw the background and selection, without the text
+        opt.text = ""
+        style.drawControl(QStyle.ControlElement.CE_ItemViewItem, opt, painter,
+                          widget)
+
+        painter.save()
+        group = QPalette.ColorGroup.Normal \
+            if opt.state & QStyle.StateFlag.State_Enabled \
+            else QPalette.ColorGroup.Disabled
+        role = QPalette.ColorRole.HighlightedText \
+            if opt.state & QStyle.StateFlag.State_Selected \
+            else QPalette.ColorRole.Text
+        painter.setPen(opt.palette.color(group, role))
+        x = rect.x()
+        for (is_bold, run), width in zip(runs, widths):
+            painter.setFont(bold if is_bold else opt.font)
+            painter.drawText(
+                QRect(x, rect.y(), width, rect.height()),
+                Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+                run)
+            x += width
+        painter.restore()
+
+
+class CompletionCache(object):
+    """
+    A LRU cache for completions, which entries expire after a time to live
+    (in seconds).
+    """
+
+    def __init__(self, maxsize=256, ttl=600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the value for the key, or None if there is no entry or it is
+        expired.
+        """
+        try:
+            expires, value = self._entries[key]
+        except KeyError:
+            return None
+        if expires <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,235 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fuzzy matching of completion candidates, in the style of fzf.
+
+The characters of each word of the query must appear in order in the
+candidate, and the matches are scored: consecutive characters, and
+characters at the start of a word score higher, gaps are penalized.
+"""
+
+from collections import namedtuple
+
+
+SCORE_MATCH = 16
+SCORE_GAP_START = -3
+SCORE_GAP_EXTENSION = -1
+BONUS_BOUNDARY = 8
+BONUS_CAMEL = 7
+BONUS_CONSECUTIVE = 4
+BONUS_FIRST_CHAR_MULTIPLIER = 2
+
+
+# the number of candidates matched between two checks of cancellation
+CHECK_INTERVAL = 256
+
+
+class Cancelled(Exception):
+    """
+    Raised when a match is cancelled.
+    """
+
+
+def cancellable(iterable, cancelled):
+    """
+    Iterate, raising Cancelled as soon as the cancelled callable returns
+    True.
+    """
+    if cancelled is None:
+        return iterable
+    return _cancellable(iterable, cancelled)
+
+
+def _cancellable(iterable, cancelled):
+    for i, item in enumerate(iterable):
+        if not i % CHECK_INTERVAL and cancelled():
+            raise Cancelled()
+        yield item
+
+
+# index of the candidate, its score, and the column and positions of the
+# matched characters.
+Match = namedtuple("Match", ("index", "score", "column", "positions"))
+
+
+def _bonus(text, pos):
+    if pos == 0:
+        return BONUS_BOUNDARY
+    prev, char = text[pos - 1], text[pos]
+    if not prev.isalnum():
+        return BONUS_BOUNDARY if char.isalnum() else 0
+    if prev.islower() and char.isupper():
+        return BONUS_CAMEL
+    if prev.isalpha() != char.isalpha():
+        return BONUS_CAMEL
+    return 0
+
+
+def _lower(text):
+    # str.lower can change the length of a string (like "\u0130" which is
+    # lowered to two characters): fold case character by character then, so
+    # the positions in the lowered text are the positions in the text.
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(c.lower()[:1] or c for c in text)
+
+
+def fuzzy_match(pattern, text):
+    """
+    Match a pattern (without spaces) in a text. Returns a tuple (score,
+    positions), or None if the text does not match.
+
+    The match is case insensitive, unless the pattern contains an uppercase
+    character.
+    """
+    subject = text if not pattern.islower() else _lower(text)
+    # forward scan, using str.find: is there a match, and where does the
+    # first one ends?
+    pos = -1
+    for char in pattern:
+        pos = subject.find(char, pos + 1)
+        if pos == -1:
+            return None
+    # backward scan from there, to find the shortest match
+    start = pos + 1
+    for char in reversed(pattern):
+        start = subject.rfind(char, 0, start)
+
+    positions = []
+    score = 0
+    prev = chunk_bonus = None
+    pos = start - 1
+    for char in pattern:
+        pos = subject.find(char, pos + 1)
+        bonus = _bonus(text, pos)
+        if prev is None:
+            score += SCORE_MATCH + bonus * BONUS_FIRST_CHAR_MULTIPLIER
+            chunk_bonus = bonus
+        elif pos == prev + 1:
+            score += SCORE_MATCH + max(bonus, chunk_bonus, BONUS_CONSECUTIVE)
+        else:
+            score += SCORE_MATCH + bonus + SCORE_GAP_START \
+                + SCORE_GAP_EXTENSION * (pos - prev - 2)
+            chunk_bonus = bonus
+        positions.append(pos)
+        prev = pos
+    return score, positions
+
+
+def match_words(words, text):
+    """
+    Match every word in the text, in any order. Returns a tuple (score,
+    positions) or None.
+    """
+    total = 0
+    positions = set()
+    for word in words:
+        result = fuzzy_match(word, text)
+        if result is None:
+            return None
+        total += result[0]
+        positions.update(result[1])
+    return total, sorted(positions)
+
+
+class FuzzyMatcher(object):
+    """
+    Match a list of candidates, each one being a tuple of strings (the
+    columns of a completion row), against queries.
+
+    When a query extends the previous one, only the candidates that
+    matched the previous query are matched again.
+
+    The candidates are never modified in place, so a copy (copy.copy) is a
+    cheap snapshot that can be matched in another thread.
+    """
+
+    def __init__(self, candidates=()):
+        self.set_candidates(candidates)
+
+    def set_candidates(self, candidates):
+        self._candidates = tuple(tuple(c) for c in candidates)
+        self._last_query = None
+        self._last_matched = None
+
+    def add_candidates(self, candidates):
+        """
+        Add candidates, and returns the range of their indexes.
+        """
+        first = len(self._candidates)
+        self._candidates += tuple(tuple(c) for c in candidates)
+        self._last_query = self._last_matched = None
+        return range(first, len(self._candidates))
+
+    def update_candidates(self, first, candidates):
+        """
+        Replace the candidates from the index first, and returns the range
+        of their indexes.
+        """
+        candidates = tuple(tuple(c) for c in candidates)
+        last = first + len(candidates)
+        self._candidates = self._candidates[:first] + candidates \
+            + self._candidates[last:]
+        self._last_query = self._last_matched = None
+        return range(first, last)
+
+    def __len__(self):
+        return len(self._candidates)
+
+    def candidate(self, index):
+        return self._candidates[index]
+
+    def _match_candidate(self, words, index):
+        best = None
+        for column, text in enumerate(self._candidates[index]):
+            if not isinstance(text, str):
+                continue
+            result = match_words(words, text)
+            if result is not None and (best is None or result[0] > best[1]):
+                best = Match(index, result[0], column, result[1])
+        return best
+
+    def match(self, query, indexes=None, cancelled=None):
+        """
+        Returns the list of Match for the query, the best first. If indexes
+        is given, only those candidates are considered.
+
+        cancelled is an optional callable, checked regularly; Cancelled is
+        raised when it returns True.
+        """
+        words = query.split()
+        remember = indexes is None
+        if indexes is None:
+            if self._last_query is not None \
+               and query.startswith(self._last_query):
+                indexes = self._last_matched
+            else:
+                indexes = range(len(self._candidates))
+
+        indexes = cancellable(indexes, cancelled)
+        if not words:
+            matches = [Match(i, 0, 0, []) for i in indexes]
+        else:
+            matches = [m for m in (self._match_candidate(words, i)
+                                   for i in indexes) if m is not None]
+        if remember:
+            self._last_query = query
+            self._last_matched = [m.index for m in matches]
+        if words:
+            matches.sort(key=lambda m: (
+                -m.score, len(self._candidates[m.index][m.column]), m.index))
+        return matches
@@ -14,12 +14,19 @@
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
+import json
+import bisect
+import logging
+import tempfile
 import itertools
+import threading
 import collections
+from functools import partial
 
 from PyQt6.QtCore import QObject, QAbstractTableModel, QModelIndex, Qt, \
     pyqtSlot as Slot, pyqtSignal as Signal, QEventLoop, QPropertyAnimation, \
-    QEvent, QRegularExpression
+    QEvent, QRegularExpression, QTimer, QThreadPool
 
 from PyQt6.QtGui import QColor, QRegularExpressionValidator
 
@@ -48,6 +55,82 @@ FLASH_COUNT = variables.define_variable(
     2,
     type=variables.Int(min=0),
 )
+PROMPT_HISTORY_SIZE = variables.define_variable(
+    "prompt-history-size",
+    "Maximum number of entries kept in the history of each prompt. The"
+    " histories are saved in the profile directory.",
+    100,
+    type=variables.Int(min=1),
+)
+
+# directory where the named prompt histories are saved, None to only keep
+# them in memory (e.g. off the record).
+_HISTORY_PATH = None
+_HISTORIES = []
+
+
+def set_prompt_history_path(path):
+    global _HISTORY_PATH
+    _HISTORY_PATH = path
+
+
+def flush_prompt_histories():
+    """
+    Save the changes of the prompt histories now.
+    """
+    for history in _HISTORIES:
+        history.flush()
+
+
+# directory path -> (mtime, names), the most recently used last
+_DIRECTORY_CACHE = collections.OrderedDict()
+DIRECTORY_CACHE_SIZE = 16
+
+
+class _DirectoryScan(QObject):
+    """
+    List a directory with os.scandir in a thread of the QThreadPool, giving
+    the names by batches.
+
+    If the mtime of the directory is given and did not change, the
+    directory is not listed again and finished is emitted with no names.
+    """
+    BATCH_SIZE = 256
+
+    names_found = Signal(object, list)
+    # the job, the mtime and all the names (or None)
+    finished = Signal(object, object, object)
+
+    def __init__(self, path, mtime=None):
+        QObject.__init__(self)
+        self.path = path
+        self.mtime = mtime
+        self.cancelled = False
+
+    def run(self):
+        names = []
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                self.finished.emit(self, mtime, None)
+                return
+            with os.scandir(self.path) as entries:
+                batch = []
+                for entry in entries:
+                    if self.cancelled:
+                        return
+                    batch.append(entry.name)
+                    if len(batch) == self.BATCH_SIZE:
+                        self.names_found.emit(self, batch)
+                        names.extend(batch)
+                        batch = []
+        except OSError:
+            self.finished.emit(self, None, None)
+            return
+        if batch:
+            self.names_found.emit(self, batch)
+            names.extend(batch)
+        self.finished.emit(self, mtime, names)
 
 
 class FSModel(QAbstractTableModel):
@@ -55,12 +138,20 @@ class FSModel(QAbstractTableModel):
     A custom filesystemmodel that does work with the custom completer;
 
     May not be as efficient as the qt version, but works without much pain.
+
+    Directories are listed in a thread, and the files are added to the model
+    as they are found. The last listed directories are cached: a cached
+    listing is displayed at once, then replaced if the directory was
+    modified since.
     """
 
     def __init__(self, parent=None):
         QAbstractTableModel.__init__(self, parent)
         self._root_dir = ""
         self._files = []
+        self._job = None
+        # the cached files are replaced by the first names found
+        self._replace = False
 
     def rowCount(self, index=QModelIndex()):
         return len(self._files)
@@ -85,14 +176,66 @@ class FSModel(QAbstractTableModel):
             root_dir = os.path.dirname(text)
 
         if root_dir != self._root_dir:
-            try:
-                files = os.listdir(root_dir)
-            except OSError:
-                return
-            self.beginResetModel()
-            self._files = files
-            self._root_dir = root_dir
-            self.endResetModel()
+            self._list_dir(root_dir)
+
+    def _list_dir(self, root_dir):
+        if self._job is not None:
+            self._job.cancelled = True
+        cached = _DIRECTORY_CACHE.get(root_dir)
+        if cached is not None:
+            _DIRECTORY_CACHE.move_to_end(root_dir)
+        self.beginResetModel()
+        self._files = list(cached[1]) if cached else []
+        self._root_dir = root_dir
+        self.endResetModel()
+        self._replace = cached is not None
+        if not root_dir:
+            self._job = None
+            return
+        self._job = _DirectoryScan(root_dir, cached[0] if cached else None)
+        self._job.names_found.connect(self._on_names_found)
+        self._job.finished.connect(self._on_scan_finished)
+        QThreadPool.globalInstance().start(self._job.run)
+
+    def _set_files(self, files):
+        self.beginResetModel()
+        self._files = files
+        self.endResetModel()
+
+    @Slot(object, list)
+    def _on_names_found(self, job, names):
+        if job is not self._job:
+            return
+        if self._replace:
+            self._replace = False
+            self._set_files(names)
+            return
+        row = len(self._files)
+        self.beginInsertRows(QModelIndex(), row, row + len(names) - 1)
+        self._files.extend(names)
+        self.endInsertRows()
+
+    @Slot(object, object, object)
+    def _on_scan_finished(self, job, mtime, names):
+        if job is not self._job:
+            return
+        self._job = None
+        if mtime is None:
+            # not readable (anymore)
+            _DIRECTORY_CACHE.pop(job.path, None)
+            if self._files:
+                self._set_files([])
+            return
+        if names is None:
+            # not modified
+            return
+        if self._replace:
+            # the directory is now empty
+            self._set_files([])
+        _DIRECTORY_CACHE[job.path] = (mtime, tuple(names))
+        _DIRECTORY_CACHE.move_to_end(job.path)
+        while len(_DIRECTORY_CACHE) > DIRECTORY_CACHE_SIZE:
+            _DIRECTORY_CACHE.popitem(last=False)
 
 
 class PromptTableModel(QAbstractTableModel):
@@ -121,6 +264,49 @@ class PromptTableModel(QAbstractTableModel):
             return QModelIndex()
 
 
+class PagedPromptTableModel(PromptTableModel):
+    """
+    A PromptTableModel which rows are taken by pages from an iterable (like
+    a sqlite cursor) when the view needs them, so large results cost only
+    what is displayed.
+    """
+    PAGE_SIZE = 64
+
+    def __init__(self, rows=(), parent=None):
+        PromptTableModel.__init__(self, [], parent)
+        self._rows = iter(())
+        self._exhausted = True
+        self.set_rows(rows)
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self._rows = iter(rows)
+        self._data = []
+        self._exhausted = False
+        self._data.extend(self._next_page())
+        self.endResetModel()
+
+    def _next_page(self):
+        page = list(itertools.islice(self._rows, self.PAGE_SIZE))
+        if len(page) < self.PAGE_SIZE:
+            self._exhausted = True
+            self._rows = iter(())
+        return page
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        page = self._next_page()
+        if page:
+            row = len(self._data)
+            self.beginInsertRows(QModelIndex(), row, row + len(page) - 1)
+            self._data.extend(page)
+            self.endInsertRows()
+
+
 def _prompt_exec(prompt, loop):
     # mocked in tests to not block.
     loop.exec()
@@ -264,25 +450,174 @@ class Prompt(QObject):
             return self.value()
 
 
+def _words(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
 class PromptHistory(object):
     """
-    In memory history for prompts.
-    """
+    History for prompts, the most recent entries last.
+
+    A value pushed again is moved to the end instead of being duplicated,
+    and the entries are indexed by words, see :meth:`search`.
+
+    When a name is given, the history is saved in the profile directory, in
+    <name>.json. It is loaded on first use, and saved in a thread shortly
+    after a change, so that consecutive changes are written at once.
 
-    def __init__(self, maxsize=50):
-        self._history = collections.deque((), maxlen=maxsize)
+    :param maxsize: the maximum number of entries, defaults to the
+        *prompt-history-size* variable.
+    :param name: the name of the history file, or None to only keep it in
+        memory.
+    """
+    # in milliseconds
+    SAVE_DELAY = 1000
+
+    def __init__(self, maxsize=None, name=None):
+        self._maxsize = maxsize
+        self.name = name
+        # loaded lazily
+        self._history = None
+        self._entries = set()
+        # word -> entries having this word, and the sorted words
+        self._index = {}
+        self._vocabulary = []
+        self._version = self._saved_version = 0
+        self._save_scheduled = False
+        self._write_lock = threading.Lock()
+        if name is not None:
+            _HISTORIES.append(self)
         self.reset()
 
     def reset(self):
         self._in_user_value = True
         self._user_value = ""
         self._cursor = 0
+        self._matches = None
 
-    def push(self, text):
-        # avoid following duplicates
-        if self._history and self._history[0] == text:
+    def _path(self):
+        if self.name is None or _HISTORY_PATH is None:
+            return None
+        return os.path.join(_HISTORY_PATH, self.name + ".json")
+
+    def _load(self):
+        if self._history is not None:
+            return
+        self._history = []
+        path = self._path()
+        if path is None:
+            return
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception:
+            logging.exception("Unable to read the prompt history %s", path)
             return
+        for text in entries:
+            if isinstance(text, str):
+                self._add(text)
+        self._trim()
+
+    def _add(self, text):
+        if text in self._entries:
+            self._remove(text)
         self._history.append(text)
+        self._entries.add(text)
+        for word in _words(text):
+            entries = self._index.get(word)
+            if entries is None:
+                entries = self._index[word] = set()
+                bisect.insort(self._vocabulary, word)
+            entries.add(text)
+
+    def _remove(self, text):
+        self._history.remove(text)
+        self._entries.discard(text)
+        for word in _words(text):
+            entries = self._index[word]
+            entries.discard(text)
+            if not entries:
+                del self._index[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary,
+                                                        word)]
+
+    def _trim(self):
+        maxsize = self._maxsize or PROMPT_HISTORY_SIZE.value
+        while len(self._history) > maxsize:
+            self._remove(self._history[0])
+
+    def push(self, text):
+        self._load()
+        if self._history and self._history[-1] == text:
+            return
+        self._add(text)
+        self._trim()
+        self._version += 1
+        if self._path() is not None and not self._save_scheduled:
+            self._save_scheduled = True
+            QTimer.singleShot(self.SAVE_DELAY, self._save)
+
+    def _save(self):
+        self._save_scheduled = False
+        path = self._path()
+        if path is not None:
+            QThreadPool.globalInstance().start(partial(
+                self._write, path, list(self._history), self._version))
+
+    def _write(self, path, entries, version):
+        with self._write_lock:
+            # an older snapshot must not replace a newer one
+            if version <= self._saved_version:
+                return
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       prefix=self.name, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp, path)
+            except OSError:
+                logging.exception("Unable to save the prompt history %s",
+                                  path)
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+            else:
+                self._saved_version = version
+
+    def flush(self):
+        """
+        Save the history now, in the current thread, if it changed.
+        """
+        path = self._path()
+        if path is not None and self._history is not None:
+            self._write(path, list(self._history), self._version)
+
+    def __len__(self):
+        self._load()
+        return len(self._history)
+
+    def search(self, text):
+        """
+        Returns the entries having, for each word of the text, a word
+        starting with it. The most recent entries first.
+        """
+        self._load()
+        found = None
+        for word in _words(text):
+            matching = set()
+            i = bisect.bisect_left(self._vocabulary, word)
+            while i < len(self._vocabulary) \
+                    and self._vocabulary[i].startswith(word):
+                matching.update(self._index[self._vocabulary[i]])
+                i += 1
+            found = matching if found is None else found & matching
+            if not found:
+                return []
+        if found is None:
+            return self._history[::-1]
+        positions = {text: i for i, text in enumerate(self._history)}
+        return sorted(found, key=positions.get, reverse=True)
 
     def in_user_value(self):
         """
@@ -295,6 +630,8 @@ class PromptHistory(object):
 
     def __get(self, delta):
         # delta must be 1 or -1
+        self._load()
+        self._matches = None
         size = len(self._history)
         if size == 0:
             return self._user_value
@@ -317,6 +654,22 @@ class PromptHistory(object):
     def get_previous(self):
         return self.__get(-1)
 
+    def get_previous_matching(self):
+        """
+        Returns the previous entry matching the user value (see
+        :meth:`search`), or the user value when there is no more match.
+        """
+        if self._matches is None:
+            self._matches = iter(self.search(self._user_value))
+        entry = next(self._matches, None)
+        if entry is None:
+            self._matches = None
+            self._in_user_value = True
+            return self._user_value
+        self._in_user_value = False
+        self._cursor = self._history.index(entry)
+        return entry
+
 
 class YesNoPrompt(Prompt):
     NO = 0
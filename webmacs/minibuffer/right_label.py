@@ -14,7 +14,7 @@
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
 from .. import hooks, variables, keyboardhandler
-from .. import windows, BUFFERS, call_later
+from .. import windows, BUFFERS, BUFFER_INDEX, call_later
 
 
 MINIBUFFER_RIGHTLABEL = variables.define_variable(
@@ -62,7 +62,7 @@ def _update_minibuffer_right_label(window):
             label.setStyleSheet("QLabel { background: orangered }")
     label.setText(
         MINIBUFFER_RIGHTLABEL.value.format(
-            buffer_current=BUFFERS.index(buff) + 1,
+            buffer_current=BUFFER_INDEX.position(buff) + 1,
             buffer_count=len(BUFFERS),
             local_keymap=keyboardhandler.local_keymap(),
             mode=getattr(buff, "mode", "unknown"),
@@ -24,6 +24,8 @@ from .visited_links import VisitedLinks
 from .ignore_certificates import IgnoredCertificates
 from .bookmarks import Bookmarks
 from .features import Features
+from .minibuffer.prompt import set_prompt_history_path, \
+    flush_prompt_histories
 from . import variables, version, require
 from .password_manager import make_password_manager
 from .variables import define_variable, Bool
@@ -100,7 +102,11 @@ class Profile(object):
             bookmarks = os.path.join(path, "bookmarks.db")
             features = os.path.join(path, "features.db")
 
+            set_prompt_history_path(make_dir(path, "prompt_history"))
+            app.aboutToQuit.connect(flush_prompt_histories)
+
         self.visitedlinks = VisitedLinks(visited_links)
+        app.aboutToQuit.connect(self.visitedlinks.close)
         self.ignored_certs = IgnoredCertificates(ignored_certs)
         self.bookmarks = Bookmarks(bookmarks)
         self.features = Features(features)
@@ -13,45 +13,76 @@
 # You should have received a copy of the GNU General Public License
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import logging
 
-from .import BUFFERS, windows, current_window
+from PyQt6.QtCore import QObject, QTimer, pyqtSlot as Slot
+from PyQt6.QtGui import QIcon
+
+from .import BUFFERS, BUFFER_INDEX, windows, current_window, hooks, variables
 from .webbuffer import create_buffer, QUrl, DelayedLoadingUrl, close_buffer
 from .window import Window
+from .session_journal import read_session, SessionWriter
 
 
 FORMAT_VERSION = 2
 
 
-def _session_load(stream):
-    data = json.load(stream)
+session_autosave_interval = variables.define_variable(
+    "session-autosave-interval",
+    "Delay in seconds before the changes of the buffers and windows are"
+    " saved in the session. The changes made during that delay are saved at"
+    " once. 0 disables the autosave, the session is then only saved on"
+    " exit.",
+    10,
+    type=variables.Int(min=0)
+)
+
+session_restore_preload = variables.define_variable(
+    "session-restore-preload",
+    "Number of the most recently used buffers loaded in the background once"
+    " a session is restored. The other buffers are loaded when first"
+    " displayed.",
+    5,
+    type=variables.Int(min=0)
+)
+
+session_restore_concurrency = variables.define_variable(
+    "session-restore-concurrency",
+    "Maximum number of buffers loaded at the same time in the background"
+    " once a session is restored.",
+    2,
+    type=variables.Int(min=1)
+)
+
+
+def _session_load(data):
+    global _RESTORE
     version = data.get("version", 0)
     urls = data["urls"]
+    get_buffer = None
     if version < 2:
-        urls = reversed(urls)
-
-    # apply the session config
-
-    # now, load urls in buffers
-    for url in urls:
-        if isinstance(url, str):
-            # old format, no delay loading support
-            # TODO must be removed after some time
-            create_buffer(url)
-        else:
-            # new format, url must be a dict
-            buff = create_buffer(DelayedLoadingUrl(
-                url=QUrl(url["url"]),
-                title=url["title"]
-            ))
-            if version >= 2:
-                buff.last_use = url["last_use"]
+        # old formats, the buffers are created at once
+        # TODO must be removed after some time
+        for url in reversed(urls):
+            if isinstance(url, str):
+                # old format, no delay loading support
+                create_buffer(url)
+            else:
+                create_buffer(DelayedLoadingUrl(
+                    url=QUrl(url["url"]),
+                    title=url["title"]
+                ))
+    else:
+        # the buffers displayed in the windows are created with them, the
+        # others when needed.
+        _RESTORE = SessionRestore(urls)
+        get_buffer = _RESTORE.buffer
+        restore_started()
 
     if version > 0:
         def create_window(wdata):
             win = Window()
-            win.restore_state(wdata, version)
+            win.restore_state(wdata, version, get_buffer)
             win.show()
 
         current_index = data.get("current-window", 0)
@@ -70,23 +101,261 @@ def _session_load(stream):
         if BUFFERS:
             cwin.current_webview().setBuffer(BUFFERS[0])
 
+    if _RESTORE is not None:
+        _RESTORE.start()
+
+
+class BufferPlaceholder(object):
+    """
+    A buffer of a restored session not created yet: only its session data.
+
+    It has the few methods of WebBuffer used to list the buffers. Use
+    :meth:`create` to get a buffer.
+    """
+
+    def __init__(self, restore, data):
+        self._restore = restore
+        self.data = data
+        self.last_use = data["last_use"]
+        # the buffer once created
+        self.buffer = None
+
+    def url(self):
+        return QUrl(self.data["url"])
+
+    def title(self):
+        return self.data["title"]
+
+    def icon(self):
+        return QIcon()
+
+    def create(self):
+        """
+        Create the buffer, if not done yet, and returns it. It is not loaded
+        until displayed.
+        """
+        if self.buffer is None:
+            self._restore.create(self)
+        return self.buffer
+
+    def discard(self):
+        """
+        Forget the buffer, without creating it.
+        """
+        self._restore.discard(self)
+
+
+# called with a placeholder once discarded
+placeholder_discarded = hooks.Hook()
+
+# called once the placeholders of a restored session are created
+restore_started = hooks.Hook()
+
+
+def _entry_index(entries, buffer):
+    """
+    Returns the index in the entries (the buffers and the placeholders of a
+    session) where a buffer just created goes: after the buffer preceding it
+    in BUFFERS, so the buffers of the entries stay in the order of BUFFERS.
+    """
+    position = BUFFER_INDEX.position(buffer)
+    if position == 0:
+        return 0
+    return entries.index(BUFFERS[position - 1]) + 1
+
+
+class SessionRestore(QObject):
+    """
+    Restore the buffers of a session by stages.
+
+    The buffers are placeholders (BufferPlaceholder, their session data)
+    until created: when displayed in the restored windows, switched to, or
+    when preloaded. Once the windows are restored, the
+    session-restore-preload most recently used buffers are created and
+    loaded in the background, at most session-restore-concurrency at a time.
+
+    The placeholders are listed in :attr:`entries` with the buffers, in the
+    session order.
+    """
+
+    def __init__(self, urls, parent=None):
+        QObject.__init__(self, parent)
+        # the buffers and the placeholders, in the session order
+        self.entries = [BufferPlaceholder(self, url) for url in urls]
+        self._placeholders = list(self.entries)
+        # the placeholder of the buffer being created
+        self._creating = None
+        self._preload = []
+        self._loading = set()
+        BUFFER_INDEX.buffer_added.connect(self._on_buffer_added)
+        BUFFER_INDEX.buffer_removed.connect(self._on_buffer_removed)
+        self._connected = True
+
+    def buffer(self, index):
+        """
+        Returns the buffer at the given index in the session, creating it if
+        needed.
+        """
+        return self._placeholders[index].create()
+
+    def placeholders(self):
+        return [e for e in self.entries if isinstance(e, BufferPlaceholder)]
+
+    def creating(self):
+        """
+        Returns the placeholder of the buffer being created, else None.
+        """
+        return self._creating
+
+    def create(self, placeholder):
+        index = self.entries.index(placeholder)
+        position = sum(1 for e in self.entries[:index]
+                       if not isinstance(e, BufferPlaceholder))
+        data = placeholder.data
+        self._creating = placeholder
+        try:
+            buff = create_buffer(DelayedLoadingUrl(
+                url=QUrl(data["url"]),
+                title=data["title"],
+                history=data.get("history"),
+            ), position=position)
+        finally:
+            self._creating = None
+        buff.last_use = placeholder.last_use
+        placeholder.buffer = buff
+        self.entries[index] = buff
+
+    def discard(self, placeholder):
+        self.entries.remove(placeholder)
+        if placeholder in self._preload:
+            self._preload.remove(placeholder)
+        placeholder_discarded(placeholder)
+
+    def start(self):
+        placeholders = sorted(self.placeholders(), key=lambda p: p.last_use,
+                              reverse=True)
+        # the most recently used last
+        self._preload = placeholders[:session_restore_preload.value][::-1]
+        self._preload_next()
+
+    def abort(self):
+        """
+        Stop loading the buffers.
+        """
+        self._preload = []
+        for buff in self._loading:
+            buff.loadFinished.disconnect(self._on_load_finished)
+        self._loading.clear()
+        if self._connected:
+            self._connected = False
+            BUFFER_INDEX.buffer_added.disconnect(self._on_buffer_added)
+            BUFFER_INDEX.buffer_removed.disconnect(self._on_buffer_removed)
+
+    def _preload_next(self):
+        while self._preload \
+                and len(self._loading) < session_restore_concurrency.value:
+            placeholder = self._preload.pop()
+            if placeholder.buffer is not None:
+                # already created, displayed or switched to
+                continue
+            buff = placeholder.create()
+            self._loading.add(buff)
+            buff.loadFinished.connect(self._on_load_finished)
+            buff.load_delayed_url()
+
+    def _done(self, buff):
+        self._loading.discard(buff)
+        self._preload_next()
+
+    @Slot(bool)
+    def _on_load_finished(self, ok):
+        buff = self.sender()
+        buff.loadFinished.disconnect(self._on_load_finished)
+        self._done(buff)
 
-def _session_save(stream):
-    urls = [{
-        "url": b.url().toString(),
-        "title": b.title(),
-        "last_use": b.last_use,
-    } for b in BUFFERS]
+    @Slot(object)
+    def _on_buffer_added(self, buff):
+        if self._creating is None:
+            self.entries.insert(_entry_index(self.entries, buff), buff)
 
-    json.dump({
+    @Slot(object)
+    def _on_buffer_removed(self, buff):
+        self.entries.remove(buff)
+        if buff in self._loading:
+            self._done(buff)
+
+
+_RESTORE = None
+
+
+def _buffer_state(buffer):
+    return {
+        "url": buffer.url().toString(),
+        "title": buffer.title(),
+        "last_use": buffer.last_use,
+        "history": buffer.history_data(),
+    }
+
+
+def _windows_state():
+    wins = windows()
+    current = current_window()
+    return {
+        "windows": [w.dump_state() for w in wins],
+        "current-window": wins.index(current) if current in wins else 0,
+    }
+
+
+def session_entries():
+    """
+    Returns the buffers and the placeholders of the buffers not yet
+    restored (see BufferPlaceholder), in order.
+    """
+    if _RESTORE is not None:
+        return _RESTORE.entries
+    return BUFFERS
+
+
+def restoring_placeholder():
+    """
+    Returns the placeholder of the buffer being created, else None.
+    """
+    if _RESTORE is not None:
+        return _RESTORE.creating()
+    return None
+
+
+def discard_placeholders():
+    """
+    Forget the buffers of the session not yet restored.
+    """
+    if _RESTORE is not None:
+        for placeholder in _RESTORE.placeholders():
+            placeholder.discard()
+
+
+def _entry_state(entry):
+    if isinstance(entry, BufferPlaceholder):
+        return entry.data
+    return _buffer_state(entry)
+
+
+def _session_data():
+    data = {
         "version": FORMAT_VERSION,
-        "urls": urls,
-        "windows": [w.dump_state() for w in windows()],
-        "current-window": windows().index(current_window()),
-    }, stream)
+        "urls": [_entry_state(e) for e in session_entries()],
+    }
+    data.update(_windows_state())
+    return data
 
 
 def session_clean():
+    global _RESTORE
+    if _RESTORE is not None:
+        discard_placeholders()
+        _RESTORE.abort()
+        _RESTORE = None
+
     # clean every opened buffers and windows
     for window in windows():
         window.quit_if_last_closed = False
@@ -108,8 +377,7 @@ def session_load(session_file):
     if session_file is None:
         return
     try:
-        with open(session_file, "r") as f:
-            _session_load(f)
+        _session_load(read_session(session_file))
     except Exception:
         logging.exception("Unable to load the session from %s.",
                           session_file)
@@ -118,10 +386,179 @@ def session_load(session_file):
 
 
 def session_save(session_file):
+    """
+    Save the session for the given profile.
+    """
     if session_file is None:
         return
+    SessionWriter(session_file).write_snapshot(_session_data())
+
+
+class SessionAutosave(QObject):
     """
-    Save the session for the given profile.
+    Save the session as the buffers and windows change.
+
+    The changes are recorded as journal operations, written at once after
+    the session-autosave-interval delay. A full snapshot is written only
+    when the journal is too long, so the cost of a save does not depend on
+    the number of buffers.
     """
-    with open(session_file, "w") as f:
-        _session_save(f)
+
+    def __init__(self, session_file, parent=None):
+        QObject.__init__(self, parent)
+        self._writer = SessionWriter(session_file)
+        self._timer = QTimer(self, singleShot=True)
+        self._timer.timeout.connect(self.save)
+        # the session entries (see session_entries), as they are once the
+        # journal is replayed
+        self._buffers = []
+        self._operations = []
+        self._inserted = set()
+        self._dirty = {}
+        self._windows = None
+        self._started = False
+        self._need_snapshot = False
+
+    def start(self):
+        """
+        Write a full snapshot and starts recording the changes.
+        """
+        if self._started or not session_autosave_interval.value:
+            return
+        self._started = True
+        self._snapshot()
+        restore_started.add(self._on_restore_started)
+        placeholder_discarded.add(self._on_buffer_removed)
+        BUFFER_INDEX.buffer_added.connect(self._on_buffer_added)
+        BUFFER_INDEX.buffer_removed.connect(self._on_buffer_removed)
+        BUFFER_INDEX.buffer_changed.connect(self._on_buffer_changed)
+        BUFFER_INDEX.buffer_used.connect(self._on_buffer_changed)
+        hooks.webbuffer_current_changed.add(self._on_changed)
+        hooks.window_activated.add(self._on_changed)
+        hooks.window_closed.add(self._on_changed)
+
+    def stop(self):
+        """
+        Stop recording the changes. The pending changes are lost, use
+        session_save to write the session.
+        """
+        if not self._started:
+            return
+        self._started = False
+        self._timer.stop()
+        restore_started.remove_if_exists(self._on_restore_started)
+        placeholder_discarded.remove_if_exists(self._on_buffer_removed)
+        BUFFER_INDEX.buffer_added.disconnect(self._on_buffer_added)
+        BUFFER_INDEX.buffer_removed.disconnect(self._on_buffer_removed)
+        BUFFER_INDEX.buffer_changed.disconnect(self._on_buffer_changed)
+        BUFFER_INDEX.buffer_used.disconnect(self._on_buffer_changed)
+        hooks.webbuffer_current_changed.remove_if_exists(self._on_changed)
+        hooks.window_activated.remove_if_exists(self._on_changed)
+        hooks.window_closed.remove_if_exists(self._on_changed)
+        self._writer.close()
+
+    def _snapshot(self):
+        data = _session_data()
+        self._writer.write_snapshot(data)
+        self._buffers = list(session_entries())
+        self._operations = []
+        self._inserted.clear()
+        self._dirty.clear()
+        self._windows = {k: data[k] for k in ("windows", "current-window")}
+        self._need_snapshot = False
+
+    def _on_changed(self, *args):
+        interval = session_autosave_interval.value
+        if interval and not self._timer.isActive():
+            self._timer.start(interval * 1000)
+
+    def _on_restore_started(self):
+        # a session is restored (restore-session) over the previous one: its
+        # entries replace the recorded ones, and a snapshot is written at the
+        # next save.
+        self._buffers = list(session_entries())
+        self._operations = []
+        self._inserted.clear()
+        self._dirty.clear()
+        self._need_snapshot = True
+        self._on_changed()
+
+    @Slot(object)
+    def _on_buffer_added(self, buffer):
+        placeholder = restoring_placeholder()
+        if placeholder is not None:
+            # a buffer of the session is restored, its state is saved
+            self._buffers[self._buffers.index(placeholder)] = buffer
+            return
+        index = _entry_index(self._buffers, buffer)
+        self._buffers.insert(index, buffer)
+        # the state is only known once saved, as the buffer is not yet
+        # initialized
+        self._operations.append({"op": "insert", "index": index,
+                                 "buffer": buffer})
+        self._inserted.add(buffer)
+        self._on_changed()
+
+    @Slot(object)
+    def _on_buffer_removed(self, buffer):
+        index = self._buffers.index(buffer)
+        del self._buffers[index]
+        self._operations.append({"op": "remove", "index": index})
+        self._inserted.discard(buffer)
+        self._dirty.pop(buffer, None)
+        self._on_changed()
+
+    @Slot(object)
+    def _on_buffer_changed(self, buffer):
+        if buffer not in self._inserted:
+            self._dirty[buffer] = None
+        self._on_changed()
+
+    def _pending_operations(self):
+        operations = []
+        for op in self._operations:
+            buffer = op.get("buffer")
+            if buffer is not None:
+                # an empty state if the buffer has been removed since, a
+                # remove operation follows.
+                state = _buffer_state(buffer) if buffer in self._inserted \
+                    else {"url": "", "title": "", "last_use": 0}
+                op = dict(op, buffer=state)
+            operations.append(op)
+
+        if self._dirty:
+            positions = {b: i for i, b in enumerate(self._buffers)}
+            for buffer in self._dirty:
+                operations.append({"op": "update",
+                                   "index": positions[buffer],
+                                   "buffer": _buffer_state(buffer)})
+
+        state = _windows_state()
+        if state != self._windows:
+            self._windows = state
+            operations.append(dict(state, op="windows"))
+        return operations
+
+    @Slot()
+    def save(self):
+        """
+        Write the pending changes in the journal, or a full snapshot if the
+        journal is too long.
+        """
+        if not self._started:
+            return
+        try:
+            operations = self._pending_operations()
+            self._operations = []
+            self._inserted.clear()
+            self._dirty.clear()
+            if self._need_snapshot or self._writer.journal_size \
+               + len(operations) > max(100, 2 * len(self._buffers)):
+                self._snapshot()
+            else:
+                self._writer.append(operations)
+        except Exception:
+            logging.exception("Unable to save the session in %s.",
+                              self._writer.session_file)
+            # the journal may be incomplete
+            self._need_snapshot = True
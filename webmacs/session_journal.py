@@ -0,0 +1,244 @@
+# This file is part of webmacs.
+#
+# webmacs is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# webmacs is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Crash safe storage of the session.
+
+The session is stored as a full snapshot (the session file, a json
+document), and an append-only journal of the changes made since that
+snapshot (the session file name followed by ".journal", one json object per
+line).
+
+The snapshot has a "generation" (a random identifier), also written in the
+first line of the journal: a journal is only replayed on the snapshot of the
+same generation. So writing a new snapshot (through a temporary file renamed
+over the old one) and then starting a new journal is safe at any point: a
+crash in between leaves a snapshot with an old journal, that is ignored.
+
+A crash while appending to the journal may leave a truncated last line,
+that is ignored too.
+
+The navigation history of the buffers (binary data, see
+WebBuffer.history_data) is stored in a sidecar file named after the
+generation of the snapshot, where the histories are appended as the journal
+is. The buffers of the session data refer to their history with its offset
+and size in that file. The sidecar is only read when the session is loaded,
+the histories are then restored by the buffers when first shown.
+"""
+
+import glob
+import json
+import logging
+import os
+import tempfile
+import uuid
+
+
+def journal_path(session_file):
+    return session_file + ".journal"
+
+
+def history_path(session_file, generation):
+    return "%s.%s.history" % (session_file, generation)
+
+
+def write_atomic(path, text):
+    """
+    Write the text in the given path, through a temporary file renamed once
+    complete.
+    """
+    dirname, basename = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix=basename + ".", suffix=".tmp",
+                               dir=dirname or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _check_index(urls, index, end):
+    if not 0 <= index < len(urls) + end:
+        raise IndexError("Session journal index %r out of range" % index)
+    return index
+
+
+def apply_operation(data, op):
+    """
+    Apply one journal operation on the session data. The data is left
+    unchanged if the operation can not be applied (IndexError, KeyError,
+    ValueError or TypeError is raised then).
+    """
+    kind = op["op"]
+    urls = data["urls"]
+    if kind == "insert":
+        urls.insert(_check_index(urls, op["index"], 1), op["buffer"])
+    elif kind == "remove":
+        del urls[_check_index(urls, op["index"], 0)]
+    elif kind == "update":
+        urls[_check_index(urls, op["index"], 0)] = op["buffer"]
+    elif kind == "windows":
+        windows, current = op["windows"], op["current-window"]
+        data["windows"] = windows
+        data["current-window"] = current
+    else:
+        raise ValueError("Unknown session journal operation %r" % kind)
+
+
+def replay_journal(data, lines):
+    """
+    Apply the journal lines on the session data of a snapshot, if the
+    journal belongs to it. Returns the number of applied operations.
+    """
+    lines = iter(lines)
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, ValueError):
+        return 0
+    if header.get("generation") != data.get("generation"):
+        return 0
+
+    count = 0
+    for line in lines:
+        try:
+            op = json.loads(line)
+        except ValueError:
+            # a write interrupted by a crash, this must be the last line
+            logging.warning("Ignoring a truncated session journal entry.")
+            break
+        try:
+            apply_operation(data, op)
+        except (IndexError, KeyError, ValueError, TypeError):
+            # the next operations depend on this one, the session is kept
+            # as it was before it.
+            logging.warning("Ignoring the session journal from an invalid"
+                            " entry: %s", line.strip())
+            break
+        count += 1
+    return count
+
+
+def read_session(session_file):
+    """
+    Returns the session data: the snapshot with its journal applied.
+    """
+    with open(session_file, "r") as f:
+        data = json.load(f)
+    try:
+        with open(journal_path(session_file), "r") as f:
+            replay_journal(data, f)
+    except FileNotFoundError:
+        pass
+    _read_histories(session_file, data)
+    return data
+
+
+def _read_histories(session_file, data):
+    histories = b""
+    if "generation" in data:
+        try:
+            with open(history_path(session_file, data["generation"]),
+                      "rb") as f:
+                histories = f.read()
+        except FileNotFoundError:
+            pass
+    for url in data["urls"]:
+        if isinstance(url, dict) and url.get("history"):
+            offset, size = url["history"]
+            history = histories[offset:offset + size]
+            url["history"] = history if len(history) == size else None
+
+
+class SessionWriter(object):
+    """
+    Write the session snapshots, and append operations to the journal.
+    """
+
+    def __init__(self, session_file):
+        self.session_file = session_file
+        self.generation = None
+        # number of operations in the current journal
+        self.journal_size = 0
+        self._journal = self._histories = None
+
+    def write_snapshot(self, data):
+        """
+        Write a full snapshot of the session data, and start a new journal.
+        """
+        self.close()
+        self.generation = uuid.uuid4().hex
+        history_file = history_path(self.session_file, self.generation)
+        with open(history_file, "wb") as f:
+            urls = [self._write_history(f, url) for url in data["urls"]]
+            f.flush()
+            os.fsync(f.fileno())
+        data = dict(data, urls=urls, generation=self.generation)
+        write_atomic(self.session_file, json.dumps(data))
+        write_atomic(journal_path(self.session_file),
+                     json.dumps({"generation": self.generation}) + "\n")
+        self.journal_size = 0
+
+        # the histories of the previous snapshots are not used anymore
+        for path in glob.glob(glob.escape(self.session_file) + ".*.history"):
+            if path != history_file:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _write_history(self, f, url):
+        history = url.get("history")
+        if not history:
+            return dict(url, history=None)
+        offset = f.tell()
+        f.write(history)
+        return dict(url, history=[offset, len(history)])
+
+    def append(self, operations):
+        """
+        Append the operations to the journal, a write call for all of them.
+        """
+        if not operations:
+            return
+        if self._journal is None:
+            self._histories = open(
+                history_path(self.session_file, self.generation), "ab")
+            self._journal = open(journal_path(self.session_file), "a")
+        operations = [
+            dict(op, buffer=self._write_history(self._histories, op["buffer"]))
+            if "buffer" in op else op
+            for op in operations
+        ]
+        # the histories must be on disk before the journal refers to them
+        self._histories.flush()
+        os.fsync(self._histories.fileno())
+        self._journal.write("".join(json.dumps(op) + "\n"
+                                    for op in operations))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.journal_size += len(operations)
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._histories.close()
+            self._journal = self._histories = None
@@ -14,8 +14,17 @@
 # along with webmacs.  If not, see <http://www.gnu.org/licenses/>.
 
 import sqlite3
+import logging
+import itertools
+import threading
+import queue
+import time
 from datetime import datetime
-from . import variables
+
+from PyQt6.QtCore import QTimer, QThreadPool, pyqtSlot as Slot
+
+from . import variables, hooks, BUFFERS
+from .task import Task
 
 
 visited_links_display_limit = variables.define_variable(
@@ -26,29 +35,536 @@ visited_links_display_limit = variables.define_variable(
     type=variables.Int(min=1)
 )
 
+visited_links_search_limit = variables.define_variable(
+    "visited-links-search-limit",
+    "Limit the number of history elements found when searching in the"
+    " visited-links-history command.",
+    200,
+    type=variables.Int(min=1)
+)
+
+visited_links_max_age = variables.define_variable(
+    "visited-links-max-age",
+    "Number of days after which a visited link is removed from the history."
+    " Links visited often are kept up to 30 more days. 0 to keep the"
+    " history forever.",
+    365,
+    type=variables.Int(min=0)
+)
+
+visited_links_flush_interval = variables.define_variable(
+    "visited-links-flush-interval",
+    "Delay in milliseconds before the visited links are written on disk."
+    " The visits made during that delay are written at once.",
+    2000,
+    type=variables.Int(min=0)
+)
+
+
+# The frecency of a link is the day of its last visit (as a julian day),
+# plus a bonus of up to 30 days for the links visited often. It does not
+# depend on the current time, so it can be stored and indexed.
+FRECENCY = "julianday({lastseen}) + 30.0 * ({visits}) / (({visits}) + 10)"
+
+
+# the schema migrations (sql scripts), the database version (user_version)
+# being the number of migrations applied.
+MIGRATIONS = (
+    # 1: visits counting and frecency
+    """
+    ALTER TABLE visitedlinks ADD COLUMN firstseen DATE;
+    ALTER TABLE visitedlinks ADD COLUMN visits INTEGER NOT NULL DEFAULT 1;
+    ALTER TABLE visitedlinks ADD COLUMN frecency REAL NOT NULL DEFAULT 0;
+    UPDATE visitedlinks SET firstseen = lastseen, frecency = {};
+    CREATE INDEX visitedlinks_lastseen ON visitedlinks (lastseen DESC);
+    CREATE INDEX visitedlinks_frecency ON visitedlinks (frecency DESC);
+    """.format(FRECENCY.format(lastseen="lastseen", visits="visits")),
+)
+
+
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, script in enumerate(MIGRATIONS[version:], version + 1):
+        logging.info("Migrating the visited links database to version %d",
+                     number)
+        try:
+            conn.executescript("BEGIN;\n%s\nPRAGMA user_version = %d;\n"
+                               "COMMIT;" % (script, number))
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+
+def _write(conn, batch):
+    """
+    Write a batch of changes, a dict of {url: (title, lastseen, visits)}
+    where a None value means the url is removed, in one transaction.
+    """
+    with conn:
+        conn.executemany("""
+        INSERT INTO visitedlinks
+            (url, title, lastseen, firstseen, visits, frecency)
+        VALUES (:url, :title, :lastseen, :lastseen, :visits, {})
+        ON CONFLICT (url) DO UPDATE SET
+            title = excluded.title,
+            lastseen = excluded.lastseen,
+            visits = visits + excluded.visits,
+            frecency = {}
+        """.format(
+            FRECENCY.format(lastseen=":lastseen", visits=":visits"),
+            FRECENCY.format(lastseen="excluded.lastseen",
+                            visits="visits + excluded.visits"),
+        ), ({"url": url, "title": visit[0], "lastseen": visit[1],
+             "visits": visit[2]}
+            for url, visit in batch.items() if visit is not None))
+        conn.executemany("""
+        DELETE from visitedlinks WHERE url = ?
+        """, ((url,) for url, visit in batch.items() if visit is None))
+
+
+def _create_search_index(conn):
+    """
+    Create the full text index over the url and title of the visited links,
+    kept up to date with triggers. Returns False if the sqlite library does
+    not support FTS5.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'visitedlinks_fts'"
+    ).fetchone()
+    if exists:
+        return True
+    try:
+        conn.executescript("""
+        BEGIN;
+        CREATE VIRTUAL TABLE visitedlinks_fts USING fts5(
+            url, title, content='visitedlinks', prefix='2 3'
+        );
+        CREATE TRIGGER visitedlinks_ai AFTER INSERT ON visitedlinks BEGIN
+            INSERT INTO visitedlinks_fts (rowid, url, title)
+            VALUES (new.rowid, new.url, new.title);
+        END;
+        CREATE TRIGGER visitedlinks_ad AFTER DELETE ON visitedlinks BEGIN
+            INSERT INTO visitedlinks_fts (visitedlinks_fts, rowid, url, title)
+            VALUES ('delete', old.rowid, old.url, old.title);
+        END;
+        CREATE TRIGGER visitedlinks_au AFTER UPDATE OF url, title
+        ON visitedlinks BEGIN
+            INSERT INTO visitedlinks_fts (visitedlinks_fts, rowid, url, title)
+            VALUES ('delete', old.rowid, old.url, old.title);
+            INSERT INTO visitedlinks_fts (rowid, url, title)
+            VALUES (new.rowid, new.url, new.title);
+        END;
+        INSERT INTO visitedlinks_fts (visitedlinks_fts) VALUES ('rebuild');
+        COMMIT;
+        """)
+    except sqlite3.OperationalError:
+        conn.rollback()
+        logging.warning("sqlite has no FTS5 support, the history will be"
+                        " searched without index")
+        return False
+    return True
+
+
+def _has_tokens(word):
+    """
+    Returns True if the FTS5 tokenizer finds a token in the word: it is made
+    of the letters and digits, the other characters being separators.
+    """
+    return any(c.isalnum() for c in word)
+
+
+def _match_query(text):
+    """
+    Convert the text typed by the user to a FTS5 query: each word is a
+    prefix, and all the words must match.
+    """
+    return " ".join('"%s"*' % word.replace('"', '""')
+                    for word in text.split())
+
+
+def _matches_words(url, title, words):
+    """
+    Returns True if all the words are in the url or the title, ignoring the
+    case, like the search without index does.
+    """
+    text = ("%s %s" % (url, title or "")).lower()
+    return all(word.lower() in text for word in words)
+
+
+class _Writer(threading.Thread):
+    """
+    Write the batches of visited links on its own connection, so the gui
+    thread never waits for sqlite.
+
+    A batch that can not be written (the database being locked by another
+    webmacs instance for too long for example) is tried again a few times,
+    after an increasing delay. The batches not yet written are kept in
+    :attr:`unwritten`, to be searched in.
+    """
+    # in seconds, the time to wait for a database lock
+    TIMEOUT = 60
+    # the number of tries of a batch, and the maximum delay between them in
+    # seconds
+    TRIES = 10
+    MAX_RETRY_DELAY = 60
+
+    def __init__(self, dbpath):
+        threading.Thread.__init__(self, name="visitedlinks-writer",
+                                  daemon=True)
+        self.dbpath = dbpath
+        self.queue = queue.Queue()
+        # the batches given to the writer and not yet written, the oldest
+        # first
+        self.unwritten = []
+        self.lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def submit(self, batch):
+        with self.lock:
+            self.unwritten.append(batch)
+        self.queue.put(batch)
+
+    def stop(self):
+        """
+        Stop the thread once the batches are written, giving up the retries.
+        """
+        self._stopping.set()
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        conn = None
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                self.queue.task_done()
+                break
+            try:
+                if conn is None:
+                    conn = sqlite3.connect(self.dbpath, timeout=self.TIMEOUT)
+                self._write(conn, batch)
+            except Exception:
+                # the thread must go on, flush(wait=True) waits for it
+                logging.exception("Unable to write %d visited links, they"
+                                  " are lost", len(batch))
+            finally:
+                with self.lock:
+                    self.unwritten.pop(0)
+                self.queue.task_done()
+        if conn is not None:
+            conn.close()
+
+    def _write(self, conn, batch):
+        delay = 1
+        for tries in range(1, self.TRIES + 1):
+            try:
+                _write(conn, batch)
+                return
+            except sqlite3.Error:
+                if tries == self.TRIES or self._stopping.is_set():
+                    raise
+                logging.warning("Unable to write the visited links, trying"
+                                " again in %d seconds", delay, exc_info=True)
+            # interrupted on stop, for a last try
+            self._stopping.wait(delay)
+            delay = min(delay * 2, self.MAX_RETRY_DELAY)
+
 
 class VisitedLinks(object):
     def __init__(self, dbbath):
+        self.path = dbbath
         self._conn = sqlite3.connect(dbbath)
+        self._writer = None
+        # only effective for a new database, see
+        # VisitedLinksMaintenanceTask._compact
+        self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if dbbath != ":memory:":
+            # readers do not block the writer and the other way around
+            self._conn.execute("PRAGMA journal_mode=WAL")
         self._conn.execute("""
         CREATE TABLE IF NOT EXISTS visitedlinks
         (url TEXT PRIMARY KEY, title TEXT, lastseen DATE);
         """)
+        self._conn.commit()
+        _migrate(self._conn)
+        self._fts = _create_search_index(self._conn)
+        if dbbath != ":memory:":
+            self._writer = _Writer(dbbath)
+            self._writer.start()
+
+        # changes not yet given to the writer, coalesced by url
+        self._pending = {}
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+
+    def _schedule(self, url, visit):
+        self._pending[url] = visit
+        if not self._timer.isActive():
+            self._timer.start(visited_links_flush_interval.value)
 
     def visit(self, url, title):
-        self._conn.execute("""
-        INSERT OR REPLACE INTO visitedlinks (url, title, lastseen)
-        VALUES (?, ?, ?)
-        """, (url, title, datetime.now()))
-        self._conn.commit()
+        pending = self._pending.get(url)
+        visits = pending[2] + 1 if pending else 1
+        self._schedule(url, (title, datetime.now(), visits))
+
+    def flush(self, wait=False):
+        """
+        Write the pending changes. This is asynchronous, unless wait is True.
+        """
+        self._timer.stop()
+        batch, self._pending = self._pending, {}
+        if self._writer is None:
+            if batch:
+                _write(self._conn, batch)
+            return
+        if batch:
+            self._writer.submit(batch)
+        if wait:
+            self._writer.queue.join()
+
+    def close(self):
+        """
+        Write the pending changes and stop the writer thread.
+        """
+        self.flush()
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+
+    def _unwritten(self):
+        """
+        Returns the changes not yet written in the database, as a dict of
+        {url: (title, lastseen, visits)} where a None value means the url is
+        removed.
+        """
+        changes = {}
+        if self._writer is not None:
+            with self._writer.lock:
+                for batch in self._writer.unwritten:
+                    changes.update(batch)
+        changes.update(self._pending)
+        return changes
+
+    def _with_unwritten(self, rows, words, limit):
+        """
+        Returns an iterator over the visited links (url, title) of the
+        database rows, preceded by the links visited but not yet written
+        matching the words: they were just visited, so they are the most
+        recent and frecent ones.
+        """
+        changes = self._unwritten()
+        if not changes:
+            return rows
+        visited = sorted(
+            ((url, visit) for url, visit in changes.items()
+             if visit is not None and _matches_words(url, visit[0], words)),
+            key=lambda item: item[1][1], reverse=True)
+        return itertools.islice(itertools.chain(
+            ((url, visit[0]) for url, visit in visited),
+            (row for row in rows if row[0] not in changes),
+        ), limit)
 
     def visited_urls(self):
-        return [(row[0], row[1]) for row in self._conn.execute(
+        return list(self._visited_urls())
+
+    def _visited_urls(self):
+        limit = visited_links_display_limit.value
+        return self._with_unwritten(self._conn.execute(
             "select url, title from visitedlinks order by lastseen DESC"
-            " LIMIT %d" % visited_links_display_limit.value
-        )]
+            " LIMIT %d" % limit
+        ), (), limit)
+
+    def search(self, text):
+        """
+        Returns an iterator over the visited links (url, title) matching
+        all the words of the text, the best ones first: by frecency, with a
+        bonus for relevance. Without text, the most recent links are
+        returned.
+
+        The visits not yet written in the database are included, without
+        waiting for the writer.
+        """
+        if not text.strip():
+            return self._visited_urls()
+        words = text.split()
+        limit = visited_links_search_limit.value
+        # a word without token (like "/") matches no row in the index
+        if not self._fts or not all(_has_tokens(w) for w in words):
+            rows = self._conn.execute(
+                "SELECT url, title FROM visitedlinks WHERE "
+                + " AND ".join(["(url || ' ' || ifnull(title, '')) LIKE ?"]
+                               * len(words))
+                + " ORDER BY frecency DESC LIMIT %d" % limit,
+                ["%" + w + "%" for w in words]
+            )
+        else:
+            # bm25 is negative, the lower the better; a relevant match
+            # counts as a few more days of frecency.
+            rows = self._conn.execute("""
+            SELECT v.url, v.title FROM visitedlinks_fts
+            JOIN visitedlinks v ON v.rowid = visitedlinks_fts.rowid
+            WHERE visitedlinks_fts MATCH ?
+            ORDER BY v.frecency - bm25(visitedlinks_fts, 1.0, 2.0) DESC
+            LIMIT %d
+            """ % limit, (_match_query(text),))
+        return self._with_unwritten(rows, words, limit)
 
     def remove(self, url):
-        self._conn.execute("""
-        DELETE from visitedlinks WHERE url = ?
-        """, (url,))
+        self._schedule(url, None)
+
+
+class VisitedLinksMaintenanceTask(Task):
+    """
+    Expire the old visited links, then compact and optimize the database.
+
+    It starts once webmacs is idle: when no page is loading and there was no
+    user input for some time. The work is done in a thread of the
+    QThreadPool with its own connection, in small transactions, so the
+    visited links writer never waits for long.
+    """
+    description = "visited links maintenance"
+    # in seconds, the time without user input after which webmacs is idle
+    IDLE_TIME = 60
+    # rows deleted, or pages freed, by transaction
+    CHUNK = 500
+
+    def __init__(self, dbpath):
+        Task.__init__(self)
+        self.dbpath = dbpath
+        self.stats = {}
+        self.__aborted = False
+        self.__thread_running = False
+        # the buffers loading a page
+        self.__loading = set()
+        self.__watching = False
+        self.__timer = QTimer()
+        self.__timer.setSingleShot(True)
+        self.__timer.timeout.connect(self._start_thread)
+
+    def start(self):
+        self.__watching = True
+        for buffer in BUFFERS:
+            self._watch(buffer)
+        hooks.webbuffer_created.add(self._watch)
+        hooks.webbuffer_load_finished.add(self._on_load_finished)
+        hooks.webbuffer_closed.add(self._on_load_finished)
+        hooks.user_input.add(self._on_user_input)
+        self.__timer.start(self.IDLE_TIME * 1000)
+
+    def _stop_watching(self):
+        if not self.__watching:
+            return
+        self.__watching = False
+        hooks.user_input.remove_if_exists(self._on_user_input)
+        hooks.webbuffer_created.remove_if_exists(self._watch)
+        hooks.webbuffer_load_finished.remove_if_exists(self._on_load_finished)
+        hooks.webbuffer_closed.remove_if_exists(self._on_load_finished)
+        for buffer in BUFFERS:
+            try:
+                buffer.loadStarted.disconnect(self._on_load_started)
+            except TypeError:
+                pass
+        self.__loading.clear()
+
+    def _watch(self, buffer):
+        buffer.loadStarted.connect(self._on_load_started)
+
+    @Slot()
+    def _on_load_started(self):
+        self.__loading.add(self.sender())
+        self.__timer.stop()
+
+    def _on_load_finished(self, buffer):
+        self.__loading.discard(buffer)
+        if not self.__loading:
+            self.__timer.start(self.IDLE_TIME * 1000)
+
+    def _on_user_input(self, event):
+        if not self.__loading:
+            # webmacs is not idle, wait again
+            self.__timer.start(self.IDLE_TIME * 1000)
+
+    def _start_thread(self):
+        self._stop_watching()
+        self.__thread_running = True
+        QThreadPool.globalInstance().start(self._run)
+
+    def _run(self):
+        try:
+            self._maintain()
+        except Exception as exc:
+            logging.exception("Unable to maintain the visited links")
+            self.set_error(str(exc))
+        self.__thread_running = False
+        self.finished.emit()
+
+    def _size(self, conn):
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        return page_size * pages
+
+    def _expire(self, conn):
+        max_age = visited_links_max_age.value
+        deleted = 0
+        while max_age and not self.__aborted:
+            with conn:
+                count = conn.execute("""
+                DELETE FROM visitedlinks WHERE rowid IN (
+                    SELECT rowid FROM visitedlinks
+                    WHERE frecency < julianday('now', 'localtime') - ?
+                    LIMIT ?
+                )
+                """, (max_age, self.CHUNK)).rowcount
+            deleted += count
+            if count < self.CHUNK:
+                break
+            # let the writer get the database lock
+            time.sleep(0.01)
+        return deleted
+
+    def _compact(self, conn):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # the databases created before the incremental vacuum are not
+            # converted: it requires a full VACUUM, locking the database
+            # for as long as it rewrites it. Their free pages are reused by
+            # the new visited links.
+            return
+        while not self.__aborted \
+                and conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            # run to completion: a cursor only frees one page per step
+            conn.executescript("PRAGMA incremental_vacuum(%d);"
+                               % self.CHUNK)
+            time.sleep(0.01)
+
+    def _maintain(self):
+        start = time.perf_counter()
+        conn = sqlite3.connect(self.dbpath, timeout=10)
+        try:
+            size = self._size(conn)
+            deleted = self._expire(conn)
+            expire_time = time.perf_counter() - start
+            if not self.__aborted:
+                self._compact(conn)
+                conn.execute("PRAGMA optimize")
+            self.stats = {
+                "deleted": deleted,
+                "size_before": size,
+                "size_after": self._size(conn),
+                "expire_time": expire_time,
+                "total_time": time.perf_counter() - start,
+            }
+        finally:
+            conn.close()
+        logging.info(
+            "visited links: %(deleted)d expired, size %(size_before)d ->"
+            " %(size_after)d bytes, in %(total_time).3fs (expiration"
+            " %(expire_time).3fs)", self.stats)
+
+    def abort(self):
+        self.__timer.stop()
+        self._stop_watching()
+        self.__aborted = True
+        # wait for any thread to join
+        if self.__thread_running:
+            QThreadPool.globalInstance().waitForDone(1000)
@@ -16,17 +16,20 @@
 import logging
 import time
 import json
+import zlib
 
-from PyQt6.QtCore import QUrl, pyqtSlot as Slot
+from PyQt6.QtCore import QUrl, QByteArray, QDataStream, QIODevice, \
+    pyqtSlot as Slot
 from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineScript
 from PyQt6.QtWebChannel import QWebChannel
 from collections import namedtuple
 
 from . import hooks, variables, windows
 from . import BUFFERS, current_minibuffer, minibuffer_show_info, \
-    current_buffer, call_later, current_window, recent_buffers
+    current_buffer, call_later, current_window, recent_buffers, BUFFER_INDEX
 from .content_handler import WebContentHandler
 from .application import app
+from .adblock import CosmeticFilters
 from .minibuffer.prompt import YesNoPrompt, AskPasswordPrompt
 from .password_manager import PasswordManagerNotReady
 from .keyboardhandler import LOCAL_KEYMAP_SETTER
@@ -45,8 +48,12 @@ close_buffer_close_window = variables.define_variable(
 )
 
 
-# a tuple of QUrl, str to delay loading of a page.
-DelayedLoadingUrl = namedtuple("DelayedLoadingUrl", ("url", "title"))
+# a tuple of QUrl, str to delay loading of a page, and optionally the
+# navigation history to restore (as returned by WebBuffer.history_data) and
+# the scroll position (x, y) to restore once loaded.
+DelayedLoadingUrl = namedtuple("DelayedLoadingUrl",
+                               ("url", "title", "history", "scroll"))
+DelayedLoadingUrl.__new__.__defaults__ = (None, None)
 
 
 def close_buffer(wb):
@@ -107,17 +114,21 @@ class WebBuffer(QWebEnginePage):
         JSMessageLevel.ErrorMessageLevel: logging.ERROR,
     }
 
-    def __init__(self, url=None):
+    def __init__(self, url=None, position=None):
         """
         Create a webbuffer.
 
         :param url: the url to use for the buffer. Must be an instance of QUrl,
             an str or None to not load any url.
+        :param position: the index of the buffer in BUFFERS. By default,
+            the buffer is inserted after the current buffer.
         """
         QWebEnginePage.__init__(self, app().profile.q_profile, None)
-        self.last_use = time.time()
+        self.__last_use = time.time()
         cb = current_buffer()
-        if cb:
+        if position is not None:
+            BUFFERS.insert(position, self)
+        elif cb:
             BUFFERS.insert(BUFFERS.index(cb) + 1, self)
         else:
             BUFFERS.append(self)
@@ -137,6 +148,7 @@ class WebBuffer(QWebEnginePage):
         self.linkHovered.connect(self.on_url_hovered)
         self.titleChanged.connect(self.__on_title_changed)
         self.__delay_loading_url = None
+        self.__restore_scroll = None
         self.__keymap_mode = Mode.KEYMAP_NORMAL
         self.__mode = get_mode("standard-mode")
         self.__text_edit_mark = False
@@ -167,6 +179,15 @@ class WebBuffer(QWebEnginePage):
     def set_text_edit_mark(self, on):
         self.__text_edit_mark = on
 
+    @property
+    def last_use(self):
+        return self.__last_use
+
+    @last_use.setter
+    def last_use(self, value):
+        self.__last_use = value
+        BUFFER_INDEX.update_last_use(self)
+
     def set_mode(self, modename):
         if self.__mode.name == modename:
             return
@@ -183,6 +204,102 @@ class WebBuffer(QWebEnginePage):
     def delayed_loading_url(self):
         return self.__delay_loading_url
 
+    def load_delayed_url(self):
+        """
+        Load the delayed url, restoring its navigation history if any.
+        """
+        delayed = self.__delay_loading_url
+        if self.lifecycleState() != QWebEnginePage.LifecycleState.Active:
+            # hibernated
+            self.setLifecycleState(QWebEnginePage.LifecycleState.Active)
+        self.__restore_scroll = delayed.scroll
+        if delayed.history:
+            try:
+                self.restore_history(delayed.history)
+                return
+            except zlib.error:
+                logging.exception("Unable to restore the history of %s",
+                                  delayed.url.toString())
+        self.load(delayed.url)
+
+    def hibernate(self):
+        """
+        Release the renderer of the page, turning the buffer into a delayed
+        loading url that keeps its navigation history and scroll position.
+        It is then loaded again when displayed.
+
+        Returns False if the buffer can not be hibernated: it is displayed,
+        not loaded, or attached to dev tools.
+        """
+        if self.__delay_loading_url or self.isVisible() \
+           or self.devToolsPage() or self.inspectedPage():
+            return False
+        scroll = self.scrollPosition()
+        self.__delay_loading_url = DelayedLoadingUrl(
+            url=self.url(),
+            title=self.title(),
+            history=self.history_data(),
+            scroll=(scroll.x(), scroll.y()),
+        )
+        self.setLifecycleState(QWebEnginePage.LifecycleState.Discarded)
+        return True
+
+    def freeze(self):
+        """
+        Freeze the page of a buffer not displayed: its javascript timers and
+        rendering are stopped, until thawed.
+
+        Returns False if the buffer can not be frozen safely: it is
+        displayed, not loaded, or Qt recommends to keep it active (it plays
+        audio, is attached to dev tools, ...).
+        """
+        state = QWebEnginePage.LifecycleState
+        if self.__delay_loading_url or self.isVisible() \
+           or self.lifecycleState() != state.Active \
+           or self.recommendedState() == state.Active:
+            return False
+        self.setLifecycleState(state.Frozen)
+        return True
+
+    def thaw(self):
+        """
+        Make a frozen page active again.
+        """
+        if self.lifecycleState() == QWebEnginePage.LifecycleState.Frozen:
+            self.setLifecycleState(QWebEnginePage.LifecycleState.Active)
+
+    def can_discard(self):
+        """
+        Returns True if Qt considers the page can be discarded (hibernated)
+        without losing anything, like a form input.
+        """
+        return self.recommendedState() \
+            == QWebEnginePage.LifecycleState.Discarded
+
+    def history_data(self):
+        """
+        Returns the navigation history, serialized and compressed, as bytes.
+
+        The history of a buffer not loaded yet is the one it will restore,
+        possibly None.
+        """
+        if self.__delay_loading_url:
+            return self.__delay_loading_url.history
+        data = QByteArray()
+        stream = QDataStream(data, QIODevice.OpenModeFlag.WriteOnly)
+        stream << self.history()
+        return zlib.compress(bytes(data), 1)
+
+    def restore_history(self, data):
+        """
+        Restore the navigation history given by history_data, loading its
+        current item.
+        """
+        data = QByteArray(zlib.decompress(data))
+        self.__delay_loading_url = None
+        stream = QDataStream(data, QIODevice.OpenModeFlag.ReadOnly)
+        stream >> self.history()
+
     def url(self):
         if self.__delay_loading_url:
             return self.__delay_loading_url.url
@@ -197,6 +314,21 @@ class WebBuffer(QWebEnginePage):
     def content_handler(self):
         return self._content_handler
 
+    def acceptNavigationRequest(self, url, type, is_main_frame):
+        if is_main_frame:
+            self._update_cosmetic_filters(url.host())
+        return QWebEnginePage.acceptNavigationRequest(self, url, type,
+                                                      is_main_frame)
+
+    def _update_cosmetic_filters(self, domain):
+        # replace the element hiding scripts of the previous domain before
+        # the new document is created.
+        scripts = self.scripts()
+        for script in scripts.find(CosmeticFilters.SCRIPT_NAME):
+            scripts.remove(script)
+        for script in app().url_interceptor().cosmetic_scripts(domain):
+            scripts.insert(script)
+
     def javaScriptConsoleMessage(self, level, message, lineno, source):
         logger = self.LOGGER
         # small speed improvement, avoid to log if unnecessary
@@ -307,6 +439,10 @@ class WebBuffer(QWebEnginePage):
 
         self.set_mode(get_auto_modename_for_url(self.url().toString()))
 
+        if self.__restore_scroll:
+            self.set_scroll_pos(*self.__restore_scroll)
+            self.__restore_scroll = None
+
         hooks.webbuffer_load_finished(self)
 
         # We lose the keyboard focus without that with Qt 5.11. Though it
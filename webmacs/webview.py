@@ -85,6 +85,9 @@ class WebView(QFrame):
             self.main_window.update_title()
             return
 
+        # a frozen page can not be displayed
+        buffer.thaw()
+
         if buffer._internal_view is None:
             buffer._internal_view = InternalWebView(self)
             buffer._internal_view.setPage(buffer)
@@ -93,9 +96,8 @@ class WebView(QFrame):
 
         self._attach_view(buffer._internal_view)
 
-        url = buffer.delayed_loading_url()
-        if url:
-            buffer.load(url.url)
+        if buffer.delayed_loading_url():
+            buffer.load_delayed_url()
         self.main_window.update_title()
         LOCAL_KEYMAP_SETTER.buffer_opened_in_view(buffer)
         # mark the buffer to be the most recently opened
@@ -171,10 +171,10 @@ class Window(QWidget):
             "view-layout": self._webviews_layout.dump_state(),
         }
 
-    def restore_state(self, data, version):
+    def restore_state(self, data, version, get_buffer=None):
         self.setGeometry(QRect(*data["geometry"]))
         for e in Qt.WindowState:
             if e.value == data["window-state"]:
                 self.setWindowState(e)
                 break
-        self._webviews_layout.restore_state(data["view-layout"])
+        self._webviews_layout.restore_state(data["view-layout"], get_buffer)